@@ -3,9 +3,11 @@ import telebot
 
 from django.conf import settings
 
+from bot.outbound import RateLimitedTeleBot
+
 commands = settings.BOT_COMMANDS
 
-bot = telebot.TeleBot(
+bot = RateLimitedTeleBot(
     settings.BOT_TOKEN,
     threaded=False,
     skip_pending=True,
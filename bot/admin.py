@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, goods_category, goods, ProductImage, Support, FAQ, Instruction, SupportTicket, SupportMessage, OwnerSettings, BroadcastMessage, PromoCode, PromoCodeCategory, TypicalIssue, WarrantyRequest, WarrantyAnswer, SupportAnswer, ProductWarrantyQuestion, ProductSupportQuestion
+from .models import User, goods_category, goods, ProductImage, Support, FAQ, Instruction, SupportTicket, SupportMessage, OwnerSettings, BroadcastMessage, PromoCode, PromoCodeCategory, PromoCodeClaim, TypicalIssue, WarrantyRequest, WarrantyAnswer, SupportAnswer, ProductWarrantyQuestion, ProductSupportQuestion, ExtendedWarranty, ScreenshotFingerprint
 from django import forms
 from django.db import models
 
@@ -49,8 +49,14 @@ class PromoCodeCategoryForm(forms.ModelForm):
                 raise ValidationError('Шаблон должен содержать маркер {promocode} для вставки промокода')
         return template
 
+class ExtendedWarrantyInline(admin.TabularInline):
+    model = ExtendedWarranty
+    extra = 0
+    fields = ('product', 'name', 'warranty_period', 'purchase_date', 'end_date', 'status', 'screenshot_id')
+    readonly_fields = ('screenshot_id',)
+
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('telegram_id', 'user_name', 'phone_number', 'is_admin', 'is_super_admin', 'is_ozon_admin', 'is_wb_admin', 'is_ai', 'screenshots_count', 'last_screenshot_date')
+    list_display = ('telegram_id', 'user_name', 'phone_number', 'is_admin', 'is_super_admin', 'is_ozon_admin', 'is_wb_admin', 'is_ai', 'screenshots_today', 'last_screenshot_date')
     search_fields = ('user_name', 'phone_number', 'telegram_id')
     ordering = ('-telegram_id',)
     fieldsets = (
@@ -58,11 +64,16 @@ class UserAdmin(admin.ModelAdmin):
             'fields': (
                 'telegram_id', 'user_name', 'phone_number',
                 'is_admin', 'is_super_admin', 'is_ozon_admin', 'is_wb_admin',
-                'is_ai', 'chat_history', 'warranty_data', 'screenshots_count',
+                'is_ai', 'chat_history', 'screenshots_count',
                 'last_screenshot_date', 'messages_count', 'last_message_id'
             )
         }),
     )
+    inlines = [ExtendedWarrantyInline]
+
+    def screenshots_today(self, obj):
+        return obj.screenshots_today
+    screenshots_today.short_description = 'Скриншотов сегодня'
 
     def get_queryset(self, request):
         """Переопределяем метод для обработки ошибок при получении пользователей."""
@@ -124,7 +135,7 @@ class SupportTicketAdmin(admin.ModelAdmin):
     search_fields = ('user__user_name', 'subject')
     list_editable = ('status', 'assigned_admin')
     inlines = [SupportMessageInline]
-    readonly_fields = ('created_at', 'updated_at', 'closed_at', 'first_admin_notification_sent', 'second_admin_notification_sent', 'owner_notification_sent')
+    readonly_fields = ('created_at', 'updated_at', 'closed_at', 'first_admin_notification_sent', 'second_admin_notification_sent', 'owner_notification_sent', 'next_escalation_at')
     fieldsets = (
         (None, {
             'fields': ('user', 'platform', 'subject', 'status', 'assigned_admin')
@@ -134,7 +145,7 @@ class SupportTicketAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Уведомления', {
-            'fields': ('first_admin_notification_sent', 'second_admin_notification_sent', 'owner_notification_sent'),
+            'fields': ('first_admin_notification_sent', 'second_admin_notification_sent', 'owner_notification_sent', 'next_escalation_at'),
             'classes': ('collapse',)
         }),
     )
@@ -217,30 +228,28 @@ admin.site.register(User, UserAdmin)
 
 @admin.action(description="Отправить выбранную рассылку всем пользователям")
 def send_broadcast(modeladmin, request, queryset):
-    from django.utils import timezone
-    from bot import bot as telegram_bot
-    sent_count_total = 0
-    for msg in queryset:
-        if msg.is_sent:
-            continue
-        sent_count = 0
-        for u in User.objects.all():
-            try:
-                telegram_bot.send_message(u.telegram_id, msg.text)
-                sent_count += 1
-            except Exception:
-                continue
-        msg.is_sent = True
-        msg.sent_at = timezone.now()
-        msg.save()
-        sent_count_total += sent_count
-    modeladmin.message_user(request, f"Отправлено сообщений: {sent_count_total}")
+    # Отправка идет в фоне, прогресс - в колонках списка рассылок
+    from bot.broadcast import start_broadcast
+    started = 0
+    for msg in queryset.filter(status='draft', is_sent=False):
+        if start_broadcast(msg.id):
+            started += 1
+    modeladmin.message_user(request, f"Запущено рассылок: {started}")
+
+
+@admin.action(description="Остановить выбранные рассылки")
+def cancel_broadcast(modeladmin, request, queryset):
+    from bot.broadcast import cancel_broadcast as cancel
+    cancelled = sum(1 for msg in queryset if cancel(msg.id))
+    modeladmin.message_user(request, f"Остановлено рассылок: {cancelled}")
 
 
 class BroadcastMessageAdmin(admin.ModelAdmin):
-    list_display = ("title", "is_sent", "created_at", "sent_at")
-    list_filter = ("is_sent", "created_at")
-    actions = [send_broadcast]
+    list_display = ("title", "status", "total_count", "sent_count", "failed_count", "created_at", "sent_at")
+    list_filter = ("status", "is_sent", "created_at")
+    readonly_fields = ("status", "total_count", "sent_count", "failed_count", "last_user_id",
+                       "started_at", "heartbeat_at", "sent_at", "is_sent", "report_chat_id", "report_message_id")
+    actions = [send_broadcast, cancel_broadcast]
 
 
 admin.site.register(BroadcastMessage, BroadcastMessageAdmin)
@@ -252,12 +261,20 @@ class PromoCodeInline(admin.TabularInline):
     fields = ('code', 'is_active', 'is_used')
 
 
+@admin.action(description="Пересчитать остаток промокодов")
+def refresh_promocode_counts(modeladmin, request, queryset):
+    from bot.promo import refresh_available_counts
+    refreshed = refresh_available_counts(queryset.values_list('id', flat=True))
+    modeladmin.message_user(request, f"Пересчитано категорий: {refreshed}")
+
+
 class PromoCodeCategoryAdmin(admin.ModelAdmin):
     form = PromoCodeCategoryForm
-    list_display = ('name', 'instruction_status', 'is_active', 'promocodes_count', 'created_at')
+    list_display = ('name', 'instruction_status', 'is_active', 'promocodes_count', 'low_stock_threshold', 'created_at')
     list_filter = ('is_active', 'created_at')
     search_fields = ('name',)
-    readonly_fields = ('created_at',)
+    readonly_fields = ('created_at', 'available_count', 'shortage_notified_at')
+    actions = [refresh_promocode_counts]
     
     # Настройки для лучшего отображения многострочного текста
     formfield_overrides = {
@@ -278,6 +295,20 @@ class PromoCodeCategoryAdmin(admin.ModelAdmin):
             })
         return form
     
+    def changelist_view(self, request, extra_context=None):
+        # Категории без кэша остатка пересчитываем одним запросом, а не COUNT на каждую строку
+        from bot.promo import refresh_available_counts
+        missing = list(PromoCodeCategory.objects.filter(available_count__isnull=True).values_list('id', flat=True))
+        if missing:
+            refresh_available_counts(missing)
+        return super().changelist_view(request, extra_context)
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Промокоды могли измениться во вкладке - остаток пересчитается при чтении
+        from bot.promo import invalidate_available_counts
+        invalidate_available_counts([form.instance.id])
+    
     def instruction_status(self, obj):
         """Показывает статус инструкции: только файл"""
         has_file = bool(obj.instruction_file)
@@ -292,6 +323,9 @@ class PromoCodeCategoryAdmin(admin.ModelAdmin):
         ('Основная информация', {
             'fields': ('name', 'is_active')
         }),
+        ('Остаток промокодов', {
+            'fields': ('available_count', 'low_stock_threshold', 'shortage_notified_at'),
+        }),
         ('Сообщение при выборе категории', {
             'fields': ('message_text',),
             'description': 'Текст, который отображается пользователю при выборе этой категории промокодов. Поддерживает многострочный текст с эмодзи.'
@@ -327,10 +361,36 @@ class PromoCodeAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    def save_model(self, request, obj, form, change):
+        old_category_id = form.initial.get('category') if change else None
+        super().save_model(request, obj, form, change)
+        from bot.promo import invalidate_available_counts
+        invalidate_available_counts([old_category_id, obj.category_id])
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        from bot.promo import invalidate_available_counts
+        invalidate_available_counts([obj.category_id])
+    
+    def delete_queryset(self, request, queryset):
+        category_ids = set(queryset.values_list('category_id', flat=True))
+        super().delete_queryset(request, queryset)
+        from bot.promo import invalidate_available_counts
+        invalidate_available_counts(category_ids)
+
+
+class PromoCodeClaimAdmin(admin.ModelAdmin):
+    list_display = ('promocode', 'category', 'user', 'claimed_at')
+    list_filter = ('category', 'claimed_at')
+    search_fields = ('promocode__code', 'user__telegram_id', 'user__user_name')
+    raw_id_fields = ('promocode', 'user')
+    readonly_fields = ('claimed_at',)
 
 
 admin.site.register(PromoCode, PromoCodeAdmin)
 admin.site.register(PromoCodeCategory, PromoCodeCategoryAdmin)
+admin.site.register(PromoCodeClaim, PromoCodeClaimAdmin)
 
 
 class TypicalIssueInline(admin.TabularInline):
@@ -481,6 +541,9 @@ class GoodsAdmin(admin.ModelAdmin):
 
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
+        # Новые и замененные файлы товара загружаем в Telegram заранее, в фоне
+        from bot.file_cache import prewarm_files_async
+        prewarm_files_async([form.instance.id])
 
 
 # Регистрируем все модели в админ-панели
@@ -493,6 +556,25 @@ admin.site.register(SupportTicket, SupportTicketAdmin)
 admin.site.register(SupportMessage, SupportMessageAdmin)
 admin.site.register(OwnerSettings, OwnerSettingsAdmin)
 
+@admin.register(ExtendedWarranty)
+class ExtendedWarrantyAdmin(admin.ModelAdmin):
+    list_display = ('user', 'name', 'warranty_period', 'end_date', 'status', 'created_at')
+    list_filter = ('status', 'end_date')
+    search_fields = ('user__user_name', 'user__telegram_id', 'name')
+    raw_id_fields = ('user', 'product')
+
+@admin.register(ScreenshotFingerprint)
+class ScreenshotFingerprintAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'product', 'is_duplicate', 'created_at')
+    list_filter = (('duplicate_of', admin.EmptyFieldListFilter), 'created_at')
+    search_fields = ('user__telegram_id', 'user__user_name', 'image_hash', 'file_unique_id')
+    raw_id_fields = ('user', 'product', 'duplicate_of')
+    readonly_fields = ('image_hash', 'file_id', 'file_unique_id', 'verdict', 'created_at')
+
+    @admin.display(boolean=True, description='Чужой скриншот')
+    def is_duplicate(self, obj):
+        return obj.duplicate_of_id is not None
+
 @admin.register(ProductWarrantyQuestion)
 class ProductWarrantyQuestionAdmin(admin.ModelAdmin):
     list_display = ("id", "product", "order", "is_active", "text", "created_at", "updated_at")
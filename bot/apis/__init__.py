@@ -1,2 +1,2 @@
 from .ai import OpenAIAPI
-from .vision import analyze_screenshot
+from .vision import analyze_screenshot, download_photo
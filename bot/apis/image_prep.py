@@ -0,0 +1,116 @@
+import io
+import logging
+import threading
+from typing import NamedTuple
+
+from django.conf import settings
+from PIL import Image, ImageChops, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Доля высоты, которую занимает строка состояния телефона (время, батарея).
+# Срезается только у вертикальных скриншотов
+STATUS_BAR_RATIO = 0.04
+# Скриншот считается снятым с телефона, если высота больше ширины во столько раз
+PHONE_ASPECT = 1.6
+# Насколько пиксель должен отличаться от цвета фона, чтобы не считаться полем
+MARGIN_TOLERANCE = 12
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    mime: str
+    original_bytes: int
+    original_size: tuple
+    size: tuple
+
+
+class _PrepStats:
+    """Суммарные размеры изображений до и после подготовки (для /status)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def add(self, before: int, after: int) -> None:
+        with self._lock:
+            self.images += 1
+            self.bytes_before += before
+            self.bytes_after += after
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            ratio = round(self.bytes_after / self.bytes_before, 3) if self.bytes_before else None
+            return {
+                'images': self.images,
+                'bytes_before': self.bytes_before,
+                'bytes_after': self.bytes_after,
+                'ratio': ratio,
+            }
+
+
+prep_stats = _PrepStats()
+
+
+def crop_status_bar(image: Image.Image) -> Image.Image:
+    width, height = image.size
+    if height < width * PHONE_ASPECT:
+        return image
+    return image.crop((0, int(height * STATUS_BAR_RATIO), width, height))
+
+
+def crop_margins(image: Image.Image) -> Image.Image:
+    """Срезает однотонные поля по цвету левого верхнего пикселя"""
+    gray = image.convert('L')
+    background = Image.new('L', gray.size, gray.getpixel((0, 0)))
+    mask = ImageChops.difference(gray, background).point(lambda value: 255 if value > MARGIN_TOLERANCE else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+    return image.crop(bbox)
+
+
+def prepare_image(data: bytes, screenshot: bool = True, max_side: int = None) -> PreparedImage:
+    """
+    Готовит изображение к отправке в модель компьютерного зрения: срезает
+    строку состояния (screenshot=True) и однотонные поля, уменьшает до
+    max_side (по умолчанию VISION_IMAGE_MAX_SIDE) по большей стороне и
+    пережимает в VISION_IMAGE_FORMAT с качеством VISION_IMAGE_QUALITY. Если
+    изображение не читается, возвращаются исходные байты.
+    """
+    max_side = max_side or settings.VISION_IMAGE_MAX_SIDE
+    image_format = settings.VISION_IMAGE_FORMAT.upper()
+    if image_format not in MIME_TYPES:
+        image_format = 'JPEG'
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            original_size = source.size
+            original_mime = Image.MIME.get(source.format, 'image/jpeg')
+            # JPEG сразу декодируется уменьшенным (кратно 1/2, 1/4, 1/8), если он намного больше нужного
+            source.draft('RGB', (max_side, max_side))
+            image = ImageOps.exif_transpose(source).convert('RGB')
+        if screenshot:
+            image = crop_status_bar(image)
+        image = crop_margins(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, image_format, quality=settings.VISION_IMAGE_QUALITY, optimize=True)
+        prepared = output.getvalue()
+    except Exception as e:
+        logger.warning(f"[VISION] Не удалось подготовить изображение, отправляем как есть: {e}")
+        return PreparedImage(data, 'image/jpeg', len(data), None, None)
+
+    mime = MIME_TYPES[image_format]
+    if len(prepared) >= len(data) and original_size == image.size:
+        # Пережатие не помогло (уже маленький файл) - отправляем исходный
+        prepared, mime = data, original_mime
+    prep_stats.add(len(data), len(prepared))
+    logger.info(
+        f"[VISION] Изображение: {len(data) // 1024} КБ -> {len(prepared) // 1024} КБ, "
+        f"{original_size[0]}x{original_size[1]} -> {image.size[0]}x{image.size[1]}"
+    )
+    return PreparedImage(prepared, mime, len(data), original_size, image.size)
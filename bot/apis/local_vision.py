@@ -0,0 +1,219 @@
+import logging
+from typing import List, NamedTuple, Optional
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # opencv-python не установлен - локальный анализ отключен
+    cv2 = None
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Ширина, до которой уменьшается скриншот перед анализом. На более мелких
+# изображениях звезды слишком малы для надежного поиска - решает модель
+WORK_WIDTH = 720
+MIN_WIDTH = 480
+# Звезда: отношение площади к выпуклой оболочке (у круга и прямоугольника ~1)
+STAR_SOLIDITY = (0.4, 0.85)
+STAR_ASPECT = (0.75, 1.33)
+STAR_MIN_SIDE = 8
+STAR_MAX_SIDE_RATIO = 0.15  # от ширины изображения
+# Желто-оранжевые звезды маркетплейсов в HSV OpenCV (H 0..179)
+YELLOW_HUE = (10, 40)
+YELLOW_MIN_SATURATION = 90
+YELLOW_MIN_VALUE = 120
+# Доля "желтых" пикселей внутри контура, чтобы звезда считалась закрашенной
+YELLOW_FILL = 0.5
+# Соседние звезды ряда отстоят не больше чем на столько своих ширин (между центрами)
+ROW_GAP = 2.5
+RATING_SLOTS = 5
+
+
+class StarRow(NamedTuple):
+    x: int
+    y: int
+    width: int
+    height: int
+    slots: int      # звезд в ряду (закрашенных и пустых)
+    yellow: int     # закрашенных
+
+
+class LocalAnalysis(NamedTuple):
+    rows: List[StarRow]
+    # Текстовые блоки размером с дату ("12.03.2025", "Сегодня") рядом с рядом рейтинга
+    date_regions: int
+
+    @property
+    def rating_row(self) -> Optional[StarRow]:
+        return _rating_row(self.rows)
+
+    @property
+    def stars_count(self) -> int:
+        row = self.rating_row
+        if row is not None:
+            return row.yellow
+        return max((row.yellow for row in self.rows), default=0)
+
+    @property
+    def rejects(self) -> Optional[str]:
+        """
+        Причина отказа, если ответ очевиден без модели: есть ровно один ряд
+        рейтинга, рядом с ним подпись размером с дату, и в нем меньше 5
+        закрашенных звезд. Отсутствие звезд отказом не считается - это может
+        быть промах поиска (мелкие или плотно стоящие звезды). Во всех
+        остальных случаях None - решает модель.
+        """
+        row = self.rating_row
+        if row is None or not self.date_regions:
+            return None
+        if 0 < row.yellow < RATING_SLOTS and not any(r.yellow >= RATING_SLOTS for r in self.rows):
+            return 'few_stars'
+        return None
+
+
+def _rating_row(rows: List[StarRow]) -> Optional[StarRow]:
+    """Единственный ряд из пяти звезд (рейтинг отзыва), иначе None"""
+    rating_rows = [row for row in rows if row.slots == RATING_SLOTS]
+    return rating_rows[0] if len(rating_rows) == 1 else None
+
+
+def _decode(data: bytes):
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("не удалось декодировать изображение")
+    height, width = image.shape[:2]
+    if width < MIN_WIDTH:
+        raise ValueError(f"слишком маленькое изображение ({width}px)")
+    if width > WORK_WIDTH:
+        image = cv2.resize(image, (WORK_WIDTH, int(height * WORK_WIDTH / width)), interpolation=cv2.INTER_AREA)
+    return image
+
+
+def _star_candidates(image) -> list:
+    """(x, y, w, h, доля желтого) звездообразных контуров - светлых на темном и темных на светлом"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    yellow = cv2.inRange(
+        hsv,
+        (YELLOW_HUE[0], YELLOW_MIN_SATURATION, YELLOW_MIN_VALUE),
+        (YELLOW_HUE[1], 255, 255),
+    )
+    max_side = image.shape[1] * STAR_MAX_SIDE_RATIO
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 8)
+    candidates = []
+    seen = set()
+    for mask in (binary, cv2.bitwise_not(binary), yellow):
+        contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if w < STAR_MIN_SIDE or h < STAR_MIN_SIDE or w > max_side or h > max_side:
+                continue
+            if not STAR_ASPECT[0] <= w / h <= STAR_ASPECT[1]:
+                continue
+            area = cv2.contourArea(contour)
+            hull_area = cv2.contourArea(cv2.convexHull(contour))
+            if not hull_area or not STAR_SOLIDITY[0] <= area / hull_area <= STAR_SOLIDITY[1]:
+                continue
+            # Один и тот же контур находится в нескольких масках
+            key = (round((x + w / 2) / 4), round((y + h / 2) / 4))
+            if key in seen:
+                continue
+            seen.add(key)
+            shape = np.zeros((h, w), np.uint8)
+            cv2.drawContours(shape, [contour - (x, y)], -1, 255, -1)
+            inside = cv2.countNonZero(shape)
+            fill = cv2.countNonZero(cv2.bitwise_and(yellow[y:y + h, x:x + w], shape)) / inside if inside else 0
+            candidates.append((x, y, w, h, fill))
+    return candidates
+
+
+def _star_rows(candidates: list) -> List[StarRow]:
+    """Группирует звезды одного размера на одной линии с равным шагом"""
+    rows = []
+    used = set()
+    for index, (x, y, w, h, _) in sorted(enumerate(candidates), key=lambda item: (item[1][1], item[1][0])):
+        if index in used:
+            continue
+        center_y = y + h / 2
+        line = sorted(
+            (i for i, (cx, cy, cw, ch, _) in enumerate(candidates)
+             if i not in used and abs(cy + ch / 2 - center_y) <= h / 2 and 0.7 <= ch / h <= 1.4),
+            key=lambda i: candidates[i][0],
+        )
+        # Разбиваем линию на ряды по расстоянию между центрами
+        run = []
+        for i in line:
+            if run:
+                prev = candidates[run[-1]]
+                gap = (candidates[i][0] + candidates[i][2] / 2) - (prev[0] + prev[2] / 2)
+                if gap > ROW_GAP * max(prev[2], candidates[i][2]):
+                    rows.append(run)
+                    run = []
+            run.append(i)
+        if run:
+            rows.append(run)
+        used.update(line)
+    result = []
+    for run in rows:
+        stars = [candidates[i] for i in run]
+        left = min(star[0] for star in stars)
+        result.append(StarRow(
+            x=int(left),
+            y=int(min(star[1] for star in stars)),
+            width=int(max(star[0] + star[2] for star in stars) - left),
+            height=int(max(star[3] for star in stars)),
+            slots=len(stars),
+            yellow=sum(1 for star in stars if star[4] >= YELLOW_FILL),
+        ))
+    # Одиночные звезды (значок среднего рейтинга и т.п.) рядом рейтинга не считаются
+    return [row for row in result if row.slots >= 2 or row.yellow]
+
+
+def _date_regions(image, row: Optional[StarRow]) -> int:
+    """
+    Текстовые блоки высотой со строку и шириной с дату в нескольких строках
+    от ряда рейтинга. Распознавания текста нет - это только признак того, что
+    рядом со звездами есть подпись нужного размера.
+    """
+    if row is None:
+        return 0
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    # Склеиваем буквы в слова и строки
+    joined = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+    contours, _ = cv2.findContours(joined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    count = 0
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if not 0.3 * row.height <= h <= 1.5 * row.height or not 2.5 <= w / h <= 12:
+            continue
+        # Сами звезды после склейки тоже похожи на строку текста
+        if x < row.x + row.width and row.x < x + w and y < row.y + row.height and row.y < y + h:
+            continue
+        if abs(y - row.y) <= 4 * row.height:
+            count += 1
+    return count
+
+
+def analyze_locally(data: bytes) -> Optional[LocalAnalysis]:
+    """
+    Ищет на скриншоте ряды звезд (закрашенные желтые и пустые) и текстовые
+    блоки размером с дату рядом с рядом рейтинга. None - анализ недоступен (нет OpenCV или файл не
+    читается).
+    """
+    if cv2 is None:
+        return None
+    try:
+        image = _decode(data)
+        rows = _star_rows(_star_candidates(image))
+        analysis = LocalAnalysis(rows, _date_regions(image, _rating_row(rows)))
+    except Exception as e:
+        logger.warning(f"[VISION] Локальный анализ не удался: {e}")
+        return None
+    logger.info(
+        f"[VISION] Локальный анализ: ряды звезд {[(row.yellow, row.slots) for row in rows]}, "
+        f"блоков с датой: {analysis.date_regions}, отказ: {analysis.rejects}"
+    )
+    return analysis
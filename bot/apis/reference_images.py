@@ -0,0 +1,116 @@
+import base64
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+
+from .image_prep import prepare_image
+
+logger = logging.getLogger(__name__)
+
+# Суффикс файла рядом с изображением товара, где лежит готовый data URL
+SIDECAR_SUFFIX = '.vision'
+
+
+class ReferenceImage(NamedTuple):
+    image_id: int
+    # data:<mime>;base64,... - готово для запроса к модели
+    data_url: str
+
+
+class _ReferenceCache:
+    """
+    LRU эталонных изображений товаров: product_id -> ReferenceImage или None
+    (у товара нет изображений). Записи живут REFERENCE_IMAGE_CACHE_TTL секунд:
+    сохранение ProductImage сбрасывает кэш только в своем процессе, а другие
+    процессы (поллинг, веб) подхватят изменения по истечении срока.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # product_id -> (время загрузки, ReferenceImage | None)
+
+    def get(self, product_id):
+        with self._lock:
+            entry = self._entries.get(product_id)
+            if entry is None or time.monotonic() - entry[0] > settings.REFERENCE_IMAGE_CACHE_TTL:
+                return False, None
+            self._entries.move_to_end(product_id)
+            return True, entry[1]
+
+    def put(self, product_id, reference: Optional[ReferenceImage]) -> None:
+        with self._lock:
+            self._entries[product_id] = (time.monotonic(), reference)
+            self._entries.move_to_end(product_id)
+            while len(self._entries) > settings.REFERENCE_IMAGE_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def drop(self, product_id) -> None:
+        with self._lock:
+            self._entries.pop(product_id, None)
+
+
+reference_cache = _ReferenceCache()
+
+
+def _sidecar_path(image_path: str) -> str:
+    return image_path + SIDECAR_SUFFIX
+
+
+def _load_data_url(image_path: str) -> str:
+    """
+    Готовый data URL с диска, если он новее изображения; иначе уменьшает
+    изображение, кодирует и сохраняет рядом с ним.
+    """
+    sidecar = _sidecar_path(image_path)
+    try:
+        if os.path.getmtime(sidecar) >= os.path.getmtime(image_path):
+            with open(sidecar, 'r', encoding='ascii') as file:
+                return file.read()
+    except OSError:
+        pass
+    with open(image_path, 'rb') as file:
+        prepared = prepare_image(file.read(), screenshot=False, max_side=settings.REFERENCE_IMAGE_MAX_SIDE)
+    data_url = f"data:{prepared.mime};base64,{base64.b64encode(prepared.data).decode('ascii')}"
+    try:
+        with open(sidecar, 'w', encoding='ascii') as file:
+            file.write(data_url)
+    except OSError as e:
+        logger.warning(f"[VISION] Не удалось сохранить эталон {sidecar}: {e}")
+    return data_url
+
+
+def get_reference_image(product_id) -> Optional[ReferenceImage]:
+    """
+    Эталонное изображение товара для сравнения со скриншотом (последнее
+    добавленное, как product.images.first()). Без обращения к базе и диску,
+    пока запись в кэше жива.
+    """
+    found, reference = reference_cache.get(product_id)
+    if found:
+        return reference
+    from bot.models import ProductImage
+    image = ProductImage.objects.filter(product_id=product_id).only('id', 'image').first()
+    reference = None
+    if image is not None:
+        try:
+            reference = ReferenceImage(image.id, _load_data_url(image.image.path))
+        except Exception as e:
+            # Файл пропал с диска - сравнения с товаром не будет, как и без изображения
+            logger.error(f"[VISION] Не удалось загрузить изображение товара {product_id}: {e}")
+    reference_cache.put(product_id, reference)
+    return reference
+
+
+def invalidate_reference_image(product_id, image_path: Optional[str] = None) -> None:
+    """Сбрасывает эталон товара; image_path - удалить и готовый файл рядом с изображением"""
+    reference_cache.drop(product_id)
+    if image_path:
+        try:
+            os.remove(_sidecar_path(image_path))
+        except OSError:
+            pass
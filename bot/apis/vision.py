@@ -9,6 +9,10 @@ from datetime import datetime, timedelta
 from django.conf import settings
 from telebot.types import PhotoSize
 
+from .image_prep import prepare_image
+from .reference_images import get_reference_image
+from .local_vision import analyze_locally
+
 dotenv.load_dotenv()
 
 # Инициализируем клиент OpenAI с API ключом и базовым URL
@@ -19,7 +23,36 @@ client = OpenAI(
 
 logger = logging.getLogger(__name__)
 
-def analyze_screenshot(photo: PhotoSize, bot, product_id=None) -> dict:
+# Уверенность, с которой показывается ответ локального анализа
+LOCAL_CONFIDENCE = 70
+
+
+def _local_result(local) -> dict:
+    """Ответ по локальному анализу (bot/apis/local_vision.py) для очевидных отказов (меньше 5 звезд)"""
+    return {
+        'success': True,
+        'has_5_stars': False,
+        'message': (
+            f"В отзыве обнаружено {local.stars_count} звезд. "
+            f"Для получения расширенной гарантии необходимо оставить отзыв с 5 звездами."
+        ),
+        'confidence': LOCAL_CONFIDENCE,
+        'stars_count': local.stars_count,
+        'review_date': None,
+        'product_match': None,
+        'is_returned': False,
+        'has_multiple_products': False,
+        'source': 'local'
+    }
+
+
+def download_photo(photo: PhotoSize, bot) -> bytes:
+    """Скачивает фотографию из Telegram"""
+    file_info = bot.get_file(photo.file_id)
+    return bot.download_file(file_info.file_path)
+
+
+def analyze_screenshot(photo: PhotoSize, bot, product_id=None, image_data: bytes = None) -> dict:
     """
     Анализирует скриншот на наличие 5-звездочного отзыва, даты и соответствие товару
     
@@ -27,15 +60,23 @@ def analyze_screenshot(photo: PhotoSize, bot, product_id=None) -> dict:
         photo: Объект фотографии из Telegram
         bot: Объект бота для скачивания файла
         product_id: ID товара для проверки соответствия
+        image_data: Уже скачанный файл (чтобы не скачивать повторно)
     
     Returns:
         dict: Результат анализа с ключами 'success', 'has_5_stars', 'message', 'confidence', 
-              'stars_count', 'review_date', 'product_match', 'is_returned', 'has_multiple_products'
+              'stars_count', 'review_date', 'product_match', 'is_returned', 'has_multiple_products',
+              'source' ('api' - ответ модели, 'local' - очевидный отказ по локальному
+              анализу без запроса к модели, 'error' - модель не ответила)
     """
     try:
         # Получаем файл из Telegram
-        file_info = bot.get_file(photo.file_id)
-        downloaded_file = bot.download_file(file_info.file_path)
+        downloaded_file = image_data if image_data is not None else download_photo(photo, bot)
+        
+        # Очевидный отказ (меньше 5 звезд в ряду рейтинга с датой) - без платного запроса к модели
+        local = analyze_locally(downloaded_file) if settings.LOCAL_VISION_PREFILTER else None
+        if local is not None and local.rejects:
+            logger.info(f"[VISION] Локальный отказ без запроса к модели: {local.rejects}")
+            return _local_result(local)
         
         # Если передан product_id, пытаемся получить изображение товара (если оно есть)
         product_image = None
@@ -43,11 +84,11 @@ def analyze_screenshot(photo: PhotoSize, bot, product_id=None) -> dict:
         if product_id:
             from bot.models import goods
             try:
-                product = goods.objects.get(id=product_id)
-                product_name = product.name
-                # Проверяем наличие изображений товара
-                if product.images.exists():
-                    product_image = product.images.first().image.path
+                product_name = goods.objects.values_list('name', flat=True).get(id=product_id)
+                # Готовый data URL миниатюры товара из кэша (bot/apis/reference_images.py)
+                reference = get_reference_image(product_id)
+                if reference is not None:
+                    product_image = reference.data_url
             except goods.DoesNotExist:
                 pass
         
@@ -59,8 +100,9 @@ def analyze_screenshot(photo: PhotoSize, bot, product_id=None) -> dict:
         
         # Пробуем сначала использовать более легкую модель для экономии токенов
         try:
-            # Кодируем файл в base64 для передачи в API
-            base64_image = base64.b64encode(downloaded_file).decode('utf-8')
+            # Срезаем лишнее, уменьшаем и пережимаем, затем кодируем в base64 для передачи в API
+            screenshot = prepare_image(downloaded_file)
+            base64_image = base64.b64encode(screenshot.data).decode('utf-8')
             
             # Формируем системное сообщение
             system_message = f"Сегодняшняя дата: {today_str}. "
@@ -105,7 +147,7 @@ def analyze_screenshot(photo: PhotoSize, bot, product_id=None) -> dict:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
+                                "url": f"data:{screenshot.mime};base64,{base64_image}"
                             }
                         }
                     ]
@@ -114,14 +156,12 @@ def analyze_screenshot(photo: PhotoSize, bot, product_id=None) -> dict:
             
             # Если есть изображение товара, добавляем его в запрос
             if product_image:
-                with open(product_image, 'rb') as img_file:
-                    product_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                    messages[1]["content"].append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{product_base64}"
-                        }
-                    })
+                messages[1]["content"].append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": product_image
+                    }
+                })
             
             # Вызываем модель с поддержкой компьютерного зрения
             response = client.chat.completions.create(
@@ -242,23 +282,30 @@ def analyze_screenshot(photo: PhotoSize, bot, product_id=None) -> dict:
                 'review_date': review_date,
                 'product_match': product_match,
                 'is_returned': is_returned,
-                'has_multiple_products': has_multiple_products
+                'has_multiple_products': has_multiple_products,
+                'source': 'api'
             }
             
         except Exception as e:
             logger.error(f"[VISION] Ошибка при вызове API Vision: {e}")
             logger.info("[VISION] Переключаемся на локальный анализ изображения")
+            if local is None:
+                local = analyze_locally(downloaded_file)
+            if local is not None and local.rejects:
+                return _local_result(local)
             
+            # Дату и соответствие товара локально не проверить - подтвердить гарантию без модели нельзя
             return {
                 'success': True,
                 'has_5_stars': False,
                 'message': "Не удалось автоматически проверить наличие 5-звездочного отзыва. Пожалуйста, убедитесь, что на скриншоте отображается отзыв с 5 звездами и отправьте его снова или подтвердите вручную.",
                 'confidence': 0,
-                'stars_count': 0,
+                'stars_count': local.stars_count if local is not None else 0,
                 'review_date': None,
                 'product_match': None,
                 'is_returned': False,
-                'has_multiple_products': False
+                'has_multiple_products': False,
+                'source': 'error'
             }
             
     except Exception as e:
@@ -272,5 +319,6 @@ def analyze_screenshot(photo: PhotoSize, bot, product_id=None) -> dict:
             'review_date': None,
             'product_match': None,
             'is_returned': False,
-            'has_multiple_products': False
+            'has_multiple_products': False,
+            'source': 'error'
         } 
\ No newline at end of file
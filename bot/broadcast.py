@@ -0,0 +1,255 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from bot import bot
+from bot.models import BroadcastDelivery, BroadcastMessage, User
+from bot.outbound import outbound_priority, PRIORITY_BULK, PRIORITY_NOTIFICATION
+from bot.utils.queryset import keyset_chunks
+
+logger = logging.getLogger(__name__)
+
+# Как часто обновлять сообщение с прогрессом у админа (секунды)
+PROGRESS_INTERVAL = 10
+# Запас сверх BROADCAST_SEND_TIMEOUT, после которого рассылка считается прерванной (секунды)
+STALE_MARGIN = 60
+
+
+def start_broadcast(broadcast_id: int) -> bool:
+    """
+    Запускает рассылку в фоновом потоке и сразу возвращает управление.
+    Рассылку забирает только один процесс: статус меняется условным UPDATE.
+    """
+    if not _claim(broadcast_id):
+        return False
+    _spawn(broadcast_id)
+    return True
+
+
+def _claim(broadcast_id: int) -> bool:
+    now = timezone.now()
+    return bool(BroadcastMessage.objects.filter(
+        id=broadcast_id, status__in=['draft', 'queued']
+    ).update(status='running', started_at=now, heartbeat_at=now))
+
+
+def resume_broadcasts(wait: bool = False) -> str:
+    """
+    Продолжает рассылки, прерванные падением процесса (нет активности дольше
+    _stale_window()), с контрольной точки last_user_id. Для cron.
+    wait=True - дождаться окончания (для короткоживущих процессов, manage.py).
+    """
+    stale_before = timezone.now() - _stale_window()
+    threads = []
+    stale = BroadcastMessage.objects.filter(
+        Q(status='running') & (Q(heartbeat_at__lt=stale_before) | Q(heartbeat_at__isnull=True))
+    ).values_list('id', 'heartbeat_at')
+    for broadcast_id, heartbeat_at in stale:
+        # Условный UPDATE: если другой процесс успел забрать рассылку, heartbeat уже другой
+        claimed = BroadcastMessage.objects.filter(
+            id=broadcast_id, status='running', heartbeat_at=heartbeat_at
+        ).update(heartbeat_at=timezone.now())
+        if claimed:
+            logger.info(f"[LOG] Возобновляем прерванную рассылку #{broadcast_id}")
+            threads.append(_spawn(broadcast_id))
+    for broadcast_id in BroadcastMessage.objects.filter(status='queued').values_list('id', flat=True):
+        if _claim(broadcast_id):
+            threads.append(_spawn(broadcast_id))
+    if wait:
+        for thread in threads:
+            thread.join()
+    return f"Запущено рассылок: {len(threads)}"
+
+
+def _stale_window() -> timedelta:
+    """
+    Сколько рассылка может молчать, прежде чем ее заберет resume_broadcasts:
+    BROADCAST_STALE_MINUTES, но не меньше BROADCAST_SEND_TIMEOUT + STALE_MARGIN,
+    чтобы исходный поток успел выйти по таймауту и записать свои доставки.
+    """
+    configured = timedelta(minutes=settings.BROADCAST_STALE_MINUTES)
+    minimum = timedelta(seconds=settings.BROADCAST_SEND_TIMEOUT + STALE_MARGIN)
+    if configured < minimum:
+        logger.warning(
+            f"[WARNING] BROADCAST_STALE_MINUTES={settings.BROADCAST_STALE_MINUTES} меньше "
+            f"BROADCAST_SEND_TIMEOUT + {STALE_MARGIN} с, используем {minimum}"
+        )
+        return minimum
+    return configured
+
+
+def cancel_broadcast(broadcast_id: int) -> bool:
+    """Останавливает рассылку: поток заметит статус перед следующей страницей"""
+    return bool(BroadcastMessage.objects.filter(
+        id=broadcast_id, status__in=['draft', 'queued', 'running']
+    ).update(status='cancelled'))
+
+
+def _spawn(broadcast_id: int) -> threading.Thread:
+    thread = threading.Thread(
+        target=run_broadcast,
+        args=(broadcast_id,),
+        name=f"broadcast-{broadcast_id}",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def _progress_text(broadcast: BroadcastMessage, finished: bool = False) -> str:
+    if finished:
+        head = "✅ Рассылка завершена." if broadcast.status == 'done' else "⛔ Рассылка остановлена."
+    else:
+        head = "📤 Рассылка отправляется..."
+    return (
+        f"{head}\n\n"
+        f"Обработано: {broadcast.processed_count} из {broadcast.total_count}\n"
+        f"Доставлено: {broadcast.sent_count}\n"
+        f"Ошибок: {broadcast.failed_count}"
+    )
+
+
+def _report_progress(broadcast: BroadcastMessage, finished: bool = False) -> None:
+    if not broadcast.report_chat_id or not broadcast.report_message_id:
+        return
+    try:
+        with outbound_priority(PRIORITY_NOTIFICATION):
+            bot.edit_message_text(
+                chat_id=broadcast.report_chat_id,
+                message_id=broadcast.report_message_id,
+                text=_progress_text(broadcast, finished)
+            )
+    except Exception as e:
+        # "message is not modified" и подобное не должны останавливать рассылку
+        logger.warning(f"[WARNING] Не удалось обновить прогресс рассылки #{broadcast.id}: {e}")
+
+
+def _record_delivery(broadcast_id: int, user_id: str, error: str = None) -> None:
+    """Сохраняет доставку одному пользователю вместе со счетчиками рассылки"""
+    with transaction.atomic():
+        created = BroadcastDelivery.objects.bulk_create([BroadcastDelivery(
+            broadcast_id=broadcast_id, user_id=user_id,
+            status='failed' if error is not None else 'sent', error=(error or '')[:255],
+        )], ignore_conflicts=True)
+        counter = 'failed_count' if error is not None else 'sent_count'
+        BroadcastMessage.objects.filter(id=broadcast_id).update(
+            **{counter: F(counter) + len(created)}, heartbeat_at=timezone.now()
+        )
+
+
+def _record_result(broadcast_id: int, user_id: str, request) -> bool:
+    """Сохраняет результат завершенной отправки; True - доставлено"""
+    try:
+        request.result()
+    except Exception as e:
+        _record_delivery(broadcast_id, user_id, error=str(e))
+        return False
+    _record_delivery(broadcast_id, user_id)
+    return True
+
+
+def _send_page(broadcast: BroadcastMessage, user_ids: list) -> tuple:
+    """
+    Отправляет страницу получателей через очередь исходящих. Каждая доставка
+    сохраняется, как только завершилась, контрольная точка last_user_id -
+    после всей страницы. Если за BROADCAST_SEND_TIMEOUT не завершилось ни
+    одной отправки, неотправленные запросы отменяются, а TimeoutError
+    оставляет рассылку для resume_broadcasts.
+    """
+    already_done = set(
+        BroadcastDelivery.objects.filter(broadcast_id=broadcast.id, user_id__in=user_ids)
+        .values_list('user_id', flat=True)
+    )
+    # Вся страница ставится в очередь сразу; темп задает ограничитель в bot.outbound
+    with outbound_priority(PRIORITY_BULK):
+        pending = {
+            bot.submit_request('send_message', chat_id=user_id, text=broadcast.text): user_id
+            for user_id in user_ids if user_id not in already_done
+        }
+    sent = failed = 0
+    while pending:
+        done, _ = wait(pending, timeout=settings.BROADCAST_SEND_TIMEOUT, return_when=FIRST_COMPLETED)
+        if not done:
+            cancelled = stuck = 0
+            for request, user_id in pending.items():
+                if request.cancel():
+                    cancelled += 1
+                elif request.done():
+                    # Завершилась между wait() и cancel() - записываем настоящий результат
+                    _record_result(broadcast.id, user_id, request)
+                else:
+                    # Отправка уже начата и могла дойти - отмечаем ошибкой, чтобы не отправить повторно
+                    _record_delivery(broadcast.id, user_id, error='timeout')
+                    stuck += 1
+            raise TimeoutError(
+                f"нет доставок дольше {settings.BROADCAST_SEND_TIMEOUT} с, "
+                f"отменено {cancelled}, без ответа {stuck}"
+            )
+        for request in done:
+            if _record_result(broadcast.id, pending.pop(request), request):
+                sent += 1
+            else:
+                failed += 1
+    BroadcastMessage.objects.filter(id=broadcast.id).update(
+        last_user_id=user_ids[-1], heartbeat_at=timezone.now()
+    )
+    return sent, failed
+
+
+def run_broadcast(broadcast_id: int) -> None:
+    """
+    Отправляет рассылку страницами по BROADCAST_PAGE_SIZE пользователей
+    (keyset_chunks по telegram_id). Доставка сохраняется сразу после отправки,
+    контрольная точка - после каждой страницы. После падения рассылка
+    продолжается с контрольной точки, а уже сохраненные доставки пропускаются:
+    повторно может уйти не больше сообщений, чем было в отправке в момент
+    падения.
+    """
+    close_old_connections()
+    try:
+        broadcast = BroadcastMessage.objects.get(id=broadcast_id)
+        if not broadcast.total_count:
+            broadcast.total_count = User.objects.count()
+            BroadcastMessage.objects.filter(id=broadcast_id).update(total_count=broadcast.total_count)
+        print(f"[LOG] Рассылка #{broadcast_id}: старт с '{broadcast.last_user_id}', получателей {broadcast.total_count}")
+        logger.info(f"[LOG] Рассылка #{broadcast_id}: старт с '{broadcast.last_user_id}', получателей {broadcast.total_count}")
+
+        last_report = 0.0
+        pages = keyset_chunks(
+            User.objects.values_list('telegram_id', flat=True),
+            chunk_size=settings.BROADCAST_PAGE_SIZE,
+            start_after=broadcast.last_user_id or None,
+        )
+        for user_ids in pages:
+            status = BroadcastMessage.objects.filter(id=broadcast_id).values_list('status', flat=True).first()
+            if status != 'running':
+                logger.info(f"[LOG] Рассылка #{broadcast_id} остановлена, статус: {status}")
+                break
+            _send_page(broadcast, user_ids)
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                broadcast.refresh_from_db()
+                _report_progress(broadcast)
+                last_report = time.monotonic()
+        else:
+            now = timezone.now()
+            BroadcastMessage.objects.filter(id=broadcast_id, status='running').update(
+                status='done', is_sent=True, sent_at=now, heartbeat_at=now
+            )
+
+        broadcast.refresh_from_db()
+        _report_progress(broadcast, finished=True)
+        print(f"[LOG] Рассылка #{broadcast_id} завершена: доставлено {broadcast.sent_count}, ошибок {broadcast.failed_count}")
+        logger.info(f"[LOG] Рассылка #{broadcast_id} завершена: доставлено {broadcast.sent_count}, ошибок {broadcast.failed_count}")
+    except Exception as e:
+        # Статус остается running: resume_broadcasts продолжит с контрольной точки
+        print(f"[ERROR] Ошибка рассылки #{broadcast_id}: {e}")
+        logger.error(f"[ERROR] Ошибка рассылки #{broadcast_id}: {e}")
+    finally:
+        close_old_connections()
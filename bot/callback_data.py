@@ -0,0 +1,134 @@
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+from telebot.types import CallbackQuery
+
+# Версия формата. Формат: "<версия>:<код действия>[:<аргументы base36 через точку>]",
+# например "1:pd:2s" -> ("promocode_detail", (100,))
+CALLBACK_DATA_VERSION = "1"
+CALLBACK_DATA_PREFIX = f"{CALLBACK_DATA_VERSION}:"
+# Ограничение Telegram на размер callback_data
+CALLBACK_DATA_MAX_BYTES = 64
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Полное имя действия -> короткий код. Коды не переиспользовать:
+# кнопки в уже отправленных сообщениях продолжают их присылать.
+ACTIONS = {
+    "category": "c",
+    "product": "p",
+    "instructions": "in",
+    "faq": "fq",
+    "issues": "is",
+    "activate_warranty": "aw",
+    "cancel_warranty": "cw",
+    "confirm_review": "cr",
+    "cancel_review": "xr",
+    "warranty_category": "wc",
+    "warranty_product": "wp",
+    "warranty_issue": "wi",
+    "warranty_helped": "wh",
+    "warranty_not_helped": "wn",
+    "warranty_other": "wo",
+    "support_category": "sg",
+    "support_product": "sp",
+    "support_issue": "si",
+    "support_helped": "sh",
+    "support_not_helped": "sn",
+    "support_other": "sx",
+    "accept_ticket": "at",
+    "view_ticket": "vt",
+    "finish_ticket": "ft",
+    "decline_ticket": "dt",
+    "takeover_ticket": "tt",
+    "get_ticket_files": "tf",
+    "get_all_ticket_files": "ta",
+    "support_ticket": "st",
+    "support_open": "so",
+    "support_close": "sc",
+    "promocode_detail": "pd",
+    "promocode_toggle": "pt",
+    "promocode_delete": "px",
+    "promocode_cat_select": "ps",
+    "promocode_cat_text": "pc",
+    "promocode_cat_file": "pf",
+    "promocode_back_to_category": "pb",
+    "get_promocode_cat": "gp",
+    "claim_promocode": "cp",
+    "get_instruction": "gi",
+    "excel_export": "ee",
+    "excel_export_category": "eg",
+    "excel_export_product": "ep",
+    "excel_export_run": "er",
+}
+ACTION_BY_CODE = {code: action for action, code in ACTIONS.items()}
+
+if len(ACTION_BY_CODE) != len(ACTIONS):
+    raise RuntimeError("Дублирующиеся коды действий в ACTIONS")
+
+
+class CallbackData(NamedTuple):
+    action: str
+    args: Tuple[int, ...]
+
+
+def _to_base36(value: int) -> str:
+    if value == 0:
+        return "0"
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    digits = []
+    while value:
+        value, rem = divmod(value, 36)
+        digits.append(_DIGITS[rem])
+    return sign + "".join(reversed(digits))
+
+
+def pack(action: str, *args: int) -> str:
+    """Собирает callback_data для действия с целочисленными аргументами"""
+    code = ACTIONS.get(action)
+    if code is None:
+        raise ValueError(f"Неизвестное действие callback_data: {action}")
+    data = CALLBACK_DATA_PREFIX + code
+    if args:
+        data += ":" + ".".join(_to_base36(int(arg)) for arg in args)
+    if len(data.encode("utf-8")) > CALLBACK_DATA_MAX_BYTES:
+        raise ValueError(f"callback_data длиннее {CALLBACK_DATA_MAX_BYTES} байт: {data}")
+    return data
+
+
+@lru_cache(maxsize=4096)
+def unpack(data: str) -> Optional[CallbackData]:
+    """Разбирает callback_data в формате кодека; для старых строк возвращает None"""
+    if not data or not data.startswith(CALLBACK_DATA_PREFIX):
+        return None
+    parts = data.split(":")
+    if len(parts) not in (2, 3):
+        return None
+    action = ACTION_BY_CODE.get(parts[1])
+    if action is None:
+        return None
+    try:
+        args = tuple(int(arg, 36) for arg in parts[2].split(".")) if len(parts) == 3 else ()
+    except ValueError:
+        return None
+    return CallbackData(action, args)
+
+
+def callback_action(call: CallbackQuery) -> str:
+    """Имя действия: из кодека либо первый сегмент старой строки вида action_id"""
+    parsed = unpack(call.data)
+    if parsed is not None:
+        return parsed.action
+    return call.data.split('_')[0]
+
+
+def callback_id(call: CallbackQuery, index: int = -1) -> int:
+    """
+    Целочисленный аргумент кнопки. Понимает оба формата: новый
+    ("1:pd:2s") и старый ("promocode_detail_100") из ранее отправленных сообщений.
+    """
+    parsed = unpack(call.data)
+    if parsed is not None:
+        return parsed.args[index]
+    return int(call.data.split('_')[index])
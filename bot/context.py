@@ -0,0 +1,86 @@
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from bot.models import User
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class UpdateContext:
+    """
+    Контекст одного апдейта Telegram.
+
+    Пользователь чата загружается из БД один раз и отдается всем хендлерам
+    и декораторам, обрабатывающим апдейт. Измененные поля (отслеживает
+    DirtyFieldsMixin) записываются одним save(update_fields=...) в конце.
+    """
+
+    def __init__(self, chat_id: Optional[int]):
+        self.chat_id = str(chat_id) if chat_id is not None else None
+        self._user = None
+
+    def get_user(self) -> Optional[User]:
+        # Отсутствие пользователя не кэшируем: его может создать регистрация
+        if self._user is None and self.chat_id is not None:
+            self._user = User.objects.filter(telegram_id=self.chat_id).first()
+        return self._user
+
+    def dirty_fields(self) -> list:
+        if self._user is None:
+            return []
+        return self._user.get_dirty_fields()
+
+    def flush(self) -> None:
+        """Записывает измененные поля пользователя одним запросом"""
+        fields = self.dirty_fields()
+        if fields:
+            self._user.save(update_fields=fields)
+
+
+def get_context() -> Optional[UpdateContext]:
+    return getattr(_local, 'context', None)
+
+
+@contextmanager
+def update_context(chat_id: Optional[int]):
+    """Открывает контекст апдейта в текущем потоке и сохраняет пользователя при выходе"""
+    previous = get_context()
+    context = UpdateContext(chat_id)
+    _local.context = context
+    try:
+        yield context
+    finally:
+        try:
+            context.flush()
+        except Exception as e:
+            logger.error(f"[ERROR] Не удалось сохранить пользователя {context.chat_id}: {e}")
+        _local.context = previous
+
+
+def get_user(telegram_id) -> User:
+    """
+    Аналог User.objects.get(telegram_id=...): для пользователя текущего
+    апдейта возвращает уже загруженный объект, для остальных идет в БД.
+    """
+    context = get_context()
+    if context is not None and context.chat_id == str(telegram_id):
+        user = context.get_user()
+        if user is None:
+            raise User.DoesNotExist(f"User {telegram_id} does not exist")
+        return user
+    return User.objects.get(telegram_id=telegram_id)
+
+
+def save_user(user: User, *fields: str) -> None:
+    """
+    Сохраняет поля пользователя: для пользователя текущего апдейта запись
+    откладывается до конца обработки, иначе выполняется сразу.
+    """
+    context = get_context()
+    if context is not None and context._user is user:
+        return
+    user.save(update_fields=list(fields) or None)
@@ -3,11 +3,15 @@
 # Функции для регулярного выполнения задач
 import logging
 from django.utils import timezone
-from bot.models import User, SupportTicket, OwnerSettings
+from bot.models import User, SupportTicket, OwnerSettings, ExtendedWarranty
 from bot.texts import ADMIN_REMINDER_TEXT, OWNER_NOTIFICATION_TEXT
 from bot.keyboards import get_admin_ticket_markup
 from bot import bot
+from bot.outbound import outbound_priority, PRIORITY_NOTIFICATION
+from bot.utils.queryset import keyset_chunks
 import json
+import time
+from collections import defaultdict
 from datetime import timedelta
 
 logger = logging.getLogger(__name__)
@@ -16,23 +20,23 @@ def reset_screenshot_counters():
     """
     Сбрасывает счетчики скриншотов пользователей ежедневно
     Функция вызывается из cron-задачи один раз в день (обычно в полночь)
+
+    Сброс выполняется одним UPDATE. Лимит в хендлере от задачи не зависит:
+    устаревший счетчик сбрасывается при чтении (User.reset_screenshots_if_stale),
+    поэтому пропущенный запуск cron ничего не ломает.
     """
     try:
         today = timezone.now().date()
+        started = time.monotonic()
         
-        # Получаем всех пользователей, у которых счетчик скриншотов > 0
-        users_with_screenshots = User.objects.filter(screenshots_count__gt=0)
-        
-        # Сбрасываем счетчики
-        counter = 0
-        for user in users_with_screenshots:
-            user.screenshots_count = 0
-            user.last_screenshot_date = today
-            user.save()
-            counter += 1
+        counter = User.objects.filter(
+            screenshots_count__gt=0,
+            last_screenshot_date__lt=today
+        ).update(screenshots_count=0)
         
-        logger.info(f"[CRON] Сброшены счетчики скриншотов для {counter} пользователей")
-        return f"Сброшены счетчики скриншотов для {counter} пользователей"
+        elapsed_ms = (time.monotonic() - started) * 1000
+        logger.info(f"[CRON] Сброшены счетчики скриншотов для {counter} пользователей за {elapsed_ms:.1f} мс")
+        return f"Сброшены счетчики скриншотов для {counter} пользователей за {elapsed_ms:.1f} мс"
     
     except Exception as e:
         logger.error(f"[CRON] Ошибка при сбросе счетчиков скриншотов: {e}")
@@ -42,96 +46,111 @@ def check_warranty_expiration():
     """
     Проверяет истечение срока расширенной гарантии
     Функция вызывается из cron-задачи ежедневно
+
+    Истекшие гарантии выбираются по индексу (status, end_date) страницами
+    пользователей, после уведомления страница помечается истекшей одним UPDATE.
     """
     try:
-        current_date = timezone.now()
-        users_with_warranty = User.objects.filter(extended_warranty_products__isnull=False)
-        
+        today = timezone.now().date()
+        expired = ExtendedWarranty.objects.filter(status='active', end_date__lt=today)
+        users_with_expired = User.objects.filter(
+            extended_warranties__in=expired
+        ).distinct().values_list('telegram_id', flat=True)
+
         expired_count = 0
-        for user in users_with_warranty:
-            extended_warranty_info = user.extended_warranty_info or {}
-            if isinstance(extended_warranty_info, str):
-                extended_warranty_info = json.loads(extended_warranty_info)
-            
-            expired_products = []
-            for product_id, info in extended_warranty_info.items():
-                try:
-                    end_date = timezone.datetime.strptime(info['end_date'], "%d.%m.%Y")
-                    if current_date > end_date:
-                        expired_products.append(info['name'])
-                except (ValueError, KeyError):
-                    continue
-            
-            if expired_products:
+        updated = 0
+        for user_ids in keyset_chunks(users_with_expired):
+            expired_by_user = defaultdict(list)
+            for warranty_id, user_id, name in expired.filter(user_id__in=user_ids).order_by('user_id', 'end_date').values_list('id', 'user_id', 'name'):
+                expired_by_user[user_id].append((warranty_id, name))
+
+            expired_ids = []
+            for user_id, warranties in expired_by_user.items():
                 # Отправляем уведомление пользователю
                 message = (
                     "⚠️ Уведомление об истечении срока гарантии\n\n"
                     "Срок расширенной гарантии истек для следующих товаров:\n"
                 )
-                for product in expired_products:
-                    message += f"• {product}\n"
-                
+                for _, name in warranties:
+                    message += f"• {name}\n"
+
                 try:
-                    bot.send_message(
-                        chat_id=user.telegram_id,
-                        text=message
-                    )
+                    with outbound_priority(PRIORITY_NOTIFICATION):
+                        bot.send_message(
+                            chat_id=user_id,
+                            text=message
+                        )
                     expired_count += 1
                 except Exception as e:
-                    logger.error(f"[CRON] Ошибка при отправке уведомления пользователю {user.telegram_id}: {e}")
-        
-        logger.info(f"[CRON] Отправлены уведомления о истечении гарантии для {expired_count} пользователей")
+                    logger.error(f"[CRON] Ошибка при отправке уведомления пользователю {user_id}: {e}")
+                # Помечаем истекшими в любом случае, чтобы не слать уведомление повторно каждый день
+                expired_ids.extend(warranty_id for warranty_id, _ in warranties)
+
+            updated += ExtendedWarranty.objects.filter(id__in=expired_ids).update(status='expired')
+
+        logger.info(f"[CRON] Отправлены уведомления о истечении гарантии для {expired_count} пользователей, истекло гарантий: {updated}")
         return f"Отправлены уведомления о истечении гарантии для {expired_count} пользователей"
     
     except Exception as e:
         logger.error(f"[CRON] Ошибка при проверке истечения срока гарантии: {e}")
         return f"Ошибка при проверке истечения срока гарантии: {e}"
 
+# Сколько обращений эскалировать за один тик cron (остальные - на следующем)
+ESCALATION_BATCH_SIZE = 500
+
 
 def check_support_notifications():
     """
     Проверяет необработанные обращения и отправляет уведомления
     Функция вызывается каждую минуту
+
+    Выбираются только открытые обращения, у которых наступил next_escalation_at
+    (индекс status + next_escalation_at). Получатели загружаются один раз за тик,
+    отметки об уведомлениях записываются одним bulk_update.
     """
     try:
+        started = time.monotonic()
         current_time = timezone.now()
         notifications_sent = 0
         
-        # Получаем все открытые обращения
-        open_tickets = SupportTicket.objects.filter(status='open')
+        _schedule_unscheduled_tickets()
         
-        for ticket in open_tickets:
-            # Проверяем первое уведомление (через 5 минут)
-            if (not ticket.first_admin_notification_sent and 
-                current_time - ticket.created_at >= timedelta(minutes=5)):
-                
-                send_admin_reminder(ticket, is_first=True)
-                ticket.first_admin_notification_sent = current_time
-                ticket.save()
-                notifications_sent += 1
-            
-            # Проверяем второе уведомление (через 10 минут от создания, если первое уже отправлено)
-            elif (ticket.first_admin_notification_sent and 
-                  not ticket.second_admin_notification_sent and 
-                  current_time - ticket.created_at >= timedelta(minutes=10)):
-                
-                send_admin_reminder(ticket, is_first=False)
-                ticket.second_admin_notification_sent = current_time
-                ticket.save()
-                notifications_sent += 1
-            
-            # Проверяем уведомление владельцу (через 15 минут от создания)
-            elif (ticket.second_admin_notification_sent and 
-                  not ticket.owner_notification_sent and 
-                  current_time - ticket.created_at >= timedelta(minutes=15)):
-                
-                send_owner_notification(ticket)
-                ticket.owner_notification_sent = current_time
-                ticket.save()
+        due_tickets = list(
+            SupportTicket.objects.filter(
+                status='open',
+                next_escalation_at__lte=current_time
+            ).select_related('user').order_by('next_escalation_at')[:ESCALATION_BATCH_SIZE]
+        )
+        if not due_tickets:
+            return "Отправлено 0 уведомлений о необработанных обращениях"
+        
+        admin_ids = None
+        owner_ids = None
+        for ticket in due_tickets:
+            level = ticket.escalation_level
+            # Ступень: 0 и 1 - напоминания админам (5 и 10 минут), 2 - владельцу (15 минут)
+            if level < 2:
+                if admin_ids is None:
+                    admin_ids = list(User.objects.filter(is_admin=True).values_list('telegram_id', flat=True))
+                send_admin_reminder(ticket, is_first=(level == 0), admin_ids=admin_ids)
+            elif level == 2:
+                if owner_ids is None:
+                    owner_ids = list(OwnerSettings.objects.filter(is_active=True).values_list('owner_telegram_id', flat=True))
+                send_owner_notification(ticket, owner_ids=owner_ids)
+            if level < len(SupportTicket.ESCALATION_FIELDS):
+                setattr(ticket, SupportTicket.ESCALATION_FIELDS[level], current_time)
                 notifications_sent += 1
+            ticket.next_escalation_at = ticket.compute_next_escalation_at()
+        
+        SupportTicket.objects.bulk_update(
+            due_tickets,
+            list(SupportTicket.ESCALATION_FIELDS) + ['next_escalation_at'],
+            batch_size=ESCALATION_BATCH_SIZE
+        )
         
+        elapsed_ms = (time.monotonic() - started) * 1000
         if notifications_sent > 0:
-            logger.info(f"[CRON] Отправлено {notifications_sent} уведомлений о необработанных обращениях")
+            logger.info(f"[CRON] Отправлено {notifications_sent} уведомлений о необработанных обращениях за {elapsed_ms:.1f} мс")
         
         return f"Отправлено {notifications_sent} уведомлений о необработанных обращениях"
     
@@ -140,47 +159,79 @@ def check_support_notifications():
         return f"Ошибка при проверке уведомлений поддержки: {e}"
 
 
-def send_admin_reminder(ticket: SupportTicket, is_first: bool = True):
-    """Отправляет напоминание админам о необработанном обращении"""
+def _schedule_unscheduled_tickets():
+    """
+    Проставляет next_escalation_at открытым обращениям, у которых его нет
+    (созданы до появления поля или в обход SupportTicket.save)
+    """
+    tickets = list(
+        SupportTicket.objects.filter(
+            status='open',
+            next_escalation_at__isnull=True,
+            owner_notification_sent__isnull=True
+        ).only('id', 'created_at', *SupportTicket.ESCALATION_FIELDS)[:ESCALATION_BATCH_SIZE]
+    )
+    if not tickets:
+        return
+    for ticket in tickets:
+        ticket.next_escalation_at = ticket.compute_next_escalation_at()
+    SupportTicket.objects.bulk_update(tickets, ['next_escalation_at'], batch_size=ESCALATION_BATCH_SIZE)
+    logger.info(f"[CRON] Запланированы напоминания для {len(tickets)} обращений")
+
+
+def send_admin_reminder(ticket: SupportTicket, is_first: bool = True, admin_ids=None):
+    """
+    Отправляет напоминание админам о необработанном обращении.
+    admin_ids - заранее загруженные telegram_id админов (один запрос на тик cron)
+    """
     try:
-        admins = User.objects.filter(is_admin=True)
+        if admin_ids is None:
+            admin_ids = User.objects.filter(is_admin=True).values_list('telegram_id', flat=True)
+        text = ADMIN_REMINDER_TEXT.format(
+            ticket_id=ticket.id,
+            user_name=ticket.user.user_name,
+            platform=ticket.get_platform_display()
+        )
+        markup = get_admin_ticket_markup(ticket.id)
         
-        for admin in admins:
+        # Ставим в очередь сразу всем админам, затем собираем результаты
+        with outbound_priority(PRIORITY_NOTIFICATION):
+            pending = [
+                (admin_id, bot.submit_request('send_message', chat_id=admin_id, text=text, reply_markup=markup))
+                for admin_id in admin_ids
+            ]
+        for admin_id, request in pending:
             try:
-                bot.send_message(
-                    chat_id=admin.telegram_id,
-                    text=ADMIN_REMINDER_TEXT.format(
-                        ticket_id=ticket.id,
-                        user_name=ticket.user.user_name,
-                        platform=ticket.get_platform_display()
-                    ),
-                    reply_markup=get_admin_ticket_markup(ticket.id)
-                )
+                request.result()
             except Exception as e:
-                logger.error(f"Ошибка при отправке напоминания админу {admin.telegram_id}: {e}")
+                logger.error(f"Ошибка при отправке напоминания админу {admin_id}: {e}")
                 
     except Exception as e:
         logger.error(f"Ошибка в send_admin_reminder: {e}")
 
 
-def send_owner_notification(ticket: SupportTicket):
+def send_owner_notification(ticket: SupportTicket, owner_ids=None):
     """Отправляет критическое уведомление владельцу"""
     try:
-        owners = OwnerSettings.objects.filter(is_active=True)
+        if owner_ids is None:
+            owner_ids = OwnerSettings.objects.filter(is_active=True).values_list('owner_telegram_id', flat=True)
+        text = OWNER_NOTIFICATION_TEXT.format(
+            ticket_id=ticket.id,
+            user_name=ticket.user.user_name,
+            platform=ticket.get_platform_display()
+        )
+        markup = get_admin_ticket_markup(ticket.id)
         
-        for owner in owners:
+        with outbound_priority(PRIORITY_NOTIFICATION):
+            pending = [
+                (owner_id, bot.submit_request('send_message', chat_id=owner_id, text=text, reply_markup=markup))
+                for owner_id in owner_ids
+            ]
+        for owner_id, request in pending:
             try:
-                bot.send_message(
-                    chat_id=owner.owner_telegram_id,
-                    text=OWNER_NOTIFICATION_TEXT.format(
-                        ticket_id=ticket.id,
-                        user_name=ticket.user.user_name,
-                        platform=ticket.get_platform_display()
-                    ),
-                    reply_markup=get_admin_ticket_markup(ticket.id)
-                )
+                request.result()
             except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления владельцу {owner.owner_telegram_id}: {e}")
+                logger.error(f"Ошибка при отправке уведомления владельцу {owner_id}: {e}")
                 
     except Exception as e:
         logger.error(f"Ошибка в send_owner_notification: {e}")
@@ -207,3 +258,36 @@ def clean_old_tickets():
     except Exception as e:
         logger.error(f"[CRON] Ошибка при очистке старых обращений: {e}")
         return f"Ошибка при очистке старых обращений: {e}"
+
+
+def resume_interrupted_broadcasts(wait: bool = False):
+    """
+    Продолжает прерванные рассылки с контрольной точки
+    Функция вызывается из cron-задачи (например, раз в 5 минут)
+    """
+    try:
+        from bot.broadcast import resume_broadcasts
+        result = resume_broadcasts(wait=wait)
+        logger.info(f"[CRON] {result}")
+        return result
+    except Exception as e:
+        logger.error(f"[CRON] Ошибка при возобновлении рассылок: {e}")
+        return f"Ошибка при возобновлении рассылок: {e}"
+
+
+def clean_expired_states():
+    """
+    Удаляет состояния диалогов с истекшим TTL (bot/state.py)
+    Функция вызывается из cron-задачи (например, раз в час): при чтении
+    просроченные записи только игнорируются, а в базе и на диске копятся
+    """
+    try:
+        from bot.state import purge_expired_states
+        started = time.monotonic()
+        result = purge_expired_states()
+        elapsed_ms = (time.monotonic() - started) * 1000
+        logger.info(f"[CRON] {result} за {elapsed_ms:.1f} мс")
+        return result
+    except Exception as e:
+        logger.error(f"[CRON] Ошибка при очистке просроченных состояний: {e}")
+        return f"Ошибка при очистке просроченных состояний: {e}"
@@ -0,0 +1,193 @@
+import os
+import time
+import logging
+import threading
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from telebot.apihelper import ApiTelegramException
+
+from bot import bot
+from bot.models import FAQ, Instruction, PromoCodeCategory, TelegramFile, TypicalIssue
+from bot.outbound import outbound, outbound_priority, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+# Сколько файлов прогрева держать открытыми и в очереди одновременно
+PREWARM_BATCH_SIZE = 20
+
+
+def get_file_id(key: str) -> Optional[str]:
+    return TelegramFile.objects.filter(key=key).values_list('file_id', flat=True).first()
+
+
+def remember_file_id(key: str, file_id: str, replaces_prefix: Optional[str] = None) -> None:
+    TelegramFile.objects.update_or_create(key=key, defaults={'file_id': file_id})
+    if replaces_prefix:
+        # Прежние версии того же файла больше не понадобятся
+        TelegramFile.objects.filter(key__startswith=replaces_prefix).exclude(key=key).delete()
+
+
+def forget_file_id(key: str) -> None:
+    TelegramFile.objects.filter(key=key).delete()
+
+
+def _sent_file_id(message) -> Optional[str]:
+    """file_id из ответа Telegram на send_document"""
+    if message is None or getattr(message, 'document', None) is None:
+        return None
+    return message.document.file_id
+
+
+def send_cached_document(chat_id, key: str, file_path: str, replaces_prefix: Optional[str] = None, **kwargs):
+    """
+    Отправляет документ по file_id из кэша, а если его нет - загружает файл
+    и запоминает file_id из ответа Telegram. key должен меняться вместе с
+    содержимым файла (хэш, путь + время изменения и т.п.). replaces_prefix -
+    ключи прежних версий того же файла, которые удаляются после загрузки.
+    """
+    file_id = get_file_id(key)
+    if file_id:
+        try:
+            return bot.send_document(chat_id=chat_id, document=file_id, **kwargs)
+        except ApiTelegramException as e:
+            # file_id мог стать недействительным (например, сменился токен бота)
+            logger.warning(f"[WARNING] file_id для {key} не принят Telegram, загружаем заново: {e}")
+            forget_file_id(key)
+    with open(file_path, 'rb') as file:
+        message = bot.send_document(chat_id=chat_id, document=file, **kwargs)
+    file_id = _sent_file_id(message)
+    if file_id:
+        remember_file_id(key, file_id, replaces_prefix)
+    return message
+
+
+def field_file_key(field_file) -> str:
+    """
+    Ключ кэша для файла модели (FileField): путь в хранилище + время изменения
+    и размер. Замена файла в админке меняет ключ, и он загрузится заново.
+    """
+    stat = os.stat(field_file.path)
+    return f"file:{field_file.name}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def send_field_file(chat_id, field_file, **kwargs):
+    """Отправляет файл модели (инструкция, FAQ, решение) через кэш file_id"""
+    return send_cached_document(
+        chat_id, field_file_key(field_file), field_file.path,
+        replaces_prefix=f"file:{field_file.name}:", **kwargs
+    )
+
+
+def _catalog_files(product_ids: Optional[Iterable[int]] = None):
+    """
+    FileField всех документов каталога, которые бот отправляет пользователям;
+    product_ids - только этих товаров. Изображения товаров (ProductImage)
+    пользователям не отправляются, поэтому не прогреваются.
+    """
+    sources = [
+        (Instruction.objects.all(), 'pdf_file'),
+        (FAQ.objects.all(), 'pdf_file'),
+        (TypicalIssue.objects.all(), 'solution_file'),
+    ]
+    if product_ids is None:
+        # Категории промокодов не привязаны к товарам - только при полном прогреве
+        sources.append((PromoCodeCategory.objects.all(), 'instruction_file'))
+    for queryset, field in sources:
+        queryset = queryset.exclude(**{f"{field}__isnull": True}).exclude(**{field: ''})
+        if product_ids is not None:
+            queryset = queryset.filter(product_id__in=product_ids)
+        for obj in queryset.only('id', field):
+            yield getattr(obj, field)
+
+
+def _upload_batch(chat_id, batch: list) -> tuple:
+    """Ставит пакет загрузок в очередь исходящих сразу и ждет ответы"""
+    uploaded = failed = 0
+    pending = []
+    with outbound_priority(PRIORITY_BULK):
+        for field_file, key in batch:
+            try:
+                file = open(field_file.path, 'rb')
+            except OSError as e:
+                logger.error(f"[ERROR] Файл {field_file.name} недоступен: {e}")
+                failed += 1
+                continue
+            pending.append((field_file, key, file, bot.submit_request('send_document', chat_id=chat_id, document=file)))
+            if not settings.OUTBOUND_QUEUE:
+                # Без очереди исходящих темп для служебного чата держим сами
+                time.sleep(60 / settings.FILE_STORAGE_UPLOADS_PER_MINUTE)
+    for field_file, key, file, request in pending:
+        try:
+            file_id = _sent_file_id(request.result())
+            if file_id:
+                remember_file_id(key, file_id, replaces_prefix=f"file:{field_file.name}:")
+                uploaded += 1
+            else:
+                failed += 1
+        except Exception as e:
+            logger.error(f"[ERROR] Не удалось загрузить {field_file.name}: {e}")
+            failed += 1
+        finally:
+            file.close()
+    return uploaded, failed
+
+
+def prewarm_files(product_ids: Optional[Iterable[int]] = None) -> str:
+    """
+    Загружает в FILE_STORAGE_CHAT_ID все вложения каталога, для которых еще
+    нет file_id, чтобы первый пользователь не ждал загрузки. Загрузки идут
+    пакетами через очередь исходящих (bot.outbound) с приоритетом рассылок,
+    поэтому ответы пользователям идут первыми. Служебный чат - группа или
+    канал, для него действует свой лимит FILE_STORAGE_UPLOADS_PER_MINUTE.
+    """
+    chat_id = settings.FILE_STORAGE_CHAT_ID
+    if not chat_id:
+        return "FILE_STORAGE_CHAT_ID не задан, прогрев пропущен"
+    outbound.set_chat_limit(chat_id, settings.FILE_STORAGE_UPLOADS_PER_MINUTE / 60)
+    product_ids = list(product_ids) if product_ids is not None else None
+
+    todo = []
+    missing = 0
+    for field_file in _catalog_files(product_ids):
+        try:
+            key = field_file_key(field_file)
+        except OSError:
+            missing += 1
+            continue
+        todo.append((field_file, key))
+    cached = set(TelegramFile.objects.filter(key__in=[key for _, key in todo]).values_list('key', flat=True))
+    todo = [item for item in todo if item[1] not in cached]
+
+    uploaded = failed = 0
+    for start in range(0, len(todo), PREWARM_BATCH_SIZE):
+        done, errors = _upload_batch(chat_id, todo[start:start + PREWARM_BATCH_SIZE])
+        uploaded += done
+        failed += errors
+
+    result = f"Загружено: {uploaded}, уже в кэше: {len(cached)}, ошибок: {failed}, нет файла на диске: {missing}"
+    print(f"[LOG] Прогрев файлов: {result}")
+    logger.info(f"[LOG] Прогрев файлов: {result}")
+    return result
+
+
+def prewarm_files_async(product_ids: Optional[Iterable[int]] = None) -> Optional[threading.Thread]:
+    """Прогрев в фоновом потоке (после сохранения товара в админке)"""
+    if not settings.FILE_STORAGE_CHAT_ID:
+        return None
+    product_ids = list(product_ids) if product_ids is not None else None
+
+    def run():
+        close_old_connections()
+        try:
+            prewarm_files(product_ids)
+        except Exception as e:
+            print(f"[ERROR] Ошибка прогрева файлов: {e}")
+            logger.error(f"[ERROR] Ошибка прогрева файлов: {e}")
+        finally:
+            close_old_connections()
+
+    thread = threading.Thread(target=run, name="prewarm-files", daemon=True)
+    thread.start()
+    return thread
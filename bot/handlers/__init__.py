@@ -19,6 +19,9 @@ from .common import (
     confirm_review,
     cancel_review,
     send_excel_to_admin,
+    excel_export_choose_category,
+    excel_export_choose_product,
+    excel_export_run,
     admin_command,
     show_admin_panel,
     show_warranty_cases,
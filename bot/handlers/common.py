@@ -1,12 +1,16 @@
 from telebot.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from bot import bot
 from bot.texts import MAIN_TEXT, SUPPORT_TEXT, SUPPORT_LIMIT_REACHED, AI_ERROR
-from bot.texts import SEND_SCREENSHOT, SCREENSHOT_PROCESSING, SCREENSHOT_CHECKING, SCREENSHOT_INVALID, SCREENSHOT_VERIFIED, SCREENSHOT_LIMIT_REACHED
+from bot.texts import SEND_SCREENSHOT, SCREENSHOT_CHECKING, SCREENSHOT_INVALID, SCREENSHOT_VERIFIED, SCREENSHOT_LIMIT_REACHED
+from bot.texts import SCREENSHOT_ALREADY_CHECKING, SCREENSHOT_BUSY, SCREENSHOT_REUSED
 from bot.texts import WARRANTY_CONDITIONS_TEXT
 from bot.keyboards import main_markup, back_to_main_markup, get_product_menu_markup, get_main_markup_for_user
 from bot.keyboards import get_screenshot_markup, get_warranty_main_menu_markup
 from .registration import start_registration
-from bot.models import goods, goods_category, User, Support, FAQ, Instruction, TypicalIssue
+from bot.models import goods, goods_category, User, Support, FAQ, Instruction, TypicalIssue, ExtendedWarranty
+from bot.callback_data import callback_action, callback_id, pack
+from bot.context import get_user, save_user
+from bot.state import StateStore
 from .support import (
     show_support_menu, start_support_ozon, start_support_wildberries,
     handle_support_message, close_support_ticket, accept_support_ticket,
@@ -16,33 +20,36 @@ from .support import (
     support_select_product, support_select_issue, support_helped, support_not_helped, support_other
 )
 from .warranty import process_warranty_questionnaire_answer
-from bot.apis import analyze_screenshot
+from bot.apis import analyze_screenshot, download_photo
+from bot.apis.reference_images import get_reference_image
 from bot.apis.ai import OpenAIAPI
 from functools import wraps
 import json
 import os
 import logging
-import time
 import random
 import traceback
 from django.utils import timezone
 from django.conf import settings
 from bot.utils.excel_handler import WarrantyExcelHandler
+from bot.file_cache import send_cached_document, send_field_file
+from bot.vision_queue import vision_queue, RESERVED as VISION_RESERVED, DUPLICATE as VISION_DUPLICATE
+from bot.screenshot_cache import lookup_screenshot, remember_screenshot
 from telebot import TeleBot
 import re
 from collections import defaultdict
 
-# Словарь для отслеживания процесса активации расширенной гарантии
-warranty_activation_state = {}
+# Состояние для отслеживания процесса активации расширенной гарантии
+warranty_activation_state = StateStore('warranty_activation')
 
-# Словарь для хранения состояния ручного подтверждения скриншотов
-manual_confirmation_state = {}
+# Состояние для хранения состояния ручного подтверждения скриншотов
+manual_confirmation_state = StateStore('manual_confirmation')
 
-# Словарь для отслеживания состояния запроса номера телефона для гарантийных случаев
-warranty_case_phone_state = {}
+# Состояние для отслеживания состояния запроса номера телефона для гарантийных случаев
+warranty_case_phone_state = StateStore('warranty_case_phone')
 
-# Словарь для отслеживания состояния запроса описания проблемы
-warranty_case_description_state = {}
+# Состояние для отслеживания состояния запроса описания проблемы
+warranty_case_description_state = StateStore('warranty_case_description')
 
 logger = logging.getLogger(__name__)
 
@@ -53,12 +60,14 @@ def disable_ai_mode(func):
     def wrapper(*args, **kwargs):
         # Получаем объект call из аргументов
         call = next((arg for arg in args if isinstance(arg, CallbackQuery)), None)
-        if call and not call.data.startswith('support_'):
+        if call and not callback_action(call).startswith('support'):
             try:
-                user = User.objects.get(telegram_id=call.message.chat.id)
-                user.is_ai = False
-                user.chat_history = {}
-                user.save()
+                # Пользователь общий с хендлером, сохранение - в конце апдейта
+                user = get_user(call.message.chat.id)
+                if user.is_ai or user.chat_history:
+                    user.is_ai = False
+                    user.chat_history = {}
+                    save_user(user, 'is_ai', 'chat_history')
             except User.DoesNotExist:
                 pass
         return func(*args, **kwargs)
@@ -68,7 +77,7 @@ def disable_ai_mode(func):
 def start(message: Message) -> None:
     # Отключаем режим ИИ при команде /start
     try:
-        user = User.objects.get(telegram_id=message.chat.id)
+        user = get_user(message.chat.id)
         user.is_ai = False
         user.chat_history = {}
         user.save()
@@ -80,7 +89,7 @@ def start(message: Message) -> None:
 def menu_call(call: CallbackQuery) -> None:
     """Обработчик для возврата в главное меню"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         user.is_ai = False
         user.chat_history = {}
         user.save()
@@ -130,7 +139,7 @@ def show_categories(chat_id: int, message_id: int = None) -> None:
             for category in categories:
                 btn = InlineKeyboardButton(
                     category.name, 
-                    callback_data=f"category_{category.id}"
+                    callback_data=pack("category", category.id)
                 )
                 markup.add(btn)
             
@@ -183,10 +192,7 @@ def show_categories(chat_id: int, message_id: int = None) -> None:
 def show_category_products(call: CallbackQuery) -> None:
     print(f"[DEBUG] call.data: {call.data}")
     try:
-        parts = call.data.split('_')
-        if len(parts) != 2:
-            raise ValueError("Неверный формат callback_data")
-        category_id = int(parts[1])
+        category_id = callback_id(call)
         
         try:
             category = goods_category.objects.get(id=category_id)
@@ -209,7 +215,7 @@ def show_category_products(call: CallbackQuery) -> None:
             for product in products:
                 btn = InlineKeyboardButton(
                     product.name,
-                    callback_data=f"product_{product.id}"
+                    callback_data=pack("product", product.id)
                 )
                 markup.add(btn)
             
@@ -254,20 +260,17 @@ def delete_previous_messages(chat_id: int, user: User) -> None:
                 print(f"[ERROR] Ошибка при удалении сообщения: {e}")
         user.messages_count = 0
         user.last_message_id = None
-        user.save()
+        save_user(user, 'messages_count', 'last_message_id')
 
 
 @disable_ai_mode
 def show_product_menu(call: CallbackQuery) -> None:
     """Показывает меню товара"""
     try:
-        parts = call.data.split('_')
-        if len(parts) != 2:
-            raise ValueError("Неверный формат callback_data")
-        product_id = int(parts[1])
+        product_id = callback_id(call)
         
         try:
-            user = User.objects.get(telegram_id=call.message.chat.id)
+            user = get_user(call.message.chat.id)
             # Удаляем предыдущие сообщения
             delete_previous_messages(call.message.chat.id, user)
         except User.DoesNotExist:
@@ -370,7 +373,7 @@ def send_long_message(chat_id: int, text: str, message_id: int = None, markup=No
     MAX_LENGTH = 4096
     
     try:
-        user = User.objects.get(telegram_id=chat_id)
+        user = get_user(chat_id)
         
         if len(text) <= MAX_LENGTH:
             if message_id:
@@ -410,7 +413,7 @@ def send_long_message(chat_id: int, text: str, message_id: int = None, markup=No
                         user.last_message_id = str(msg.message_id)
             user.messages_count = len(parts)
         
-        user.save()
+        save_user(user, 'messages_count', 'last_message_id')
         
     except User.DoesNotExist:
         # Если пользователь не найден, просто отправляем сообщение
@@ -450,7 +453,7 @@ def reset_user_messages(user: User) -> None:
     """Сбрасывает счетчик сообщений пользователя"""
     user.messages_count = 0
     user.last_message_id = None
-    user.save()
+    save_user(user, 'messages_count', 'last_message_id')
 
 @disable_ai_mode
 def show_product_info(call: CallbackQuery) -> None:
@@ -472,12 +475,8 @@ def show_product_info(call: CallbackQuery) -> None:
             return
         
         # Получаем тип информации и ID товара из callback_data
-        parts = call.data.split('_')
-        if len(parts) < 2:
-            raise ValueError("Неверный формат callback_data")
-            
-        info_type = parts[0]
-        product_id = int(parts[1])
+        info_type = callback_action(call)
+        product_id = callback_id(call)
         
         # Проверяем, что тип информации валидный
         if info_type not in ['instructions', 'faq', 'issues']:
@@ -487,7 +486,7 @@ def show_product_info(call: CallbackQuery) -> None:
         
         # Для всех разделов — только кнопка назад к товару
         markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=f"product_{product_id}"))
+        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=pack("product", product_id)))
 
         # Удаляем предыдущее сообщение
         try:
@@ -518,7 +517,7 @@ def show_product_info(call: CallbackQuery) -> None:
                     markup.add(btn)
                 
                 # Добавляем кнопку назад
-                back_btn = InlineKeyboardButton("⬅️ Назад", callback_data=f"product_{product_id}")
+                back_btn = InlineKeyboardButton("⬅️ Назад", callback_data=pack("product", product_id))
                 markup.add(back_btn)
                 
                 text = f"📖 Инструкции для товара {product.name}:\n\nВыберите нужную инструкцию:"
@@ -561,7 +560,7 @@ def show_product_info(call: CallbackQuery) -> None:
                     markup.add(btn)
                 
                 # Добавляем кнопку назад
-                back_btn = InlineKeyboardButton("⬅️ Назад", callback_data=f"product_{product_id}")
+                back_btn = InlineKeyboardButton("⬅️ Назад", callback_data=pack("product", product_id))
                 markup.add(back_btn)
                 
                 text = f"❓ Часто задаваемые вопросы о {product.name}:\n\nВыберите интересующий вопрос:"
@@ -592,19 +591,19 @@ def show_product_info(call: CallbackQuery) -> None:
                 for issue in issues:
                     btn = InlineKeyboardButton(
                         f"⚠️ {issue.title}",
-                        callback_data=f"warranty_issue_{issue.id}"
+                        callback_data=pack("warranty_issue", issue.id)
                     )
                     markup.add(btn)
                 
                 # Добавляем кнопку "Другое"
                 other_btn = InlineKeyboardButton(
                     "❓ Другое",
-                    callback_data=f"warranty_other_{product_id}"
+                    callback_data=pack("warranty_other", product_id)
                 )
                 markup.add(other_btn)
                 
                 # Добавляем кнопку назад
-                back_btn = InlineKeyboardButton("⬅️ Назад", callback_data=f"product_{product_id}")
+                back_btn = InlineKeyboardButton("⬅️ Назад", callback_data=pack("product", product_id))
                 markup.add(back_btn)
                 
                 text = f"⚠️ Типичные проблемы для товара {product.name}:\n\nВыберите проблему, с которой вы столкнулись:"
@@ -642,10 +641,7 @@ def show_product_info(call: CallbackQuery) -> None:
 def activate_warranty(call: CallbackQuery) -> None:
     """Начинает процесс активации расширенной гарантии"""
     try:
-        parts = call.data.split('_')
-        if len(parts) != 3:
-            raise ValueError("Неверный формат callback_data")
-        product_id = int(parts[2])
+        product_id = callback_id(call)
         print(f"[LOG] Запрос на активацию гарантии от пользователя {call.message.chat.id} для товара {product_id}")
         logger.info(f"[LOG] Запрос на активацию гарантии от пользователя {call.message.chat.id} для товара {product_id}")
         
@@ -680,10 +676,7 @@ def activate_warranty(call: CallbackQuery) -> None:
 def cancel_warranty_activation(call: CallbackQuery) -> None:
     """Отменяет процесс активации расширенной гарантии"""
     try:
-        parts = call.data.split('_')
-        if len(parts) != 3:
-            raise ValueError("Неверный формат callback_data")
-        product_id = int(parts[2])
+        product_id = callback_id(call)
         print(f"[LOG] Отмена активации гарантии пользователем {call.message.chat.id} для товара {product_id}")
         logger.info(f"[LOG] Отмена активации гарантии пользователем {call.message.chat.id} для товара {product_id}")
         
@@ -729,12 +722,8 @@ def check_screenshot(message: Message) -> None:
         user, created = User.objects.get_or_create(telegram_id=message.chat.id)
         
         # Проверяем лимит скриншотов в день
-        today = timezone.now().date()
-        
         # Если дата последнего скриншота не сегодня, сбрасываем счетчик
-        if user.last_screenshot_date != today:
-            user.screenshots_count = 0
-            user.last_screenshot_date = today
+        user.reset_screenshots_if_stale()
         
         # Проверяем, не превышен ли лимит
         if user.screenshots_count >= 3:
@@ -747,226 +736,49 @@ def check_screenshot(message: Message) -> None:
             logger.info(f"[LOG] Пользователь {message.chat.id} достиг лимита скриншотов")
             return
         
-        # Увеличиваем счетчик скриншотов
-        user.screenshots_count += 1
-        user.save()
-        print(f"[LOG] Счетчик скриншотов для пользователя {message.chat.id}: {user.screenshots_count}")
-        logger.info(f"[LOG] Счетчик скриншотов для пользователя {message.chat.id}: {user.screenshots_count}")
-        
-        # Отправляем мгновенное подтверждение получения фото
-        msg = bot.send_message(
-            chat_id=message.chat.id,
-            text=SCREENSHOT_PROCESSING
-        )
-        print(f"[LOG] Отправлено подтверждение получения фото")
+        # Если пользователь не в процессе активации гарантии - проверять нечего
+        activation = warranty_activation_state.get(message.chat.id)
+        if not activation or not activation.get('waiting_for_screenshot'):
+            print(f"[LOG] Пользователь не в процессе активации гарантии")
+            bot.send_message(
+                chat_id=message.chat.id,
+                text="Спасибо за фотографию! Если вы хотите активировать расширенную гарантию, перейдите в раздел гарантии товара."
+            )
+            return
         
-        # Получаем фото максимального размера
-        if message.photo:
-            photo = message.photo[-1]
-            file_id = photo.file_id
-            print(f"[LOG] ID файла: {file_id}")
+        # Одна проверка на пользователя и ограниченная очередь
+        status = vision_queue.reserve(message.chat.id)
+        if status != VISION_RESERVED:
+            bot.send_message(
+                chat_id=message.chat.id,
+                text=SCREENSHOT_ALREADY_CHECKING if status == VISION_DUPLICATE else SCREENSHOT_BUSY
+            )
+            print(f"[LOG] Скриншот пользователя {message.chat.id} не принят в проверку: {status}")
+            logger.info(f"[LOG] Скриншот пользователя {message.chat.id} не принят в проверку: {status}")
+            return
         
-        # Если пользователь в процессе активации гарантии
-        if message.chat.id in warranty_activation_state and warranty_activation_state[message.chat.id].get('waiting_for_screenshot'):
-            print(f"[LOG] Пользователь в процессе активации гарантии")
-            
-            # Получаем информацию о товаре
-            product_id = warranty_activation_state[message.chat.id]['product_id']
-            print(f"[LOG] Product ID: {product_id}")
-            
-            # Проверяем, есть ли у товара изображение
-            product = goods.objects.get(id=product_id)
-            has_product_image = product.images.exists()
-            print(f"[LOG] У товара есть изображение: {has_product_image}")
+        try:
+            # Увеличиваем счетчик скриншотов
+            user.screenshots_count += 1
+            user.save()
+            print(f"[LOG] Счетчик скриншотов для пользователя {message.chat.id}: {user.screenshots_count}")
+            logger.info(f"[LOG] Счетчик скриншотов для пользователя {message.chat.id}: {user.screenshots_count}")
             
-            # Обновляем сообщение с информацией о проверке
-            bot.edit_message_text(
+            # Сразу отвечаем пользователю, результат проверки придет правкой этого сообщения
+            msg = bot.send_message(
                 chat_id=message.chat.id,
-                message_id=msg.message_id,
                 text=SCREENSHOT_CHECKING
             )
-            print(f"[LOG] Сообщение обновлено: проверка скриншота")
             
-            # Имитируем задержку обработки
-            time.sleep(2)
+            # Получаем фото максимального размера
+            photo = message.photo[-1]
+            print(f"[LOG] ID файла: {photo.file_id}, Product ID: {activation['product_id']}")
             
-            # Анализируем скриншот с помощью компьютерного зрения
-            try:
-                print(f"[LOG] Начинаем анализ скриншота")
-                analysis_result = analyze_screenshot(photo, bot, product_id)
-                print(f"[LOG] Результат анализа: {analysis_result}")
-                
-                is_valid = analysis_result['has_5_stars']
-                confidence = analysis_result.get('confidence', 0)
-                stars_count = analysis_result.get('stars_count', 0)
-                review_date = analysis_result.get('review_date')
-                product_match = analysis_result.get('product_match')
-                
-                # Логируем результат анализа
-                print(f"[LOG] Скриншот содержит {stars_count} звезд, уверенность: {confidence}%")
-                if review_date:
-                    print(f"[LOG] Дата отзыва: {review_date}")
-                if product_match is not None:
-                    print(f"[LOG] Соответствие товара: {product_match}")
-                logger.info(f"[LOG] Скриншот содержит {stars_count} звезд, уверенность: {confidence}%")
-                
-                # Отправляем информацию в лог-чат
-                if settings.CHAT_LOG_ID:
-                    try:
-                        product = goods.objects.get(id=product_id)
-                        # Если дата отзыва не определена, используем текущую дату
-                        review_date = review_date if review_date else timezone.now().strftime("%d.%m.%Y")
-                        log_message = (
-                            f"📸 Новый скриншот отзыва\n\n"
-                            f"👤 Пользователь: {user.user_name} (ID: {user.telegram_id})\n"
-                            f"📱 Товар: {product.name}\n"
-                            f"⭐️ Количество звезд: {stars_count}\n"
-                            f"📊 Уверенность: {confidence}%\n"
-                            f"📅 Дата отзыва: {review_date}\n"
-                        )
-                        if product_match is not None:
-                            log_message += f"🔄 Соответствие товара: {'Да' if product_match else 'Нет'}\n"
-                        log_message += f"✅ Результат проверки: {'Успешно' if is_valid else 'Не пройдена'}"
-                        
-                        # Отправляем скриншот с информацией одним сообщением
-                        bot.send_photo(
-                            chat_id=settings.CHAT_LOG_ID,
-                            photo=file_id,
-                            caption=log_message
-                        )
-                    except Exception as e:
-                        print(f"[ERROR] Ошибка при отправке лога: {e}")
-                        logger.error(f"[ERROR] Ошибка при отправке лога: {e}")
-                
-                # Проверяем все условия для активации гарантии
-                should_block = False
-                
-                print(f"[LOG] Проверка условий активации:")
-                print(f"[LOG] - 5 звезд: {is_valid}")
-                print(f"[LOG] - Товар возвращен: {analysis_result.get('is_returned', False)}")
-                print(f"[LOG] - Несколько товаров: {analysis_result.get('has_multiple_products', False)}")
-                print(f"[LOG] - У товара есть изображение: {has_product_image}")
-                print(f"[LOG] - Соответствие товара: {product_match}")
-                print(f"[LOG] - Название товара: {product.name}")
-                
-                # КРИТИЧНО: Проверяем в правильном порядке
-                # 1. Сначала базовые условия
-                if not is_valid:
-                    should_block = True
-                    print(f"[LOG] Блокировка: нет 5 звезд")
-                elif analysis_result.get('is_returned', False):
-                    should_block = True
-                    print(f"[LOG] Блокировка: товар возвращен")
-                elif analysis_result.get('has_multiple_products', False):
-                    should_block = True
-                    print(f"[LOG] Блокировка: несколько товаров")
-                # 2. Только если базовые условия пройдены, проверяем соответствие товара
-                elif has_product_image and product_match is not True:
-                    should_block = True
-                    print(f"[LOG] КРИТИЧНО: Блокировка - товар не соответствует (есть изображение)")
-                    print(f"[LOG] Детали: product_match={product_match}, has_product_image={has_product_image}")
-                
-                print(f"[LOG] Итоговое решение: {'Блокировать' if should_block else 'Разрешить'}")
-                
-                if should_block:
-                    # Формируем сообщение в зависимости от результатов проверки
-                    message_parts = []
-                    
-                    if analysis_result.get('is_returned', False):
-                        message_parts.append(
-                            "Товар возвращен или отменен. Расширенная гарантия недоступна."
-                        )
-                    elif analysis_result.get('has_multiple_products', False):
-                        message_parts.append(
-                            "На скриншоте обнаружено несколько товаров. Пожалуйста, отправьте скриншот только с одним товаром."
-                        )
-                    elif has_product_image and product_match is False:
-                        message_parts.append(
-                            f"❌ Товар в отзыве НЕ соответствует запрошенному товару '{product.name}'. "
-                            f"Пожалуйста, убедитесь, что вы отправляете скриншот отзыва именно этого товара. "
-                            f"Товары должны быть ОДИНАКОВЫМИ по типу, внешнему виду и функциональности."
-                        )
-                    elif has_product_image and product_match is None:
-                        message_parts.append(
-                            f"❓ Не удалось определить соответствие товара '{product.name}'. "
-                            f"Пожалуйста, убедитесь, что отправляете скриншот отзыва правильного товара. "
-                            f"Товары должны быть ОДИНАКОВЫМИ по типу, внешнему виду и функциональности."
-                        )
-                    elif stars_count > 0 and stars_count < 5:
-                        message_parts.append(
-                            f"Мы сожалеем, что вам не понравился наш продукт. 😔\n\n"
-                            f"В вашем отзыве обнаружено {stars_count} звезд. К сожалению, мы не можем предоставить вам расширенную гарантию, "
-                            f"так как не выполнено условие получения - отзыв с 5 звездами.\n\n"
-                            f"Для получения расширенной гарантии необходимо:\n"
-                            f"1. Оставить отзыв с 5 звездами\n"
-                            f"2. Отправить скриншот этого отзыва\n\n"
-                            f"Вы можете изменить свой отзыв на 5 звезд и отправить новый скриншот."
-                        )
-                    else:
-                        message_parts.append(analysis_result.get('message', SCREENSHOT_INVALID))
-                    
-                    message_text = "\n\n".join(message_parts)
-                    
-                    # Создаем клавиатуру с кнопками
-                    markup = InlineKeyboardMarkup()
-                    resend_btn = InlineKeyboardButton("🔄 Отправить другой скриншот", 
-                                                     callback_data=f"cancel_review_{product_id}")
-                    markup.add(resend_btn)
-                    
-                    # Сохраняем состояние ожидания ручного подтверждения
-                    manual_confirmation_state[message.chat.id] = {
-                        'product_id': product_id,
-                        'message_id': msg.message_id,
-                        'photo_id': photo.file_id,
-                        'review_date': review_date
-                    }
-                    
-                    # Отправляем сообщение с результатом проверки
-                    bot.edit_message_text(
-                        chat_id=message.chat.id,
-                        message_id=msg.message_id,
-                        text=message_text,
-                        reply_markup=markup
-                    )
-                    
-                    print(f"[LOG] Отправлено сообщение о необходимости 5 звезд или правильного товара")
-                    logger.info(f"[LOG] Отправлено сообщение о необходимости 5 звезд или правильного товара")
-                    return
-                
-                # Если скриншот прошел проверку
-                bot.edit_message_text(
-                    chat_id=message.chat.id,
-                    message_id=msg.message_id,
-                    text=f"{SCREENSHOT_VERIFIED}\n\nУверенность определения: {confidence}%"
-                )
-                print(f"[LOG] Скриншот прошел проверку")
-                logger.info(f"[LOG] Скриншот прошел проверку")
-                
-                # Активируем расширенную гарантию для пользователя
-                activate_extended_warranty(message.chat.id, product_id, msg.message_id, photo.file_id, review_date)
-                
-            except Exception as e:
-                print(f"[ERROR] Ошибка при анализе скриншота: {e}")
-                logger.error(f"[ERROR] Ошибка при анализе скриншота: {e}")
-                
-                # Сохраняем состояние ожидания ручного подтверждения
-                manual_confirmation_state[message.chat.id] = {
-                    'product_id': product_id,
-                    'message_id': msg.message_id,
-                    'photo_id': photo.file_id
-                }
-                
-                print(f"[LOG] Запрос ручного подтверждения отправлен пользователю после ошибки")
-                logger.info(f"[LOG] Запрос ручного подтверждения отправлен пользователю после ошибки")
-                
-        else:
-            # Если пользователь не в процессе активации гарантии
-            print(f"[LOG] Пользователь не в процессе активации гарантии")
-            bot.edit_message_text(
-                chat_id=message.chat.id,
-                message_id=msg.message_id,
-                text="Спасибо за фотографию! Если вы хотите активировать расширенную гарантию, перейдите в раздел гарантии товара."
-            )
+            # Анализ (запрос к модели компьютерного зрения) выполняет пул vision_queue
+            vision_queue.start(message.chat.id, process_screenshot, message.chat.id, msg.message_id, photo, activation['product_id'])
+        except Exception:
+            vision_queue.release(message.chat.id)
+            raise
     
     except Exception as e:
         print(f"[ERROR] ОШИБКА В ФУНКЦИИ check_screenshot: {e}")
@@ -981,13 +793,287 @@ def check_screenshot(message: Message) -> None:
         )
 
 
+def process_screenshot(chat_id, message_id, photo, product_id) -> None:
+    """
+    Проверка скриншота в пуле vision_queue: анализ, ответ правкой сообщения
+    message_id и активация гарантии при успехе.
+    """
+    try:
+        user = get_user(chat_id)
+        file_id = photo.file_id
+        
+        # Проверяем, есть ли у товара изображение
+        product = goods.objects.get(id=product_id)
+        has_product_image = get_reference_image(product_id) is not None
+        print(f"[LOG] У товара есть изображение: {has_product_image}")
+
+        # Анализируем скриншот с помощью компьютерного зрения
+        try:
+            # Тот же (или пересжатый) скриншот уже проверялся - берем вердикт из кэша
+            image_data = _download_screenshot(photo)
+            lookup = lookup_screenshot(photo, image_data, chat_id, product_id) if image_data else None
+            if lookup is not None and lookup.reused:
+                report_screenshot_reuse(chat_id, message_id, photo, product, lookup)
+                return
+            if lookup is not None and lookup.foreign:
+                # Похож на чужой, но не копия: проверяем как обычно, админу - на ручную проверку
+                _log_screenshot_reuse(chat_id, photo, product, lookup, suspected=True)
+            photo_id = photo.file_id
+            if lookup is not None and lookup.verdict is not None:
+                analysis_result = lookup.verdict
+                # Исходный file_id: повторная активация по тому же скриншоту будет отклонена
+                photo_id = lookup.match.file_id
+                print(f"[LOG] Скриншот уже проверялся (#{lookup.match.id}), запрос к модели не нужен")
+                logger.info(f"[LOG] Скриншот уже проверялся (#{lookup.match.id}), запрос к модели не нужен")
+            else:
+                print(f"[LOG] Начинаем анализ скриншота")
+                analysis_result = analyze_screenshot(photo, bot, product_id, image_data=image_data)
+                if lookup is not None:
+                    _remember_screenshot(lookup, photo, product_id, analysis_result)
+            print(f"[LOG] Результат анализа: {analysis_result}")
+
+            is_valid = analysis_result['has_5_stars']
+            confidence = analysis_result.get('confidence', 0)
+            stars_count = analysis_result.get('stars_count', 0)
+            review_date = analysis_result.get('review_date')
+            product_match = analysis_result.get('product_match')
+
+            # Логируем результат анализа
+            print(f"[LOG] Скриншот содержит {stars_count} звезд, уверенность: {confidence}%")
+            if review_date:
+                print(f"[LOG] Дата отзыва: {review_date}")
+            if product_match is not None:
+                print(f"[LOG] Соответствие товара: {product_match}")
+            logger.info(f"[LOG] Скриншот содержит {stars_count} звезд, уверенность: {confidence}%")
+
+            # Отправляем информацию в лог-чат
+            if settings.CHAT_LOG_ID:
+                try:
+                    product = goods.objects.get(id=product_id)
+                    # Если дата отзыва не определена, используем текущую дату
+                    review_date = review_date if review_date else timezone.now().strftime("%d.%m.%Y")
+                    log_message = (
+                        f"📸 Новый скриншот отзыва\n\n"
+                        f"👤 Пользователь: {user.user_name} (ID: {user.telegram_id})\n"
+                        f"📱 Товар: {product.name}\n"
+                        f"⭐️ Количество звезд: {stars_count}\n"
+                        f"📊 Уверенность: {confidence}%\n"
+                        f"📅 Дата отзыва: {review_date}\n"
+                    )
+                    if product_match is not None:
+                        log_message += f"🔄 Соответствие товара: {'Да' if product_match else 'Нет'}\n"
+                    log_message += f"✅ Результат проверки: {'Успешно' if is_valid else 'Не пройдена'}"
+
+                    # Отправляем скриншот с информацией одним сообщением
+                    bot.send_photo(
+                        chat_id=settings.CHAT_LOG_ID,
+                        photo=file_id,
+                        caption=log_message
+                    )
+                except Exception as e:
+                    print(f"[ERROR] Ошибка при отправке лога: {e}")
+                    logger.error(f"[ERROR] Ошибка при отправке лога: {e}")
+
+            # Проверяем все условия для активации гарантии
+            should_block = False
+
+            print(f"[LOG] Проверка условий активации:")
+            print(f"[LOG] - 5 звезд: {is_valid}")
+            print(f"[LOG] - Товар возвращен: {analysis_result.get('is_returned', False)}")
+            print(f"[LOG] - Несколько товаров: {analysis_result.get('has_multiple_products', False)}")
+            print(f"[LOG] - У товара есть изображение: {has_product_image}")
+            print(f"[LOG] - Соответствие товара: {product_match}")
+            print(f"[LOG] - Название товара: {product.name}")
+
+            # КРИТИЧНО: Проверяем в правильном порядке
+            # 1. Сначала базовые условия
+            if not is_valid:
+                should_block = True
+                print(f"[LOG] Блокировка: нет 5 звезд")
+            elif analysis_result.get('is_returned', False):
+                should_block = True
+                print(f"[LOG] Блокировка: товар возвращен")
+            elif analysis_result.get('has_multiple_products', False):
+                should_block = True
+                print(f"[LOG] Блокировка: несколько товаров")
+            # 2. Только если базовые условия пройдены, проверяем соответствие товара
+            elif has_product_image and product_match is not True:
+                should_block = True
+                print(f"[LOG] КРИТИЧНО: Блокировка - товар не соответствует (есть изображение)")
+                print(f"[LOG] Детали: product_match={product_match}, has_product_image={has_product_image}")
+
+            print(f"[LOG] Итоговое решение: {'Блокировать' if should_block else 'Разрешить'}")
+
+            if should_block:
+                # Формируем сообщение в зависимости от результатов проверки
+                message_parts = []
+
+                if analysis_result.get('is_returned', False):
+                    message_parts.append(
+                        "Товар возвращен или отменен. Расширенная гарантия недоступна."
+                    )
+                elif analysis_result.get('has_multiple_products', False):
+                    message_parts.append(
+                        "На скриншоте обнаружено несколько товаров. Пожалуйста, отправьте скриншот только с одним товаром."
+                    )
+                elif has_product_image and product_match is False:
+                    message_parts.append(
+                        f"❌ Товар в отзыве НЕ соответствует запрошенному товару '{product.name}'. "
+                        f"Пожалуйста, убедитесь, что вы отправляете скриншот отзыва именно этого товара. "
+                        f"Товары должны быть ОДИНАКОВЫМИ по типу, внешнему виду и функциональности."
+                    )
+                elif has_product_image and product_match is None:
+                    message_parts.append(
+                        f"❓ Не удалось определить соответствие товара '{product.name}'. "
+                        f"Пожалуйста, убедитесь, что отправляете скриншот отзыва правильного товара. "
+                        f"Товары должны быть ОДИНАКОВЫМИ по типу, внешнему виду и функциональности."
+                    )
+                elif stars_count > 0 and stars_count < 5:
+                    message_parts.append(
+                        f"Мы сожалеем, что вам не понравился наш продукт. 😔\n\n"
+                        f"В вашем отзыве обнаружено {stars_count} звезд. К сожалению, мы не можем предоставить вам расширенную гарантию, "
+                        f"так как не выполнено условие получения - отзыв с 5 звездами.\n\n"
+                        f"Для получения расширенной гарантии необходимо:\n"
+                        f"1. Оставить отзыв с 5 звездами\n"
+                        f"2. Отправить скриншот этого отзыва\n\n"
+                        f"Вы можете изменить свой отзыв на 5 звезд и отправить новый скриншот."
+                    )
+                else:
+                    message_parts.append(analysis_result.get('message', SCREENSHOT_INVALID))
+
+                message_text = "\n\n".join(message_parts)
+
+                # Создаем клавиатуру с кнопками
+                markup = InlineKeyboardMarkup()
+                resend_btn = InlineKeyboardButton("🔄 Отправить другой скриншот", 
+                                                 callback_data=pack("cancel_review", product_id))
+                markup.add(resend_btn)
+
+                # Сохраняем состояние ожидания ручного подтверждения
+                manual_confirmation_state[chat_id] = {
+                    'product_id': product_id,
+                    'message_id': message_id,
+                    'photo_id': photo_id,
+                    'review_date': review_date
+                }
+
+                # Отправляем сообщение с результатом проверки
+                bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=message_text,
+                    reply_markup=markup
+                )
+
+                print(f"[LOG] Отправлено сообщение о необходимости 5 звезд или правильного товара")
+                logger.info(f"[LOG] Отправлено сообщение о необходимости 5 звезд или правильного товара")
+                return
+
+            # Если скриншот прошел проверку
+            bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=f"{SCREENSHOT_VERIFIED}\n\nУверенность определения: {confidence}%"
+            )
+            print(f"[LOG] Скриншот прошел проверку")
+            logger.info(f"[LOG] Скриншот прошел проверку")
+
+            # Активируем расширенную гарантию для пользователя
+            activate_extended_warranty(chat_id, product_id, message_id, photo_id, review_date)
+
+        except Exception as e:
+            print(f"[ERROR] Ошибка при анализе скриншота: {e}")
+            logger.error(f"[ERROR] Ошибка при анализе скриншота: {e}")
+
+            # Сохраняем состояние ожидания ручного подтверждения
+            manual_confirmation_state[chat_id] = {
+                'product_id': product_id,
+                'message_id': message_id,
+                'photo_id': photo.file_id
+            }
+
+            print(f"[LOG] Запрос ручного подтверждения отправлен пользователю после ошибки")
+            logger.info(f"[LOG] Запрос ручного подтверждения отправлен пользователю после ошибки")
+
+    except Exception as e:
+        print(f"[ERROR] Ошибка при проверке скриншота пользователя {chat_id}: {e}")
+        logger.error(f"[ERROR] Ошибка при проверке скриншота пользователя {chat_id}: {e}")
+        bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text="Произошла ошибка при обработке фотографии. Пожалуйста, попробуйте еще раз."
+        )
+
+
+
+def _download_screenshot(photo):
+    """Скачивает скриншот; при ошибке None - analyze_screenshot попробует сам"""
+    try:
+        return download_photo(photo, bot)
+    except Exception as e:
+        logger.error(f"[ERROR] Не удалось скачать скриншот {photo.file_id}: {e}")
+        return None
+
+
+def _remember_screenshot(lookup, photo, product_id, analysis_result) -> None:
+    """Сохраняет отпечаток скриншота; вердикт - только если ответила модель"""
+    try:
+        verdict = analysis_result if analysis_result.get('source') == 'api' else None
+        remember_screenshot(lookup, photo, product_id, verdict)
+    except Exception as e:
+        logger.error(f"[ERROR] Не удалось сохранить отпечаток скриншота: {e}")
+
+
+def report_screenshot_reuse(chat_id, message_id, photo, product, lookup) -> None:
+    """Скриншот уже присылал другой пользователь: отказ и уведомление в лог-чат"""
+    _remember_screenshot(lookup, photo, product.id, {})
+
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton("🔄 Отправить другой скриншот", callback_data=pack("cancel_review", product.id)))
+    bot.edit_message_text(
+        chat_id=chat_id,
+        message_id=message_id,
+        text=SCREENSHOT_REUSED,
+        reply_markup=markup
+    )
+    _log_screenshot_reuse(chat_id, photo, product, lookup, suspected=False)
+
+
+def _log_screenshot_reuse(chat_id, photo, product, lookup, suspected: bool) -> None:
+    """Уведомление в лог-чат о скриншоте, похожем на скриншот другого пользователя"""
+    original = lookup.match
+    print(f"[LOG] Пользователь {chat_id}: скриншот похож на #{original.id} пользователя {original.user_id}, расстояние {lookup.distance}")
+    logger.warning(f"[WARNING] Пользователь {chat_id}: скриншот похож на #{original.id} пользователя {original.user_id}, расстояние {lookup.distance}")
+    if not settings.CHAT_LOG_ID:
+        return
+    head = (
+        "🔎 Скриншот похож на чужой - нужна ручная проверка" if suspected
+        else "⚠️ Повторное использование скриншота - отказ"
+    )
+    try:
+        bot.send_photo(
+            chat_id=settings.CHAT_LOG_ID,
+            photo=photo.file_id,
+            caption=(
+                f"{head}\n\n"
+                f"👤 Пользователь: {chat_id}\n"
+                f"📱 Товар: {product.name}\n"
+                f"🔁 Похожий прислал: {original.user_id} "
+                f"({timezone.localtime(original.created_at).strftime('%d.%m.%Y %H:%M')}), "
+                f"отличие: {lookup.distance} бит"
+            )
+        )
+    except Exception as e:
+        print(f"[ERROR] Ошибка при отправке лога: {e}")
+        logger.error(f"[ERROR] Ошибка при отправке лога: {e}")
+
 @disable_ai_mode
 def activate_extended_warranty(chat_id, product_id, message_id=None, photo_id=None, review_date=None):
     """Активирует расширенную гарантию для пользователя"""
     try:
         print(f"[LOG] Активация расширенной гарантии для пользователя {chat_id} на товар {product_id}")
         product = goods.objects.get(id=product_id)
-        user = User.objects.get(telegram_id=chat_id)
+        user = get_user(chat_id)
         if not product.is_active:
             error_text = "Товар неактивен. Расширенная гарантия недоступна."
             send_long_message(chat_id, error_text, message_id)
@@ -996,29 +1082,11 @@ def activate_extended_warranty(chat_id, product_id, message_id=None, photo_id=No
             error_text = "Товар возвращен или отменен. Расширенная гарантия недоступна."
             send_long_message(chat_id, error_text, message_id)
             return
-        warranty_data = user.warranty_data or []
-        if isinstance(warranty_data, dict):
-            migrated = []
-            for pid, data in warranty_data.items():
-                if isinstance(data, dict):
-                    info = data.get('info', {})
-                    migrated.append({
-                        'product_id': int(pid),
-                        'name': info.get('name', ''),
-                        'warranty_period': info.get('warranty_period', ''),
-                        'end_date': info.get('end_date', ''),
-                        'purchase_date': info.get('review_date', ''),
-                        'screenshot': data.get('screenshot'),
-                        'status': info.get('status', 'Активна')
-                    })
-            warranty_data = migrated
         # Проверка на дублирование скриншота
-        if photo_id:
-            for w in warranty_data:
-                if w.get('product_id') == product.id and w.get('screenshot') and w['screenshot'].get('photo_id') == photo_id:
-                    error_text = "Вы уже использовали этот скриншот для активации гарантии по этому товару. Пожалуйста, отправьте другой скриншот."
-                    send_long_message(chat_id, error_text, message_id)
-                    return
+        if photo_id and ExtendedWarranty.objects.filter(user=user, product=product, screenshot_id=photo_id).exists():
+            error_text = "Вы уже использовали этот скриншот для активации гарантии по этому товару. Пожалуйста, отправьте другой скриншот."
+            send_long_message(chat_id, error_text, message_id)
+            return
         if review_date:
             try:
                 start_date = timezone.datetime.strptime(review_date, "%d.%m.%Y")
@@ -1029,35 +1097,23 @@ def activate_extended_warranty(chat_id, product_id, message_id=None, photo_id=No
             review_date = start_date.strftime("%d.%m.%Y")
         warranty_years = product.extended_warranty
         end_date = start_date + timezone.timedelta(days=int(warranty_years * 365))
-        start_date_str = start_date.strftime("%d.%m.%Y")
         end_date_str = end_date.strftime("%d.%m.%Y")
         if warranty_years.is_integer():
             warranty_text = f"{int(warranty_years)} {'год' if warranty_years == 1 else 'года' if 1 < warranty_years < 5 else 'лет'}"
         else:
             months = int(warranty_years * 12)
             warranty_text = f"{months} {'месяц' if months == 1 else 'месяца' if 1 < months < 5 else 'месяцев'}"
-        warranty_info = {
-            'product_id': product.id,
-            'name': product.name,
-            'warranty_period': warranty_text,
-            'end_date': end_date_str,
-            'purchase_date': start_date_str,
-            'screenshot': {'photo_id': photo_id, 'upload_date': timezone.now().strftime("%d.%m.%Y %H:%M:%S")} if photo_id else None,
-            'status': 'Активна'
-        }
-        warranty_data.append(warranty_info)
-        user.warranty_data = warranty_data
-        user.save()
-        excel_handler = WarrantyExcelHandler()
-        user_data = {
-            'telegram_id': user.telegram_id,
-            'user_name': user.user_name
-        }
-        product_data = {
-            'id': product.id,
-            'name': product.name
-        }
-        excel_handler.add_warranty_record(user_data, product_data, warranty_info)
+        ExtendedWarranty.objects.create(
+            user=user,
+            product=product,
+            name=product.name,
+            warranty_period=warranty_text,
+            purchase_date=start_date.date(),
+            end_date=end_date.date(),
+            screenshot_id=photo_id,
+            screenshot_uploaded_at=timezone.now() if photo_id else None,
+        )
+        # Excel-таблица собирается из ExtendedWarranty по запросу (send_excel_to_admin)
         print(f"[LOG] Гарантия активирована для товара {product_id}")
         # Сообщение без даты активации
         success_text = (
@@ -1068,8 +1124,8 @@ def activate_extended_warranty(chat_id, product_id, message_id=None, photo_id=No
         )
         # Кнопка для активации ещё одной гарантии
         markup = InlineKeyboardMarkup()
-        back_btn = InlineKeyboardButton("⬅️ Вернуться к товару", callback_data=f"product_{product_id}")
-        activate_btn = InlineKeyboardButton("➕ Активировать ещё одну гарантию", callback_data=f"activate_warranty_{product_id}")
+        back_btn = InlineKeyboardButton("⬅️ Вернуться к товару", callback_data=pack("product", product_id))
+        activate_btn = InlineKeyboardButton("➕ Активировать ещё одну гарантию", callback_data=pack("activate_warranty", product_id))
         markup.add(back_btn)
         markup.add(activate_btn)
         send_long_message(chat_id, success_text, message_id, markup)
@@ -1089,10 +1145,7 @@ def activate_extended_warranty(chat_id, product_id, message_id=None, photo_id=No
 def confirm_review(call: CallbackQuery) -> None:
     """Обработчик для ручного подтверждения скриншота с отзывом"""
     try:
-        parts = call.data.split('_')
-        if len(parts) != 3:
-            raise ValueError("Неверный формат callback_data")
-        product_id = int(parts[2])
+        product_id = callback_id(call)
         chat_id = call.message.chat.id
         
         print(f"[LOG] Пользователь {chat_id} подтвердил скриншот отзыва для товара {product_id}")
@@ -1123,10 +1176,7 @@ def confirm_review(call: CallbackQuery) -> None:
 def cancel_review(call: CallbackQuery) -> None:
     """Обработчик для отмены ручного подтверждения скриншота"""
     try:
-        parts = call.data.split('_')
-        if len(parts) != 3:
-            raise ValueError("Неверный формат callback_data")
-        product_id = int(parts[2])
+        product_id = callback_id(call)
         chat_id = call.message.chat.id
         
         print(f"[LOG] Пользователь {chat_id} отменил подтверждение скриншота для товара {product_id}")
@@ -1157,46 +1207,25 @@ def cancel_review(call: CallbackQuery) -> None:
 def show_my_warranties(call: CallbackQuery) -> None:
     """Показывает список товаров с активированной расширенной гарантией"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        warranty_data = user.warranty_data or []
-        if isinstance(warranty_data, dict):
-            migrated = []
-            for pid, data in warranty_data.items():
-                if isinstance(data, dict):
-                    info = data.get('info', {})
-                    migrated.append({
-                        'product_id': int(pid),
-                        'name': info.get('name', ''),
-                        'warranty_period': info.get('warranty_period', ''),
-                        'end_date': info.get('end_date', ''),
-                        'purchase_date': info.get('review_date', ''),
-                        'screenshot': data.get('screenshot'),
-                        'status': info.get('status', 'Активна')
-                    })
-            warranty_data = migrated
-            user.warranty_data = warranty_data
-            user.save()
-        active_warranties = [w for w in warranty_data if w.get('status', 'Активна') == 'Активна']
+        user = get_user(call.message.chat.id)
+        active_warranties = list(
+            ExtendedWarranty.objects.filter(user=user).order_by('name', 'end_date')
+        )
         if not active_warranties:
             text = "У вас пока нет активированных расширенных гарантий на товары."
         else:
             text = "🛡️ Ваши активированные расширенные гарантии:\n\n"
-            current_date = timezone.now().date()
             # Группируем по товарам
             grouped = defaultdict(list)
             for w in active_warranties:
-                grouped[w['name']].append(w)
+                grouped[w.name].append(w)
             for name, warranties in grouped.items():
                 text += f"{name}:\n"
                 for idx, w in enumerate(warranties, 1):
-                    try:
-                        end_date = timezone.datetime.strptime(w['end_date'], "%d.%m.%Y").date()
-                        status = "✅ Активна" if current_date <= end_date else "❌ Истекла"
-                        text += (
-                            f"  {idx}. {status} | ⏳ Срок: {w['warranty_period']} | 📆 Окончание: {w['end_date']}\n"
-                        )
-                    except Exception:
-                        continue
+                    status = "❌ Истекла" if w.is_expired else "✅ Активна"
+                    text += (
+                        f"  {idx}. {status} | ⏳ Срок: {w.warranty_period} | 📆 Окончание: {w.end_date:%d.%m.%Y}\n"
+                    )
                 text += "\n"
         markup = InlineKeyboardMarkup()
         warranty_case_btn = InlineKeyboardButton("🛠️ Гарантийный случай", callback_data="warranty_cases")
@@ -1237,7 +1266,7 @@ def product_support(call: CallbackQuery) -> None:
     try:
         product_id = int(call.data.split('_')[1])
         product = goods.objects.get(id=product_id)
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         
         # Включаем режим ИИ для общения с поддержкой
         user.is_ai = True
@@ -1447,7 +1476,7 @@ def chat_with_ai(message):
             if handle_admin_response(message):
                 return
 
-        user = User.objects.get(telegram_id=message.chat.id)
+        user = get_user(message.chat.id)
         
         # Проверяем, не является ли сообщение командой или кнопкой меню
         if message.text == "📱 Каталог товаров":
@@ -1603,7 +1632,7 @@ def handle_first_user_message(message: Message) -> bool:
     """
     try:
         chat_id = message.chat.id
-        user = User.objects.get(telegram_id=chat_id)
+        user = get_user(chat_id)
         
         # Проверяем, есть ли активные обращения
         from bot.models import SupportTicket, WarrantyRequest
@@ -1657,7 +1686,7 @@ def handle_first_user_message(message: Message) -> bool:
 def back_to_main(call: CallbackQuery) -> None:
     """Обработчик для возврата в главное меню"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         user.is_ai = False
         user.chat_history = {}
         
@@ -1682,7 +1711,7 @@ def back_to_main(call: CallbackQuery) -> None:
 def back_to_categories(call: CallbackQuery) -> None:
     """Обработчик для возврата к списку категорий"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         # Удаляем предыдущие сообщения
         delete_previous_messages(call.message.chat.id, user)
     except User.DoesNotExist:
@@ -1694,7 +1723,7 @@ def back_to_categories(call: CallbackQuery) -> None:
 def admin_panel(call: CallbackQuery) -> None:
     """Показывает админ-панель"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         # Доступ к админ-панели: любой админ-тип
         if not (user.is_admin or getattr(user, 'is_super_admin', False) or getattr(user, 'is_ozon_admin', False) or getattr(user, 'is_wb_admin', False)):
             bot.answer_callback_query(
@@ -1736,45 +1765,156 @@ def admin_panel(call: CallbackQuery) -> None:
         )
 
 
+# Периоды выгрузки гарантий: дней назад от сегодня (0 - за все время)
+EXCEL_EXPORT_PERIODS = ((0, "Все время"), (7, "7 дней"), (30, "30 дней"), (90, "90 дней"), (365, "Год"))
+
+
+def _can_export_excel(user) -> bool:
+    return bool(user.is_admin or getattr(user, 'is_super_admin', False) or getattr(user, 'is_ozon_admin', False) or getattr(user, 'is_wb_admin', False))
+
+
+def _excel_export_filters(call: CallbackQuery):
+    """(дней, id категории, id товара) из кнопки; 0 - без фильтра"""
+    if call.data == "admin_excel":
+        return 0, 0, 0
+    return callback_id(call, 0), callback_id(call, 1), callback_id(call, 2)
+
+
+def _excel_export_menu_markup(days: int, category_id: int, product_id: int) -> InlineKeyboardMarkup:
+    markup = InlineKeyboardMarkup(row_width=5)
+    markup.add(*[
+        InlineKeyboardButton(("✅ " if value == days else "") + label, callback_data=pack("excel_export", value, category_id, product_id))
+        for value, label in EXCEL_EXPORT_PERIODS
+    ])
+    category = goods_category.objects.filter(id=category_id).values_list('name', flat=True).first() if category_id else None
+    markup.row(InlineKeyboardButton(f"🗂 Категория: {category or 'все'}", callback_data=pack("excel_export_category", days, category_id, product_id)))
+    if category_id:
+        product = goods.objects.filter(id=product_id).values_list('name', flat=True).first() if product_id else None
+        markup.row(InlineKeyboardButton(f"📦 Товар: {product or 'все'}", callback_data=pack("excel_export_product", days, category_id, product_id)))
+    markup.row(InlineKeyboardButton("📥 Сформировать", callback_data=pack("excel_export_run", days, category_id, product_id)))
+    markup.row(InlineKeyboardButton("⬅️ Назад", callback_data="admin_panel"))
+    return markup
+
+
 @disable_ai_mode
 def send_excel_to_admin(call: CallbackQuery) -> None:
-    """Отправляет Excel-таблицу админу"""
+    """Меню выгрузки гарантий в Excel: период, категория и товар"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        if not (user.is_admin or getattr(user, 'is_super_admin', False) or getattr(user, 'is_ozon_admin', False) or getattr(user, 'is_wb_admin', False)):
+        user = get_user(call.message.chat.id)
+        if not _can_export_excel(user):
             bot.answer_callback_query(
                 callback_query_id=call.id,
                 text="У вас нет доступа к админ-панели"
             )
             return
         
-        # Отправляем сообщение о начале процесса
+        days, category_id, product_id = _excel_export_filters(call)
         bot.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            text="⏳ Подготовка Excel-таблицы..."
+            text="📊 Выгрузка гарантий в Excel\n\nВыберите период активации и, при необходимости, категорию и товар:",
+            reply_markup=_excel_export_menu_markup(days, category_id, product_id)
         )
+        bot.answer_callback_query(call.id)
         
-        # Получаем путь к файлу Excel
-        excel_handler = WarrantyExcelHandler()
-        file_path = excel_handler.file_path
-        
-        # Проверяем существование файла
-        if not os.path.exists(file_path):
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text="❌ Файл Excel не найден"
+    except Exception as e:
+        print(f"[ERROR] Ошибка при показе меню выгрузки Excel: {e}")
+        logger.error(f"[ERROR] Ошибка при показе меню выгрузки Excel: {e}")
+
+
+@disable_ai_mode
+def excel_export_choose_category(call: CallbackQuery) -> None:
+    """Выбор категории товаров для выгрузки"""
+    try:
+        user = get_user(call.message.chat.id)
+        if not _can_export_excel(user):
+            bot.answer_callback_query(call.id, "У вас нет доступа к админ-панели")
+            return
+        days, category_id, product_id = _excel_export_filters(call)
+        markup = InlineKeyboardMarkup()
+        markup.add(InlineKeyboardButton("Все категории", callback_data=pack("excel_export", days, 0, 0)))
+        for cat_id, name in goods_category.objects.order_by('name').values_list('id', 'name'):
+            markup.add(InlineKeyboardButton(name, callback_data=pack("excel_export", days, cat_id, 0)))
+        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=pack("excel_export", days, category_id, product_id)))
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="🗂 Выберите категорию товаров:",
+            reply_markup=markup
+        )
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        print(f"[ERROR] Ошибка при выборе категории выгрузки: {e}")
+        logger.error(f"[ERROR] Ошибка при выборе категории выгрузки: {e}")
+
+
+@disable_ai_mode
+def excel_export_choose_product(call: CallbackQuery) -> None:
+    """Выбор товара выбранной категории для выгрузки"""
+    try:
+        user = get_user(call.message.chat.id)
+        if not _can_export_excel(user):
+            bot.answer_callback_query(call.id, "У вас нет доступа к админ-панели")
+            return
+        days, category_id, product_id = _excel_export_filters(call)
+        markup = InlineKeyboardMarkup()
+        markup.add(InlineKeyboardButton("Все товары", callback_data=pack("excel_export", days, category_id, 0)))
+        for pid, name in goods.objects.filter(parent_category_id=category_id).order_by('name').values_list('id', 'name'):
+            markup.add(InlineKeyboardButton(name, callback_data=pack("excel_export", days, category_id, pid)))
+        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=pack("excel_export", days, category_id, product_id)))
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="📦 Выберите товар:",
+            reply_markup=markup
+        )
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        print(f"[ERROR] Ошибка при выборе товара выгрузки: {e}")
+        logger.error(f"[ERROR] Ошибка при выборе товара выгрузки: {e}")
+
+
+@disable_ai_mode
+def excel_export_run(call: CallbackQuery) -> None:
+    """Собирает и отправляет Excel-таблицу гарантий по выбранным фильтрам"""
+    try:
+        user = get_user(call.message.chat.id)
+        if not _can_export_excel(user):
+            bot.answer_callback_query(
+                callback_query_id=call.id,
+                text="У вас нет доступа к админ-панели"
             )
             return
         
-        # Отправляем файл
-        with open(file_path, 'rb') as file:
-            bot.send_document(
-                chat_id=call.message.chat.id,
-                document=file,
-                caption="📊 Таблица с данными о гарантиях"
+        days, category_id, product_id = _excel_export_filters(call)
+        
+        # Отправляем сообщение о начале процесса
+        bot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text="⏳ Подготовка Excel-таблицы..."
+        )
+        
+        # Собираем таблицу из журнала активаций
+        today = timezone.localdate()
+        excel_handler = WarrantyExcelHandler(
+            date_from=today - timezone.timedelta(days=days) if days else None,
+            product_id=product_id or None,
+            category_id=category_id or None,
+        )
+        file_path = excel_handler.export()
+        
+        # Отправляем файл: те же данные уже загружались - уходит file_id без загрузки
+        try:
+            send_cached_document(
+                call.message.chat.id,
+                f"warranty_export:{excel_handler.content_hash}",
+                file_path,
+                visible_file_name=f"warranty_records_{today.strftime('%Y%m%d')}.xlsx",
+                caption=f"📊 Таблица с данными о гарантиях ({excel_handler.row_count} записей)"
             )
+        finally:
+            os.remove(file_path)
         
         # Возвращаем админ-панель
         admin_panel(call)
@@ -1794,7 +1934,7 @@ def send_excel_to_admin(call: CallbackQuery) -> None:
 def handle_admin_panel(message: Message) -> None:
     """Обработчик кнопки админ-панели"""
     try:
-        user = User.objects.get(telegram_id=message.chat.id)
+        user = get_user(message.chat.id)
         if not (user.is_admin or getattr(user, 'is_super_admin', False) or getattr(user, 'is_ozon_admin', False) or getattr(user, 'is_wb_admin', False)):
             bot.answer_callback_query(
                 callback_query_id=message.id,
@@ -1835,7 +1975,7 @@ def handle_admin_panel(message: Message) -> None:
 def admin_command(message: Message) -> None:
     """Обработчик команды /admin"""
     try:
-        user = User.objects.get(telegram_id=message.chat.id)
+        user = get_user(message.chat.id)
         if not (user.is_admin or getattr(user, 'is_super_admin', False) or getattr(user, 'is_ozon_admin', False) or getattr(user, 'is_wb_admin', False)):
             bot.answer_callback_query(
                 callback_query_id=message.id,
@@ -1874,7 +2014,7 @@ def admin_command(message: Message) -> None:
 def show_admin_panel(call: CallbackQuery) -> None:
     """Показывает админ-панель для callback запросов"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         if not (user.is_admin or getattr(user, 'is_super_admin', False) or getattr(user, 'is_ozon_admin', False) or getattr(user, 'is_wb_admin', False)):
             bot.answer_callback_query(call.id, "У вас нет доступа к админ-панели")
             return
@@ -1933,7 +2073,7 @@ def handle_warranty_case(call: CallbackQuery) -> None:
             raise ValueError("Неверный формат callback_data")
             
         product_id = int(parts[2])
-        user = User.objects.get(telegram_id=call.from_user.id)
+        user = get_user(call.from_user.id)
         product = goods.objects.get(id=product_id)
         
         print(f"[LOG] Запрос гарантийного случая от пользователя {user.telegram_id} для товара {product.name}")
@@ -1990,12 +2130,11 @@ def send_instruction_pdf(call: CallbackQuery) -> None:
         instruction = Instruction.objects.get(id=instruction_id)
         
         if instruction.pdf_file:
-            with open(instruction.pdf_file.path, 'rb') as pdf_file:
-                bot.send_document(
-                    chat_id=call.message.chat.id,
-                    document=pdf_file,
-                    caption=f"📄 {instruction.title}"
-                )
+            send_field_file(
+                call.message.chat.id,
+                instruction.pdf_file,
+                caption=f"📄 {instruction.title}"
+            )
         else:
             bot.answer_callback_query(
                 callback_query_id=call.id,
@@ -2014,24 +2153,23 @@ def send_instruction_pdf(call: CallbackQuery) -> None:
 @disable_ai_mode
 def send_faq_pdf(call: CallbackQuery, bot: TeleBot) -> None:
     try:
-        faq_id = int(call.data.split('_')[-1])
+        faq_id = callback_id(call)
         faq = FAQ.objects.get(id=faq_id, is_active=True)
         
         markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=f"product_{faq.product.id}"))
+        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=pack("product", faq.product.id)))
         
         if faq.pdf_file:
-            with open(faq.pdf_file.path, 'rb') as pdf:
-                caption = f"❓ {faq.title}"
-                if faq.description:
-                    caption += f"\n\n{faq.description}"
-                
-                bot.send_document(
-                    chat_id=call.message.chat.id,
-                    document=pdf,
-                    caption=caption,
-                    reply_markup=markup
-                )
+            caption = f"❓ {faq.title}"
+            if faq.description:
+                caption += f"\n\n{faq.description}"
+            
+            send_field_file(
+                call.message.chat.id,
+                faq.pdf_file,
+                caption=caption,
+                reply_markup=markup
+            )
         elif faq.link:
             # Если есть ссылка, отправляем сообщение со ссылкой
             text = f"🔗 {faq.title}"
@@ -2153,7 +2291,7 @@ def process_warranty_case_contact(message) -> None:
         state_data = warranty_case_phone_state[user_id]
         product_id = state_data['product_id']
         
-        user = User.objects.get(telegram_id=user_id)
+        user = get_user(user_id)
         product = goods.objects.get(id=product_id)
         
         # Сохраняем номер телефона пользователя
@@ -2260,17 +2398,13 @@ def process_warranty_case_description(message) -> None:
         product_id = state_data['product_id']
         phone_number = state_data['phone_number']
         
-        user = User.objects.get(telegram_id=user_id)
+        user = get_user(user_id)
         product = goods.objects.get(id=product_id)
         
         # Получаем скриншот отзыва пользователя для данного товара
-        warranty_data = user.warranty_data or []
-        product_warranty = None
-        for warranty in warranty_data:
-            if warranty.get('product_id') == product_id:
-                product_warranty = warranty
-                break
-        screenshot_data = product_warranty.get('screenshot') if product_warranty else None
+        product_warranty = ExtendedWarranty.objects.filter(
+            user=user, product_id=product_id, screenshot_id__isnull=False
+        ).order_by('-created_at').first()
         
         # Получаем контакт администратора
         admin_contact = AdminContact.objects.filter(is_active=True).first()
@@ -2297,13 +2431,14 @@ def process_warranty_case_description(message) -> None:
             )
             
             # Если есть скриншот отзыва, отправляем его отдельно
-            if screenshot_data and screenshot_data.get('photo_id'):
+            if product_warranty and product_warranty.screenshot_id:
+                upload_date = product_warranty.screenshot_uploaded_at
                 try:
                     bot.send_photo(
                         chat_id=admin.telegram_id,
-                        photo=screenshot_data['photo_id'],
+                        photo=product_warranty.screenshot_id,
                         caption=f"📸 Скриншот отзыва для верификации гарантии\n"
-                               f"📅 Дата загрузки: {screenshot_data.get('upload_date', 'Не указана')}"
+                               f"📅 Дата загрузки: {upload_date.strftime('%d.%m.%Y %H:%M:%S') if upload_date else 'Не указана'}"
                     )
                     print(f"[LOG] Отправлен скриншот отзыва админу {admin.telegram_id}")
                 except Exception as e:
@@ -2355,38 +2490,8 @@ def show_warranty_main_menu(call: CallbackQuery) -> None:
         # Проверяем, есть ли у пользователя активированные гарантии
         has_active_warranties = False
         try:
-            user = User.objects.get(telegram_id=call.message.chat.id)
-            warranty_data = user.warranty_data or []
-            
-            if isinstance(warranty_data, str):
-                warranty_data = json.loads(warranty_data)
-            
-            # Преобразуем старый формат в новый, если нужно
-            if isinstance(warranty_data, dict):
-                migrated = []
-                for pid, data in warranty_data.items():
-                    if isinstance(data, dict):
-                        info = data.get('info', {})
-                        migrated.append({
-                            'product_id': int(pid),
-                            'name': info.get('name', ''),
-                            'warranty_period': info.get('warranty_period', ''),
-                            'end_date': info.get('end_date', ''),
-                            'purchase_date': info.get('review_date', ''),
-                            'screenshot': data.get('screenshot'),
-                            'status': info.get('status', 'Активна')
-                        })
-                warranty_data = migrated
-                user.warranty_data = warranty_data
-                user.save()
-            
-            # Фильтруем только активные гарантии
-            active_warranties = [
-                w for w in warranty_data
-                if w.get('status', 'Активна') == 'Активна'
-            ]
-            
-            has_active_warranties = len(active_warranties) > 0
+            user = get_user(call.message.chat.id)
+            has_active_warranties = ExtendedWarranty.objects.filter(user=user, status='active').exists()
         except User.DoesNotExist:
             pass
         except Exception as e:
@@ -2490,25 +2595,24 @@ def show_warranty_activation_menu(call: CallbackQuery) -> None:
 def send_product_instruction_pdf(call: CallbackQuery) -> None:
     """Отправляет PDF файл инструкции товара"""
     try:
-        product_id = int(call.data.split('_')[-1])
+        product_id = callback_id(call)
         product = goods.objects.get(id=product_id)
         
         # Получаем первую активную инструкцию для товара
         instruction = product.instructions.filter(is_active=True).first()
         
         markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=f"product_{product_id}"))
+        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=pack("product", product_id)))
         
         if instruction and instruction.pdf_file:
-            with open(instruction.pdf_file.path, 'rb') as pdf:
-                caption = f"📖 {instruction.title}"
-                
-                bot.send_document(
-                    chat_id=call.message.chat.id,
-                    document=pdf,
-                    caption=caption,
-                    reply_markup=markup
-                )
+            caption = f"📖 {instruction.title}"
+            
+            send_field_file(
+                call.message.chat.id,
+                instruction.pdf_file,
+                caption=caption,
+                reply_markup=markup
+            )
         else:
             text = f"📖 Инструкция для товара {product.name}\n\nПDF файл не найден."
             bot.send_message(
@@ -2527,12 +2631,12 @@ def send_product_instruction_pdf(call: CallbackQuery) -> None:
 def warranty_show_categories(call: CallbackQuery):
     """Показывает категории товаров для активации расширенной гарантии"""
     try:
-        # Получаем пользователя и его данные о гарантиях
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        warranty_data = user.warranty_data or {}
-
-        if isinstance(warranty_data, str):
-            warranty_data = json.loads(warranty_data)
+        # Получаем пользователя и товары, на которые уже активирована гарантия
+        user = get_user(call.message.chat.id)
+        warranted_ids = set(
+            ExtendedWarranty.objects.filter(user=user, status='active', product__isnull=False)
+            .values_list('product_id', flat=True)
+        )
 
         # Получаем все активные товары
         products = goods.objects.filter(is_active=True).order_by('parent_category__name', 'name')
@@ -2552,14 +2656,7 @@ def warranty_show_categories(call: CallbackQuery):
         # Фильтруем товары, исключая те, на которые уже активирована гарантия
         available_products = []
         for product in products:
-            # Проверяем, есть ли активная гарантия для этого товара в списке гарантий
-            has_active_warranty = False
-            for warranty in warranty_data:
-                if warranty.get('product_id') == product.id and warranty.get('status') == 'Активна':
-                    has_active_warranty = True
-                    break
-
-            if not has_active_warranty:
+            if product.id not in warranted_ids:
                 available_products.append(product)
 
         # Проверяем, есть ли доступные товары для активации
@@ -2661,12 +2758,12 @@ def warranty_show_category_products(call: CallbackQuery):
         parts = call.data.split('_')
         category_id = int(parts[-1])
 
-        # Получаем пользователя и его данные о гарантиях
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        warranty_data = user.warranty_data or {}
-
-        if isinstance(warranty_data, str):
-            warranty_data = json.loads(warranty_data)
+        # Получаем пользователя и товары, на которые уже активирована гарантия
+        user = get_user(call.message.chat.id)
+        warranted_ids = set(
+            ExtendedWarranty.objects.filter(user=user, status='active', product__isnull=False)
+            .values_list('product_id', flat=True)
+        )
 
         # Получаем категорию
         category = goods_category.objects.get(id=category_id)
@@ -2692,14 +2789,7 @@ def warranty_show_category_products(call: CallbackQuery):
         # Фильтруем товары, исключая те, на которые уже активирована гарантия
         available_products = []
         for product in products:
-            # Проверяем, есть ли активная гарантия для этого товара в списке гарантий
-            has_active_warranty = False
-            for warranty in warranty_data:
-                if warranty.get('product_id') == product.id and warranty.get('status') == 'Активна':
-                    has_active_warranty = True
-                    break
-
-            if not has_active_warranty:
+            if product.id not in warranted_ids:
                 available_products.append(product)
 
         # Проверяем, есть ли доступные товары для активации
@@ -2733,7 +2823,7 @@ def warranty_show_category_products(call: CallbackQuery):
             # Используем callback_data для прямой активации гарантии
             markup.add(InlineKeyboardButton(
                 button_text,
-                callback_data=f"activate_warranty_{product.id}"
+                callback_data=pack("activate_warranty", product.id)
             ))
 
         # Добавляем кнопку назад к категориям
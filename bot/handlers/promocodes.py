@@ -3,6 +3,18 @@ from django.conf import settings
 from django.utils import timezone
 from bot import bot, logger
 from bot.models import User, PromoCode, PromoCodeCategory
+from bot.callback_data import callback_id, pack
+from bot.context import get_user
+from bot.file_cache import send_field_file
+from bot.state import StateStore
+from bot.promo import (
+    adjust_available_count,
+    claim_promocode_for,
+    import_promocodes,
+    import_result_text,
+    iter_file_codes,
+    mark_shortage_alert,
+)
 from bot.keyboards import (
     get_promocode_menu_markup,
     get_promocode_list_markup,
@@ -15,7 +27,7 @@ from bot.keyboards import (
 
 
 # Состояния для работы с промокодами
-promocode_state = {}
+promocode_state = StateStore('promocode')
 
 
 def promocode_menu(call: CallbackQuery) -> None:
@@ -23,7 +35,7 @@ def promocode_menu(call: CallbackQuery) -> None:
     try:
         from bot.models import OwnerSettings
         
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         is_owner_db = OwnerSettings.objects.filter(
             owner_telegram_id=call.message.chat.id,
             is_active=True
@@ -53,7 +65,7 @@ def promocode_add(call: CallbackQuery) -> None:
     try:
         from bot.models import OwnerSettings
         
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         is_owner = OwnerSettings.objects.filter(
             owner_telegram_id=call.message.chat.id,
             is_active=True
@@ -98,7 +110,7 @@ def handle_promocode_text(message: Message) -> bool:
         
         from bot.models import OwnerSettings
         
-        user = User.objects.get(telegram_id=message.chat.id)
+        user = get_user(message.chat.id)
         is_owner_db = OwnerSettings.objects.filter(
             owner_telegram_id=message.chat.id,
             is_active=True
@@ -116,56 +128,21 @@ def handle_promocode_text(message: Message) -> bool:
             return True
         
         # Разбираем промокоды из текста
-        promocodes_text = message.text.strip()
-        promocodes_lines = [line.strip().upper() for line in promocodes_text.split('\n') if line.strip()]
+        promocodes_lines = (message.text or '').splitlines()
         
-        if not promocodes_lines:
+        if not any(line.strip() for line in promocodes_lines):
             bot.send_message(
                 chat_id=message.chat.id,
                 text="❌ Не найдено ни одного промокода. Попробуйте еще раз."
             )
             return True
         
-        # Создаем промокоды
-        created_count = 0
-        skipped_count = 0
-        
-        for code in promocodes_lines:
-            if len(code) > 50:
-                skipped_count += 1
-                continue
-                
-            try:
-                promo, created = PromoCode.objects.get_or_create(
-                    code=code,
-                    defaults={
-                        'created_by': user,
-                        'is_active': True,
-                        'is_used': False,
-                        'category': state.get('category')
-                    }
-                )
-                
-                if created:
-                    created_count += 1
-                else:
-                    skipped_count += 1
-                    
-            except Exception as e:
-                logger.error(f"Ошибка создания промокода {code}: {e}")
-                skipped_count += 1
-        
-        # Отправляем результат
-        result_text = f"✅ Промокоды обработаны:\n"
-        result_text += f"• Создано: {created_count}\n"
-        if skipped_count > 0:
-            result_text += f"• Пропущено (уже существуют или ошибка): {skipped_count}\n"
-        
-        result_text += "\n💡 Инструкции можно добавить в админ-панели Django."
+        # Создаем промокоды пакетами
+        result = import_promocodes(promocodes_lines, category_id=state.get('category_id'), created_by=user)
         
         bot.send_message(
             chat_id=message.chat.id,
-            text=result_text,
+            text=import_result_text(result),
             reply_markup=get_promocode_menu_markup()
         )
         
@@ -186,7 +163,7 @@ def handle_promocode_text(message: Message) -> bool:
 
 
 def handle_promocode_document(message: Message) -> bool:
-    """Обрабатывает загруженный текстовый файл с промокодами (по одному в строке)"""
+    """Обрабатывает загруженный файл с промокодами (.txt по одному в строке, .csv/.xlsx со столбцом code)"""
     try:
         if message.chat.id not in promocode_state:
             return False
@@ -195,7 +172,7 @@ def handle_promocode_document(message: Message) -> bool:
             return False
 
         from bot.models import OwnerSettings
-        user = User.objects.get(telegram_id=message.chat.id)
+        user = get_user(message.chat.id)
         is_owner_db = OwnerSettings.objects.filter(
             owner_telegram_id=message.chat.id,
             is_active=True
@@ -219,59 +196,20 @@ def handle_promocode_document(message: Message) -> bool:
             bot.send_message(chat_id=message.chat.id, text="❌ Не удалось скачать файл. Попробуйте снова.")
             return True
 
-        # Читаем текст
-        content = None
-        for enc in ("utf-8", "utf-16", "cp1251", "iso-8859-1"):
-            try:
-                content = file_bytes.decode(enc)
-                break
-            except Exception:
-                continue
-        if content is None:
-            bot.send_message(chat_id=message.chat.id, text="❌ Не удалось определить кодировку файла.")
+        # Разбираем файл потоково (.txt, .csv или .xlsx) и создаем промокоды пакетами
+        try:
+            codes = iter_file_codes(message.document.file_name, file_bytes)
+            result = import_promocodes(codes, category_id=state.get('category_id'), created_by=user)
+        except Exception as e:
+            logger.error(f"Не удалось разобрать файл промокодов {message.document.file_name}: {e}")
+            bot.send_message(chat_id=message.chat.id, text="❌ Не удалось прочитать файл. Поддерживаются .txt, .csv и .xlsx.")
             return True
 
-        lines = [line.strip().upper() for line in content.splitlines() if line.strip()]
-        if not lines:
+        if not result.created and not result.skipped:
             bot.send_message(chat_id=message.chat.id, text="❌ Файл пустой или не содержит промокодов.")
             return True
 
-        created_count = 0
-        skipped_count = 0
-        for code in lines:
-            if len(code) > 50:
-                skipped_count += 1
-                continue
-            try:
-                promo, created = PromoCode.objects.get_or_create(
-                    code=code,
-                    defaults={
-                        'created_by': user,
-                        'is_active': True,
-                        'is_used': False,
-                        'category': state.get('category')
-                    }
-                )
-                if created:
-                    created_count += 1
-                else:
-                    skipped_count += 1
-            except Exception as e:
-                logger.error(f"Ошибка создания промокода {code}: {e}")
-                skipped_count += 1
-
-        # Обновляем состояние для запроса инструкций
-        promocode_state[message.chat.id]["awaiting_promocodes"] = False
-        promocode_state[message.chat.id]["awaiting_instruction"] = True
-        promocode_state[message.chat.id]["created_count"] = created_count
-        promocode_state[message.chat.id]["skipped_count"] = skipped_count
-
-        # Запрашиваем инструкции
-        result_text = f"✅ Файл обработан:\n"
-        result_text += f"• Создано промокодов: {created_count}\n"
-        if skipped_count:
-            result_text += f"• Пропущено: {skipped_count}\n"
-        result_text += "\n💡 Инструкции можно добавить в админ-панели Django."
+        result_text = import_result_text(result, title="✅ Файл обработан:")
         
         # Удаляем состояние
         del promocode_state[message.chat.id]
@@ -291,7 +229,7 @@ def promocode_list(call: CallbackQuery) -> None:
     try:
         from bot.models import OwnerSettings
         
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         is_owner_db = OwnerSettings.objects.filter(
             owner_telegram_id=call.message.chat.id,
             is_active=True
@@ -333,7 +271,7 @@ def promocode_detail(call: CallbackQuery) -> None:
     try:
         from bot.models import OwnerSettings
         
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         is_owner_db = OwnerSettings.objects.filter(
             owner_telegram_id=call.message.chat.id,
             is_active=True
@@ -345,7 +283,7 @@ def promocode_detail(call: CallbackQuery) -> None:
             bot.answer_callback_query(call.id, "Нет доступа")
             return
         
-        promo_id = int(call.data.split('_')[-1])
+        promo_id = callback_id(call)
         promo = PromoCode.objects.get(id=promo_id)
         
         # Формируем текст с деталями
@@ -383,7 +321,7 @@ def promocode_toggle(call: CallbackQuery) -> None:
     try:
         from bot.models import OwnerSettings
         
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         is_owner = OwnerSettings.objects.filter(
             owner_telegram_id=call.message.chat.id,
             is_active=True
@@ -393,11 +331,14 @@ def promocode_toggle(call: CallbackQuery) -> None:
             bot.answer_callback_query(call.id, "Нет доступа")
             return
         
-        promo_id = int(call.data.split('_')[-1])
+        promo_id = callback_id(call)
         promo = PromoCode.objects.get(id=promo_id)
         
         promo.is_active = not promo.is_active
-        promo.save()
+        # Условный UPDATE: повторное нажатие не сдвинет счетчик дважды
+        changed = PromoCode.objects.filter(id=promo.id, is_active=not promo.is_active).update(is_active=promo.is_active)
+        if changed and not promo.is_used:
+            adjust_available_count(promo.category_id, 1 if promo.is_active else -1)
         
         status_text = "активирован" if promo.is_active else "деактивирован"
         
@@ -419,7 +360,7 @@ def promocode_delete(call: CallbackQuery) -> None:
     try:
         from bot.models import OwnerSettings
         
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         is_owner = OwnerSettings.objects.filter(
             owner_telegram_id=call.message.chat.id,
             is_active=True
@@ -429,11 +370,13 @@ def promocode_delete(call: CallbackQuery) -> None:
             bot.answer_callback_query(call.id, "Нет доступа")
             return
         
-        promo_id = int(call.data.split('_')[-1])
+        promo_id = callback_id(call)
         promo = PromoCode.objects.get(id=promo_id)
         promo_code = promo.code
         
         promo.delete()
+        if promo.is_active and not promo.is_used:
+            adjust_available_count(promo.category_id, -1)
         
         bot.edit_message_text(
             chat_id=call.message.chat.id,
@@ -457,7 +400,7 @@ def get_user_promocode(call: CallbackQuery) -> None:
         except:
             pass  # Игнорируем ошибку, если не можем удалить
         
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         
         # Получаем все активные категории (независимо от статуса промокодов)
         all_categories = PromoCodeCategory.objects.filter(
@@ -489,7 +432,7 @@ def promocode_select_category(call: CallbackQuery) -> None:
     """Обработчик выбора категории для ввода текстом"""
     try:
         from bot.models import OwnerSettings
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         is_owner = OwnerSettings.objects.filter(
             owner_telegram_id=call.message.chat.id,
             is_active=True
@@ -497,9 +440,9 @@ def promocode_select_category(call: CallbackQuery) -> None:
         if not is_owner and not user.is_super_admin:
             bot.answer_callback_query(call.id, "Нет доступа")
             return
-        cat_id = int(call.data.split('_')[-1])
+        cat_id = callback_id(call)
         category = PromoCodeCategory.objects.get(id=cat_id, is_active=True)
-        promocode_state[call.message.chat.id] = {"awaiting_promocodes": True, "category": category}
+        promocode_state[call.message.chat.id] = {"awaiting_promocodes": True, "category_id": category.id}
         bot.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
@@ -515,7 +458,7 @@ def promocode_select_category(call: CallbackQuery) -> None:
                 "ZXZCSED32"
             ),
             reply_markup=InlineKeyboardMarkup().add(
-                InlineKeyboardButton("⬅️ Назад", callback_data=f"promocode_back_to_category_{category.id}")
+                InlineKeyboardButton("⬅️ Назад", callback_data=pack("promocode_back_to_category", category.id))
             )
         )
         bot.answer_callback_query(call.id)
@@ -528,7 +471,7 @@ def promocode_select_category_file(call: CallbackQuery) -> None:
     """Обработчик выбора категории для загрузки промокодов файлом"""
     try:
         from bot.models import OwnerSettings
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         is_owner_db = OwnerSettings.objects.filter(
             owner_telegram_id=call.message.chat.id,
             is_active=True
@@ -538,19 +481,21 @@ def promocode_select_category_file(call: CallbackQuery) -> None:
         if not is_owner and not user.is_super_admin:
             bot.answer_callback_query(call.id, "Нет доступа")
             return
-        cat_id = int(call.data.split('_')[-1])
+        cat_id = callback_id(call)
         category = PromoCodeCategory.objects.get(id=cat_id, is_active=True)
-        promocode_state[call.message.chat.id] = {"awaiting_promocodes": True, "category": category}
+        promocode_state[call.message.chat.id] = {"awaiting_promocodes": True, "category_id": category.id}
         bot.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
             text=(
                 f"📄 Загрузка промокодов файлом\n\n"
                 f"Категория: {category.name}\n\n"
-                "Прикрепите .txt файл, в котором каждый промокод на новой строке."
+                "Прикрепите файл с промокодами:\n"
+                "• .txt - каждый промокод на новой строке\n"
+                "• .csv или .xlsx - столбец code (или «промокод»), иначе первый столбец"
             ),
             reply_markup=InlineKeyboardMarkup().add(
-                InlineKeyboardButton("⬅️ Назад", callback_data=f"promocode_back_to_category_{category.id}")
+                InlineKeyboardButton("⬅️ Назад", callback_data=pack("promocode_back_to_category", category.id))
             )
         )
         bot.answer_callback_query(call.id)
@@ -563,14 +508,14 @@ def promocode_choose_actions(call: CallbackQuery) -> None:
     """После выбора категории показать две кнопки: текстом или файлом"""
     try:
         from bot.models import OwnerSettings
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         is_owner_db = OwnerSettings.objects.filter(owner_telegram_id=call.message.chat.id, is_active=True).exists()
         is_owner_env = str(getattr(settings, 'OWNER_ID', '')).strip() == str(call.message.chat.id)
         is_owner = is_owner_db or is_owner_env
         if not is_owner and not user.is_super_admin:
             bot.answer_callback_query(call.id, "Нет доступа")
             return
-        cat_id = int(call.data.split('_')[-1])
+        cat_id = callback_id(call)
         category = PromoCodeCategory.objects.get(id=cat_id, is_active=True)
         bot.edit_message_text(
             chat_id=call.message.chat.id,
@@ -589,14 +534,14 @@ def promocode_back_to_category(call: CallbackQuery) -> None:
     """
     try:
         from bot.models import OwnerSettings
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         is_owner_db = OwnerSettings.objects.filter(owner_telegram_id=call.message.chat.id, is_active=True).exists()
         is_owner_env = str(getattr(settings, 'OWNER_ID', '')).strip() == str(call.message.chat.id)
         is_owner = is_owner_db or is_owner_env
         if not is_owner and not user.is_super_admin:
             bot.answer_callback_query(call.id, "Нет доступа")
             return
-        cat_id = int(call.data.split('_')[-1])
+        cat_id = callback_id(call)
         category = PromoCodeCategory.objects.get(id=cat_id)
         bot.edit_message_text(
             chat_id=call.message.chat.id,
@@ -612,8 +557,8 @@ def promocode_back_to_category(call: CallbackQuery) -> None:
 def user_select_category(call: CallbackQuery) -> None:
     """Пользователь выбрал категорию - показываем кнопку 'Получить промокод'"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        cat_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        cat_id = callback_id(call)
         category = PromoCodeCategory.objects.get(id=cat_id, is_active=True)
         
         # Проверяем, не получал ли пользователь уже промокод из этой категории
@@ -629,10 +574,11 @@ def user_select_category(call: CallbackQuery) -> None:
         else:
             # Стандартный текст, если message_text не заполнен
             text = f"🎁 Категория: {category.name}\n\n"
-            if str(cat_id) in user.received_promocodes_by_category:
+            # Остаток берется из кэшированного счетчика категории, без COUNT
+            if str(cat_id) in user.received_promocodes_by_category or category.promocodes_count() > 0:
                 text += f"🌟 Доступен промокод!\n\n"
             else:
-                text += f"🌟 Доступен промокод!\n\n"
+                text += f"😔 Промокоды в этой категории временно закончились.\n\n"
             
             if has_instruction_file:
                 text += "📋 Доступные действия:"
@@ -646,11 +592,11 @@ def user_select_category(call: CallbackQuery) -> None:
         markup = InlineKeyboardMarkup()
         
         # Кнопка получения промокода (всегда доступна)
-        markup.add(InlineKeyboardButton("🎯 Получить промокод", callback_data=f"claim_promocode_{cat_id}"))
+        markup.add(InlineKeyboardButton("🎯 Получить промокод", callback_data=pack("claim_promocode", cat_id)))
         
         # Кнопка инструкции (если есть файл)
         if has_instruction_file:
-            markup.add(InlineKeyboardButton("📋 Инструкция", callback_data=f"get_instruction_{cat_id}"))
+            markup.add(InlineKeyboardButton("📋 Инструкция", callback_data=pack("get_instruction", cat_id)))
         
         markup.add(InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main"))
         
@@ -676,7 +622,7 @@ def user_select_category(call: CallbackQuery) -> None:
         bot.answer_callback_query(call.id, "Произошла ошибка")
 
 
-def notify_admin_promocodes_shortage(category):
+def notify_admin_promocodes_shortage(category, remaining: int = 0):
     """Отправляет уведомление главному админу о заканчивающихся промокодах"""
     try:
         from bot.models import OwnerSettings
@@ -697,7 +643,10 @@ def notify_admin_promocodes_shortage(category):
         
         notification_text = f"⚠️ **Предупреждение о промокодах**\n\n"
         notification_text += f"📦 **Категория:** {category.name}\n"
-        notification_text += f"📊 **Статус:** Промокоды в данной категории закончились\n\n"
+        if remaining > 0:
+            notification_text += f"📊 **Статус:** Осталось промокодов: {remaining} (порог {category.low_stock_threshold})\n\n"
+        else:
+            notification_text += f"📊 **Статус:** Промокоды в данной категории закончились\n\n"
         notification_text += "🔧 **Рекомендации:**\n"
         notification_text += "• Добавьте новые промокоды через админ-панель Telegram\n"
         notification_text += "• Настройте инструкции в админ-панели Django\n"
@@ -720,8 +669,8 @@ def claim_promocode(call: CallbackQuery) -> None:
     try:
         logger.info(f"[DEBUG] claim_promocode вызвана с {call.data}")
         
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        cat_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        cat_id = callback_id(call)
         category = PromoCodeCategory.objects.get(id=cat_id, is_active=True)
         
         logger.info(f"[DEBUG] Получаем промокод для категории: {category.name}")
@@ -752,7 +701,7 @@ def claim_promocode(call: CallbackQuery) -> None:
             
             # Кнопка инструкции (если есть файл)
             if has_instruction_file:
-                markup.add(InlineKeyboardButton("📋 Инструкция", callback_data=f"get_instruction_{cat_id}"))
+                markup.add(InlineKeyboardButton("📋 Инструкция", callback_data=pack("get_instruction", cat_id)))
             
             markup.add(InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main"))
             
@@ -768,23 +717,12 @@ def claim_promocode(call: CallbackQuery) -> None:
             bot.answer_callback_query(call.id)
             return
         
-        # Получаем доступный промокод
-        available_promo = PromoCode.objects.filter(
-            is_active=True,
-            is_used=False,
-            category=category
-        ).first()
-        
-        if not available_promo:
-            # Проверяем, есть ли еще промокоды в категории или они действительно закончились
-            remaining_promos = PromoCode.objects.filter(
-                is_active=True,
-                is_used=False,
-                category=category
-            ).count()
-            
-            if remaining_promos == 0:
-                # Уведомляем главного админа
+        # Атомарно забираем свободный промокод (выданный не удаляется, а помечается и записывается в PromoCodeClaim)
+        promo_code, claimed_now, remaining_count = claim_promocode_for(user, category)
+        
+        if not promo_code:
+            # Уведомляем главного админа (один раз, пока склад не пополнят)
+            if mark_shortage_alert(category, 0):
                 notify_admin_promocodes_shortage(category)
             
             bot.edit_message_text(
@@ -796,27 +734,15 @@ def claim_promocode(call: CallbackQuery) -> None:
             bot.answer_callback_query(call.id, "Промокод больше недоступен")
             return
         
-        promo_code = available_promo.code
-        
-        # Удаляем промокод из базы данных после получения
-        available_promo.delete()
-        
-        # Проверяем, сколько промокодов осталось после удаления
-        remaining_count = PromoCode.objects.filter(
-            is_active=True,
-            is_used=False,
-            category=category
-        ).count()
-        
-        # Если промокоды закончились, уведомляем админа
-        if remaining_count == 0:
-            notify_admin_promocodes_shortage(category)
+        # Если остаток опустился до порога, уведомляем админа
+        if claimed_now and mark_shortage_alert(category, remaining_count):
+            notify_admin_promocodes_shortage(category, remaining_count)
         
         # Сохраняем в пользователе
         if not user.received_promocodes_by_category:
             user.received_promocodes_by_category = {}
         user.received_promocodes_by_category[str(cat_id)] = promo_code
-        user.save()
+        user.save(update_fields=["received_promocodes_by_category"])
         
         # Формируем сообщение с промокодом
         if category.promocode_template:
@@ -834,13 +760,15 @@ def claim_promocode(call: CallbackQuery) -> None:
         # Показываем все полученные промокоды пользователя
         if len(user.received_promocodes_by_category) > 1:
             received_text += "🎁 **Ваши полученные промокоды:**\n"
+            category_names = dict(PromoCodeCategory.objects.filter(
+                id__in=[int(c) for c in user.received_promocodes_by_category if str(c).isdigit()]
+            ).values_list('id', 'name'))
             for cat_id_str, promocode in user.received_promocodes_by_category.items():
-                try:
-                    cat = PromoCodeCategory.objects.get(id=int(cat_id_str))
-                    star = "⭐️" if str(cat_id) == str(cat_id_str) else "•"
-                    received_text += f"{star} **{cat.name}**: `{promocode}`\n"
-                except:
-                    star = "⭐️" if str(cat_id) == str(cat_id_str) else "•"
+                star = "⭐️" if str(cat_id) == str(cat_id_str) else "•"
+                name = category_names.get(int(cat_id_str)) if str(cat_id_str).isdigit() else None
+                if name:
+                    received_text += f"{star} **{name}**: `{promocode}`\n"
+                else:
                     received_text += f"{star} Промокод: `{promocode}`\n"
         
         received_text += "\n💡 **Помните:** Вы можете получить по одному промокоду в каждой категории!"
@@ -870,8 +798,8 @@ def get_category_instruction(call: CallbackQuery) -> None:
         except:
             pass  # Игнорируем ошибку, если не можем удалить
         
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        cat_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        cat_id = callback_id(call)
         category = PromoCodeCategory.objects.get(id=cat_id, is_active=True)
         
         logger.info(f"[DEBUG] Категория найдена: {category.name}")
@@ -888,12 +816,11 @@ def get_category_instruction(call: CallbackQuery) -> None:
                 logger.info(f"[DEBUG] Пытаемся отправить файл инструкции: {category.instruction_file.path}")
                 
                 # Отправляем файл и добавляем кнопку "Назад" под ним
-                with open(category.instruction_file.path, 'rb') as file:
-                    message_with_document = bot.send_document(
-                        chat_id=call.message.chat.id,
-                        document=file,
-                        caption=f"📋 Инструкция для категории '{category.name}'"
-                    )
+                message_with_document = send_field_file(
+                    call.message.chat.id,
+                    category.instruction_file,
+                    caption=f"📋 Инструкция для категории '{category.name}'"
+                )
                 
                 # Добавляем кнопку "Назад в главное меню"
                 from bot.keyboards import InlineKeyboardMarkup, InlineKeyboardButton
@@ -1,7 +1,12 @@
 from telebot.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from django.utils import timezone
 from bot import bot
-from bot.models import User, SupportTicket, SupportMessage, OwnerSettings, WarrantyRequest, WarrantyAnswer, goods, goods_category, TypicalIssue, ProductSupportQuestion, ProductWarrantyQuestion, SupportAnswer
+from bot.models import User, SupportTicket, SupportMessage, OwnerSettings, WarrantyRequest, WarrantyAnswer, goods, goods_category, TypicalIssue, ProductSupportQuestion, ProductWarrantyQuestion, SupportAnswer, BroadcastMessage
+from bot.callback_data import callback_id, pack
+from bot.context import get_user
+from bot.file_cache import send_field_file
+from bot.broadcast import start_broadcast
+from bot.state import StateStore
 from bot.texts import (
     SUPPORT_WELCOME_TEXT, SUPPORT_OZON_START_TEXT, SUPPORT_WILDBERRIES_START_TEXT,
     SUPPORT_MESSAGE_RECEIVED_TEXT, SUPPORT_TICKET_CLOSED_TEXT,
@@ -20,17 +25,17 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-# Словарь для отслеживания состояния пользователей в поддержке
-support_state = {}
-# Словарь для отслеживания состояния админов, отвечающих на обращения
-admin_response_state = {}
-broadcast_state = {}
+# Состояние для отслеживания состояния пользователей в поддержке
+support_state = StateStore('support')
+# Состояние для отслеживания состояния админов, отвечающих на обращения
+admin_response_state = StateStore('admin_response')
+broadcast_state = StateStore('broadcast')
 # Контекст для переноса деталей из гарантийного обращения в новое обращение поддержки
-warranty_to_support_context = {}
-# Словарь для отслеживания анкеты поддержки
-support_qna_state = {}
+warranty_to_support_context = StateStore('warranty_to_support_context')
+# Состояние для отслеживания анкеты поддержки
+support_qna_state = StateStore('support_qna')
 # Контекст для переноса деталей из обращения в поддержку в новое обращение поддержки
-support_to_support_context = {}
+support_to_support_context = StateStore('support_to_support_context')
 
 # ===== Helpers for tracking and cleanup admin chat messages =====
 def _track_admin_message(ticket: SupportTicket, admin_chat_id: int, message_id: int) -> None:
@@ -121,7 +126,7 @@ def show_support_menu(call: CallbackQuery) -> None:
 def show_user_tickets(call: CallbackQuery) -> None:
     """Показывает список активных обращений пользователя"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         # Активные: open и in_progress
         tickets = list(user.support_tickets.filter(status__in=["open", "in_progress"]).order_by("-created_at"))
 
@@ -150,7 +155,7 @@ def show_user_tickets(call: CallbackQuery) -> None:
 def show_user_ticket_actions(call: CallbackQuery) -> None:
     """Показывает действия по выбранному обращению"""
     try:
-        ticket_id = int(call.data.split("_")[-1])
+        ticket_id = callback_id(call)
         ticket = SupportTicket.objects.get(id=ticket_id)
 
         if ticket.status == "closed":
@@ -178,7 +183,7 @@ def show_user_ticket_actions(call: CallbackQuery) -> None:
 def user_close_ticket(call: CallbackQuery) -> None:
     """Закрывает выбранное пользователем обращение (из списка)"""
     try:
-        ticket_id = int(call.data.split("_")[-1])
+        ticket_id = callback_id(call)
         ticket = SupportTicket.objects.get(id=ticket_id)
         ticket.status = 'closed'
         ticket.closed_at = timezone.now()
@@ -218,7 +223,7 @@ def user_close_ticket(call: CallbackQuery) -> None:
 def user_open_ticket(call: CallbackQuery) -> None:
     """Открывает выбранное обращение для продолжения переписки"""
     try:
-        ticket_id = int(call.data.split("_")[-1])
+        ticket_id = callback_id(call)
         ticket = SupportTicket.objects.get(id=ticket_id)
 
         # Включаем состояние поддержки для пользователя
@@ -249,7 +254,7 @@ def user_open_ticket(call: CallbackQuery) -> None:
 def admin_start_broadcast(call: CallbackQuery) -> None:
     """Запрашивает у админа текст рассылки"""
     try:
-        admin = User.objects.get(telegram_id=call.message.chat.id)
+        admin = get_user(call.message.chat.id)
         if not admin.is_admin:
             bot.answer_callback_query(call.id, "Нет доступа")
             return
@@ -300,56 +305,35 @@ def admin_broadcast_confirm(call: CallbackQuery) -> None:
             bot.answer_callback_query(call.id)
             return
 
-        # Отправка
+        # Рассылка уходит в фоновый поток, прогресс обновляется в этом же сообщении
         text = state["text"]
-        from bot.models import User as UModel
-        sent = 0
-        for u in UModel.objects.all():
-            try:
-                bot.send_message(u.telegram_id, text)
-                sent += 1
-            except Exception:
-                continue
+        broadcast = BroadcastMessage.objects.create(
+            title=text[:50],
+            text=text,
+            status='queued',
+            report_chat_id=str(call.message.chat.id),
+            report_message_id=call.message.message_id,
+        )
         broadcast_state.pop(call.message.chat.id, None)
         bot.edit_message_text(
             chat_id=call.message.chat.id,
             message_id=call.message.message_id,
-            text=f"✅ Рассылка отправлена. Сообщений: {sent}"
+            text=f"🚀 Рассылка #{broadcast.id} запущена. Прогресс будет обновляться в этом сообщении."
         )
         bot.answer_callback_query(call.id)
+        start_broadcast(broadcast.id)
     except Exception as e:
         logger.error(f"Ошибка в admin_broadcast_confirm: {e}")
         bot.answer_callback_query(call.id, "Произошла ошибка. Попробуйте позже.")
 
 
 def send_broadcast_to_all_users(broadcast_message) -> None:
-    """Отправляет рассылку всем пользователям"""
+    """Запускает фоновую отправку рассылки всем пользователям (см. bot/broadcast.py)"""
     try:
-        from bot.models import BroadcastMessage
-        
-        # Получаем всех пользователей
-        users = User.objects.filter(is_active=True)
-        sent_count = 0
-        failed_count = 0
-        
-        for user in users:
-            try:
-                bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=f"📢 {broadcast_message.message_text}"
-                )
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Ошибка отправки рассылки пользователю {user.telegram_id}: {e}")
-                failed_count += 1
-        
-        # Обновляем статус рассылки
-        broadcast_message.is_sent = True
-        broadcast_message.sent_at = timezone.now()
-        broadcast_message.save()
-        
-        logger.info(f"Рассылка завершена. Отправлено: {sent_count}, ошибок: {failed_count}")
-        
+        if start_broadcast(broadcast_message.id):
+            logger.info(f"Рассылка #{broadcast_message.id} запущена")
+        else:
+            logger.info(f"Рассылка #{broadcast_message.id} уже отправляется или завершена")
     except Exception as e:
         logger.error(f"Ошибка в send_broadcast_to_all_users: {e}")
 
@@ -597,7 +581,7 @@ def handle_support_message(message: Message) -> None:
         if chat_id not in support_state:
             return False
         
-        user = User.objects.get(telegram_id=chat_id)
+        user = get_user(chat_id)
         ticket_id = support_state[chat_id]['ticket_id']
         
         try:
@@ -693,7 +677,7 @@ def handle_support_message(message: Message) -> None:
 def close_support_ticket(call: CallbackQuery) -> None:
     """Закрывает обращение по запросу пользователя"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         
         # Находим активное обращение пользователя
         ticket = SupportTicket.objects.filter(
@@ -753,8 +737,8 @@ def accept_support_ticket(call: CallbackQuery) -> None:
     """Админ принимает обращение"""
     try:
         # Извлекаем ID тикета из callback_data
-        ticket_id = int(call.data.split('_')[-1])
-        admin = User.objects.get(telegram_id=call.message.chat.id)
+        ticket_id = callback_id(call)
+        admin = get_user(call.message.chat.id)
         
         with transaction.atomic():
             ticket = SupportTicket.objects.select_for_update().get(id=ticket_id)
@@ -886,7 +870,7 @@ def handle_admin_response(message: Message) -> None:
         if chat_id not in admin_response_state:
             return False
         
-        admin = User.objects.get(telegram_id=chat_id)
+        admin = get_user(chat_id)
         ticket_id = admin_response_state[chat_id]['ticket_id']
         ticket = SupportTicket.objects.get(id=ticket_id)
         
@@ -987,8 +971,8 @@ def handle_admin_response(message: Message) -> None:
 def finish_ticket_processing(call: CallbackQuery) -> None:
     """Админ завершает обработку обращения"""
     try:
-        ticket_id = int(call.data.split('_')[-1])
-        admin = User.objects.get(telegram_id=call.message.chat.id)
+        ticket_id = callback_id(call)
+        admin = get_user(call.message.chat.id)
         
         # Получаем тикет и проверяем его статус
         ticket = SupportTicket.objects.get(id=ticket_id)
@@ -1060,7 +1044,7 @@ def finish_ticket_processing(call: CallbackQuery) -> None:
 def view_ticket_details(call: CallbackQuery) -> None:
     """Показывает детали обращения админу"""
     try:
-        ticket_id = int(call.data.split('_')[-1])
+        ticket_id = callback_id(call)
         ticket = SupportTicket.objects.get(id=ticket_id)
         
         # Собираем полную историю сообщений
@@ -1119,7 +1103,7 @@ def view_ticket_details(call: CallbackQuery) -> None:
         ticket.save(update_fields=['unread_by_admin'])
 
         # Проверяем, назначен ли текущий админ на это обращение
-        admin = User.objects.get(telegram_id=call.message.chat.id)
+        admin = get_user(call.message.chat.id)
         
         if ticket.assigned_admin and ticket.assigned_admin.telegram_id == admin.telegram_id:
             # Если админ уже назначен на это обращение, устанавливаем состояние для ответов
@@ -1154,7 +1138,7 @@ def view_ticket_details(call: CallbackQuery) -> None:
             # Кнопка перехвата обращения
             markup.add(InlineKeyboardButton(
                 "🔄 Перехватить обращение",
-                callback_data=f"takeover_ticket_{ticket_id}"
+                callback_data=pack("takeover_ticket", ticket_id)
             ))
             
             # Кнопка получения файлов
@@ -1162,7 +1146,7 @@ def view_ticket_details(call: CallbackQuery) -> None:
             if has_files:
                 markup.add(InlineKeyboardButton(
                     "📎 Получить все файлы",
-                    callback_data=f"get_all_ticket_files_{ticket_id}"
+                    callback_data=pack("get_all_ticket_files", ticket_id)
                 ))
             
             # Кнопка назад к списку обращений
@@ -1194,7 +1178,7 @@ def admin_list_open_tickets(call: CallbackQuery) -> None:
     try:
         from bot.keyboards import get_admin_open_tickets_markup
         # Свободные тикеты: показываем релевантным админам по платформе, супер-админ видит все
-        admin = User.objects.get(telegram_id=call.message.chat.id)
+        admin = get_user(call.message.chat.id)
         base_qs = SupportTicket.objects.filter(status__in=["open", "in_progress"], assigned_admin__isnull=True)
         if is_super_admin(admin) or getattr(admin, 'is_admin', False):
             tickets = base_qs.order_by("-created_at")
@@ -1231,7 +1215,7 @@ def admin_list_in_progress_tickets(call: CallbackQuery) -> None:
     try:
         from bot.keyboards import get_admin_in_progress_tickets_markup
         # В обработке: супер/общие админы видят все; платформенные видят только свою платформу
-        admin = User.objects.get(telegram_id=call.message.chat.id)
+        admin = get_user(call.message.chat.id)
         base_qs = SupportTicket.objects.filter(status="in_progress")
         if is_super_admin(admin) or getattr(admin, 'is_admin', False):
             tickets = base_qs.order_by("-updated_at")
@@ -1267,8 +1251,8 @@ def takeover_support_ticket(call: CallbackQuery) -> None:
     """Перехват обращения другим админом"""
     try:
         bot.answer_callback_query(call.id)
-        ticket_id = int(call.data.split('_')[-1])
-        admin = User.objects.get(telegram_id=call.message.chat.id)
+        ticket_id = callback_id(call)
+        admin = get_user(call.message.chat.id)
         with transaction.atomic():
             ticket = SupportTicket.objects.select_for_update().get(id=ticket_id)
 
@@ -1385,8 +1369,8 @@ def takeover_support_ticket(call: CallbackQuery) -> None:
 def send_ticket_files_to_admin(call: CallbackQuery) -> None:
     """Отправляет админу все нетекстовые файлы из тикета по file_id"""
     try:
-        ticket_id = int(call.data.split('_')[-1])
-        admin = User.objects.get(telegram_id=call.message.chat.id)
+        ticket_id = callback_id(call)
+        admin = get_user(call.message.chat.id)
         ticket = SupportTicket.objects.get(id=ticket_id)
 
         # Проверка прав: только админы
@@ -1454,8 +1438,8 @@ def send_ticket_files_to_admin(call: CallbackQuery) -> None:
 def send_all_ticket_files_to_admin(call: CallbackQuery) -> None:
     """Отправляет админу все файлы из тикета (включая уже отправленные ранее)."""
     try:
-        ticket_id = int(call.data.split('_')[-1])
-        admin = User.objects.get(telegram_id=call.message.chat.id)
+        ticket_id = callback_id(call)
+        admin = get_user(call.message.chat.id)
         ticket = SupportTicket.objects.get(id=ticket_id)
 
         if not admin.is_admin:
@@ -1504,7 +1488,7 @@ def send_all_ticket_files_to_admin(call: CallbackQuery) -> None:
 def admin_list_my_tickets(call: CallbackQuery) -> None:
     """Показывает обращения, назначенные на текущего админа"""
     try:
-        admin = User.objects.get(telegram_id=call.message.chat.id)
+        admin = get_user(call.message.chat.id)
         tickets = SupportTicket.objects.filter(assigned_admin=admin, status__in=["open","in_progress"]).order_by('-last_message_at','-created_at')
         from bot.keyboards import get_admin_my_tickets_markup
         if not tickets.exists():
@@ -1531,7 +1515,7 @@ def admin_list_my_tickets(call: CallbackQuery) -> None:
 def decline_support_ticket(call: CallbackQuery) -> None:
     """Админ отказывается от обращения (ничего не меняем в тикете)"""
     try:
-        ticket_id = int(call.data.split('_')[-1])
+        ticket_id = callback_id(call)
         # Переходим в хаб обращений
         from bot.keyboards import get_admin_tickets_hub_markup
         bot.edit_message_text(
@@ -1659,15 +1643,37 @@ def _notify_admins_user_continues(ticket: SupportTicket) -> None:
 
 # ===== НОВЫЕ ФУНКЦИИ ДЛЯ ПОДДЕРЖКИ (АНАЛОГ ГАРАНТИЙНЫХ) =====
 
+def _dump_support_request(support_request: dict) -> dict:
+    """Контекст обращения для хранилища состояний: только JSON-совместимые значения"""
+    return {
+        'product_id': support_request['product'].id if support_request.get('product') else None,
+        'issue_id': support_request['issue'].id if support_request.get('issue') else None,
+        'custom_issue_description': support_request.get('custom_issue_description'),
+        'answers': [list(answer) for answer in support_request.get('answers', [])],
+    }
+
+
+def _load_support_request(data: dict) -> dict:
+    """Восстанавливает контекст обращения с объектами моделей"""
+    support_request = {'answers': data.get('answers', [])}
+    if data.get('product_id'):
+        support_request['product'] = goods.objects.filter(id=data['product_id']).first()
+    if data.get('issue_id'):
+        support_request['issue'] = TypicalIssue.objects.filter(id=data['issue_id']).first()
+    if data.get('custom_issue_description'):
+        support_request['custom_issue_description'] = data['custom_issue_description']
+    return support_request
+
+
 def _start_support_questionnaire(user: User, support_request: dict, chat_id: int, with_intro: bool = False, back_callback: str = None) -> None:
     questions_qs = ProductSupportQuestion.objects.filter(product=support_request['product'], is_active=True).order_by('order')
     if not questions_qs.exists():
         _finish_support_questionnaire_and_ask_platform(user, support_request, chat_id)
         return
-    questions = list(questions_qs.values_list('id', 'text'))
+    questions = [list(question) for question in questions_qs.values_list('id', 'text')]
     support_qna_state[chat_id] = {
         'user_id': user.telegram_id,
-        'support_request': support_request,
+        'support_request': _dump_support_request(support_request),
         'current_question': 0,
         'questions': questions,
         'root_back_callback': back_callback
@@ -1731,7 +1737,7 @@ def process_support_questionnaire_answer(call: CallbackQuery):
     state = support_qna_state.get(chat_id)
     if not state:
         return False
-    user = User.objects.get(telegram_id=state['user_id'])
+    user = get_user(state['user_id'])
     support_request = state['support_request']
     questions = state['questions']
     idx = state['current_question']
@@ -1744,19 +1750,19 @@ def process_support_questionnaire_answer(call: CallbackQuery):
         question_id, question_text = questions[q_idx]
         if 'answers' not in support_request:
             support_request['answers'] = []
-        support_request['answers'].append((question_text, answer))
+        support_request['answers'].append([question_text, answer])
         next_idx = q_idx + 1
         if next_idx < len(questions):
-            state['current_question'] = next_idx
+            support_qna_state.update(chat_id, current_question=next_idx, support_request=support_request)
             ask_support_question(chat_id, next_idx)
         else:
             del support_qna_state[chat_id]
-            _finish_support_questionnaire_and_ask_platform(user, support_request, chat_id)
+            _finish_support_questionnaire_and_ask_platform(user, _load_support_request(support_request), chat_id)
     elif data.startswith('support_qna_back_'):
         q_idx = int(data.split('_')[-1])
         prev_idx = q_idx - 1
         if prev_idx >= 0:
-            state['current_question'] = prev_idx
+            support_qna_state.update(chat_id, current_question=prev_idx)
             ask_support_question(chat_id, prev_idx)
     bot.answer_callback_query(call.id)
 
@@ -1764,7 +1770,7 @@ def process_support_questionnaire_answer(call: CallbackQuery):
 def support_start(call: CallbackQuery) -> None:
     """Начало процесса обращения в поддержку - выбор категории товара"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         
         # Получаем все активные категории товаров
         categories = goods_category.objects.all()
@@ -1799,7 +1805,7 @@ def support_start(call: CallbackQuery) -> None:
                 markup.add(
                     InlineKeyboardButton(
                         f"📦 {category.name}",
-                        callback_data=f"support_category_{category.id}"
+                        callback_data=pack("support_category", category.id)
                     )
                 )
         
@@ -1839,8 +1845,8 @@ def support_start(call: CallbackQuery) -> None:
 def support_select_category(call: CallbackQuery) -> None:
     """Пользователь выбрал категорию - показываем товары"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        category_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        category_id = callback_id(call)
         category = goods_category.objects.get(id=category_id)
         
         # Получаем товары категории
@@ -1872,7 +1878,7 @@ def support_select_category(call: CallbackQuery) -> None:
             markup.add(
                 InlineKeyboardButton(
                     f"📱 {product.name}",
-                    callback_data=f"support_product_{product.id}"
+                    callback_data=pack("support_product", product.id)
                 )
             )
         
@@ -1909,8 +1915,8 @@ def support_select_category(call: CallbackQuery) -> None:
 def support_select_product(call: CallbackQuery) -> None:
     """Пользователь выбрал товар - показываем типичные проблемы"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        product_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        product_id = callback_id(call)
         product = goods.objects.get(id=product_id)
         
         # Создаем контекст для поддержки
@@ -1933,7 +1939,7 @@ def support_select_product(call: CallbackQuery) -> None:
                 markup.add(
                     InlineKeyboardButton(
                         f"⚠️ {issue.title}",
-                        callback_data=f"support_issue_{issue.id}"
+                        callback_data=pack("support_issue", issue.id)
                     )
                 )
         
@@ -1941,13 +1947,13 @@ def support_select_product(call: CallbackQuery) -> None:
         markup.add(
             InlineKeyboardButton(
                 "❓ Другое",
-                callback_data=f"support_other_{product_id}"
+                callback_data=pack("support_other", product_id)
             )
         )
         markup.add(
             InlineKeyboardButton(
                 "⬅️ Назад",
-                callback_data=f"support_category_{product.parent_category.id}"
+                callback_data=pack("support_category", product.parent_category.id)
             )
         )
         
@@ -1977,8 +1983,8 @@ def support_select_product(call: CallbackQuery) -> None:
 def support_select_issue(call: CallbackQuery) -> None:
     """Пользователь выбрал проблему - показываем решение"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        issue_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        issue_id = callback_id(call)
         issue = TypicalIssue.objects.get(id=issue_id)
         
         # Создаем контекст для поддержки
@@ -1991,11 +1997,11 @@ def support_select_issue(call: CallbackQuery) -> None:
         # Клавиатура с кнопками
         markup = InlineKeyboardMarkup()
         markup.row(
-            InlineKeyboardButton("✅ Помогло", callback_data=f"support_helped_{issue.id}"),
-            InlineKeyboardButton("❌ Не помогло", callback_data=f"support_not_helped_{issue.id}")
+            InlineKeyboardButton("✅ Помогло", callback_data=pack("support_helped", issue.id)),
+            InlineKeyboardButton("❌ Не помогло", callback_data=pack("support_not_helped", issue.id))
         )
         markup.add(
-            InlineKeyboardButton("⬅️ Назад", callback_data=f"support_product_{issue.product.id}")
+            InlineKeyboardButton("⬅️ Назад", callback_data=pack("support_product", issue.product.id))
         )
         
         # Формируем текст
@@ -2037,12 +2043,11 @@ def support_select_issue(call: CallbackQuery) -> None:
         # Если есть файл, отправляем его
         if has_file:
             try:
-                with open(issue.solution_file.path, 'rb') as file:
-                    bot.send_document(
-                        chat_id=call.message.chat.id,
-                        document=file,
-                        caption=f"📋 Инструкция: {issue.title}"
-                    )
+                send_field_file(
+                    call.message.chat.id,
+                    issue.solution_file,
+                    caption=f"📋 Инструкция: {issue.title}"
+                )
             except Exception as e:
                 logger.error(f"Ошибка отправки файла решения: {e}")
         
@@ -2056,13 +2061,13 @@ def support_select_issue(call: CallbackQuery) -> None:
 def support_helped(call: CallbackQuery) -> None:
     """Решение помогло"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        issue_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        issue_id = callback_id(call)
         issue = TypicalIssue.objects.get(id=issue_id)
         
         markup = InlineKeyboardMarkup()
         markup.add(InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main"))
-        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=f"support_product_{issue.product.id}"))
+        markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=pack("support_product", issue.product.id)))
         
         # Удаляем старое сообщение
         try:
@@ -2089,8 +2094,8 @@ def support_helped(call: CallbackQuery) -> None:
 def support_not_helped(call: CallbackQuery) -> None:
     """Решение не помогло - переходим к анкете"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        issue_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        issue_id = callback_id(call)
         issue = TypicalIssue.objects.get(id=issue_id)
         
         # Удаляем старое сообщение
@@ -2125,8 +2130,8 @@ def support_not_helped(call: CallbackQuery) -> None:
 def support_other(call: CallbackQuery) -> None:
     """Пользователь выбрал "Другое" - переходим к анкете"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        product_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        product_id = callback_id(call)
         product = goods.objects.get(id=product_id)
         
         # Удаляем старое сообщение
@@ -1,14 +1,18 @@
 from telebot.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from bot import bot, logger
 from bot.models import User, goods_category, goods, TypicalIssue, WarrantyRequest, Support, ProductWarrantyQuestion, WarrantyAnswer
+from bot.callback_data import callback_id, pack
+from bot.context import get_user
+from bot.file_cache import send_field_file
+from bot.state import StateStore
 from bot.handlers.support import warranty_to_support_context
 from bot.keyboards import get_support_platform_markup
 
 
 # Состояния для работы с гарантией
-warranty_state = {}
+warranty_state = StateStore('warranty')
  # Состояние опроса вопросов перед выбором платформы: по chat_id храним прогресс
-warranty_qna_state = {}
+warranty_qna_state = StateStore('warranty_qna')
 
 
 def _start_warranty_questionnaire(user: User, warranty_request: WarrantyRequest, chat_id: int, with_intro: bool = False, back_callback: str = None) -> None:
@@ -83,7 +87,7 @@ def process_warranty_questionnaire_answer(call: CallbackQuery):
     state = warranty_qna_state.get(chat_id)
     if not state:
         return False
-    user = User.objects.get(telegram_id=chat_id)
+    user = get_user(chat_id)
     warranty_request = WarrantyRequest.objects.get(id=state['request_id'])
     q_ids = state['question_ids']
     idx = state['index']
@@ -101,7 +105,7 @@ def process_warranty_questionnaire_answer(call: CallbackQuery):
         )
         next_idx = q_idx + 1
         if next_idx < len(q_ids):
-            state['index'] = next_idx
+            warranty_qna_state.update(chat_id, index=next_idx)
             ask_warranty_question(chat_id, next_idx)
         else:
             warranty_qna_state.pop(chat_id, None)
@@ -111,7 +115,7 @@ def process_warranty_questionnaire_answer(call: CallbackQuery):
         q_idx = int(data.split('_')[-1])
         prev_idx = q_idx - 1
         if prev_idx >= 0:
-            state['index'] = prev_idx
+            warranty_qna_state.update(chat_id, index=prev_idx)
             ask_warranty_question(chat_id, prev_idx)
     bot.answer_callback_query(call.id)
 
@@ -119,7 +123,7 @@ def process_warranty_questionnaire_answer(call: CallbackQuery):
 def warranty_start(call: CallbackQuery) -> None:
     """Начало процесса обращения по гарантии - выбор категории товара"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
+        user = get_user(call.message.chat.id)
         
         # Получаем все активные категории товаров
         categories = goods_category.objects.all()
@@ -154,7 +158,7 @@ def warranty_start(call: CallbackQuery) -> None:
                 markup.add(
                     InlineKeyboardButton(
                         f"📦 {category.name}",
-                        callback_data=f"warranty_category_{category.id}"
+                        callback_data=pack("warranty_category", category.id)
                     )
                 )
         
@@ -194,8 +198,8 @@ def warranty_start(call: CallbackQuery) -> None:
 def warranty_select_category(call: CallbackQuery) -> None:
     """Пользователь выбрал категорию - показываем товары"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        category_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        category_id = callback_id(call)
         category = goods_category.objects.get(id=category_id)
         
         # Получаем все активные товары в категории
@@ -233,7 +237,7 @@ def warranty_select_category(call: CallbackQuery) -> None:
             markup.add(
                 InlineKeyboardButton(
                     f"📱 {product.name}",
-                    callback_data=f"warranty_product_{product.id}"
+                    callback_data=pack("warranty_product", product.id)
                 )
             )
         
@@ -264,8 +268,8 @@ def warranty_select_category(call: CallbackQuery) -> None:
 def warranty_select_product(call: CallbackQuery) -> None:
     """Пользователь выбрал товар - показываем типичные проблемы"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        product_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        product_id = callback_id(call)
         product = goods.objects.get(id=product_id)
         
         # Создаем или получаем запрос по гарантии
@@ -294,7 +298,7 @@ def warranty_select_product(call: CallbackQuery) -> None:
                 markup.add(
                     InlineKeyboardButton(
                         f"⚠️ {issue.title}",
-                        callback_data=f"warranty_issue_{issue.id}"
+                        callback_data=pack("warranty_issue", issue.id)
                     )
                 )
         
@@ -302,13 +306,13 @@ def warranty_select_product(call: CallbackQuery) -> None:
         markup.add(
             InlineKeyboardButton(
                 "❓ Другое",
-                callback_data=f"warranty_other_{product_id}"
+                callback_data=pack("warranty_other", product_id)
             )
         )
         markup.add(
             InlineKeyboardButton(
                 "⬅️ Назад",
-                callback_data=f"warranty_category_{product.parent_category.id}"
+                callback_data=pack("warranty_category", product.parent_category.id)
             )
         )
         
@@ -339,8 +343,8 @@ def warranty_select_product(call: CallbackQuery) -> None:
 def warranty_select_issue(call: CallbackQuery) -> None:
     """Пользователь выбрал проблему - показываем решение"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        issue_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        issue_id = callback_id(call)
         issue = TypicalIssue.objects.get(id=issue_id)
         
         # Обновляем запрос по гарантии
@@ -365,11 +369,11 @@ def warranty_select_issue(call: CallbackQuery) -> None:
         # Клавиатура с кнопками
         markup = InlineKeyboardMarkup()
         markup.row(
-            InlineKeyboardButton("✅ Помогло", callback_data=f"warranty_helped_{warranty_request.id}"),
-            InlineKeyboardButton("❌ Не помогло", callback_data=f"warranty_not_helped_{warranty_request.id}")
+            InlineKeyboardButton("✅ Помогло", callback_data=pack("warranty_helped", warranty_request.id)),
+            InlineKeyboardButton("❌ Не помогло", callback_data=pack("warranty_not_helped", warranty_request.id))
         )
         markup.add(
-            InlineKeyboardButton("⬅️ Назад", callback_data=f"warranty_product_{issue.product.id}")
+            InlineKeyboardButton("⬅️ Назад", callback_data=pack("warranty_product", issue.product.id))
         )
         
         # Формируем текст
@@ -411,12 +415,11 @@ def warranty_select_issue(call: CallbackQuery) -> None:
         # Если есть файл, отправляем его
         if has_file:
             try:
-                with open(issue.solution_file.path, 'rb') as file:
-                    bot.send_document(
-                        chat_id=call.message.chat.id,
-                        document=file,
-                        caption=f"📋 Инструкция: {issue.title}"
-                    )
+                send_field_file(
+                    call.message.chat.id,
+                    issue.solution_file,
+                    caption=f"📋 Инструкция: {issue.title}"
+                )
             except Exception as e:
                 logger.error(f"Ошибка отправки файла решения: {e}")
         
@@ -430,8 +433,8 @@ def warranty_select_issue(call: CallbackQuery) -> None:
 def warranty_helped(call: CallbackQuery) -> None:
     """Решение помогло"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        request_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        request_id = callback_id(call)
         
         warranty_request = WarrantyRequest.objects.get(id=request_id)
         warranty_request.solution_helped = True
@@ -466,8 +469,8 @@ def warranty_helped(call: CallbackQuery) -> None:
 def warranty_not_helped(call: CallbackQuery) -> None:
     """Решение не помогло - переводим на менеджера"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        request_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        request_id = callback_id(call)
         
         warranty_request = WarrantyRequest.objects.get(id=request_id)
         warranty_request.solution_helped = False
@@ -515,8 +518,8 @@ def warranty_not_helped(call: CallbackQuery) -> None:
 def warranty_other(call: CallbackQuery) -> None:
     """Пользователь выбрал "Другое" - переводим на менеджера"""
     try:
-        user = User.objects.get(telegram_id=call.message.chat.id)
-        product_id = int(call.data.split('_')[-1])
+        user = get_user(call.message.chat.id)
+        product_id = callback_id(call)
         product = goods.objects.get(id=product_id)
         
         # Обновляем запрос по гарантии
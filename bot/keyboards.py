@@ -5,6 +5,8 @@ from telebot.types import (
     KeyboardButton,
 )
 from django.conf import settings
+
+from bot.callback_data import ACTIONS, pack
 from django.contrib.auth.models import User
 
 # Главное меню (базовое без админки)
@@ -76,30 +78,30 @@ def get_back_markup(callback_data):
 # Клавиатура для товара без кнопки расширенной гарантии
 def get_product_menu_markup(product_id):
     markup = InlineKeyboardMarkup()
-    markup.add(InlineKeyboardButton("📖 Инструкция", callback_data=f"instructions_{product_id}"))
-    markup.add(InlineKeyboardButton("❓ FAQ", callback_data=f"faq_{product_id}"))
-    markup.add(InlineKeyboardButton("⚠️ Типичные проблемы", callback_data=f"issues_{product_id}"))
+    markup.add(InlineKeyboardButton("📖 Инструкция", callback_data=pack("instructions", product_id)))
+    markup.add(InlineKeyboardButton("❓ FAQ", callback_data=pack("faq", product_id)))
+    markup.add(InlineKeyboardButton("⚠️ Типичные проблемы", callback_data=pack("issues", product_id)))
     #markup.add(InlineKeyboardButton("🛡️ Гарантия", callback_data=f"warranty_{product_id}"))
     #markup.add(InlineKeyboardButton("📞 Поддержка", callback_data=f"support_{product_id}"))
-    markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=f"category_{product_id}"))
+    markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=pack("category", product_id)))
     return markup
 
 # Клавиатура для активации расширенной гарантии
 def get_warranty_markup_with_extended(product_id, has_extended_warranty=False):
     markup = InlineKeyboardMarkup()
     if not has_extended_warranty:
-        markup.add(InlineKeyboardButton("✅ Активировать расширенную гарантию", callback_data=f"activate_warranty_{product_id}"))
+        markup.add(InlineKeyboardButton("✅ Активировать расширенную гарантию", callback_data=pack("activate_warranty", product_id)))
     
     # Добавляем дополнительные кнопки
     markup.add(InlineKeyboardButton("📋 Условия гарантии", callback_data="warranty_conditions"))
     markup.add(InlineKeyboardButton("🛠️ Обратиться по гарантии", callback_data="warranty_start"))
-    markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=f"product_{product_id}"))
+    markup.add(InlineKeyboardButton("⬅️ Назад", callback_data=pack("product", product_id)))
     return markup
 
 # Клавиатура для подтверждения отправки скриншота
 def get_screenshot_markup(product_id):
     markup = InlineKeyboardMarkup()
-    markup.add(InlineKeyboardButton("❌ Отменить", callback_data=f"cancel_warranty_{product_id}"))
+    markup.add(InlineKeyboardButton("❌ Отменить", callback_data=pack("cancel_warranty", product_id)))
     return markup
 
 def get_main_markup(user_id: int) -> ReplyKeyboardMarkup:
@@ -145,22 +147,22 @@ def get_admin_ticket_markup(ticket_id, is_assigned=False):
     """Создает клавиатуру для админа при получении уведомления о новом обращении"""
     markup = InlineKeyboardMarkup()
     if not is_assigned:
-        accept_btn = InlineKeyboardButton("✅ Принять обращение", callback_data=f"accept_ticket_{ticket_id}")
+        accept_btn = InlineKeyboardButton("✅ Принять обращение", callback_data=pack("accept_ticket", ticket_id))
         markup.add(accept_btn)
     else:
         already_assigned_btn = InlineKeyboardButton("⚠️ Обращение уже принято другим админом", callback_data="already_assigned")
         markup.add(already_assigned_btn)
     
-    view_btn = InlineKeyboardButton("👁️ Просмотреть обращение", callback_data=f"view_ticket_{ticket_id}")
+    view_btn = InlineKeyboardButton("👁️ Просмотреть обращение", callback_data=pack("view_ticket", ticket_id))
     markup.add(view_btn)
     return markup
 
 def get_admin_response_markup(ticket_id):
     """Создает клавиатуру для админа во время ответа на обращение"""
     markup = InlineKeyboardMarkup()
-    finish_btn = InlineKeyboardButton("🏁 Завершить обработку", callback_data=f"finish_ticket_{ticket_id}")
-    files_btn = InlineKeyboardButton("📎 Получить новые файлы", callback_data=f"get_ticket_files_{ticket_id}")
-    files_all_btn = InlineKeyboardButton("📎 Получить все файлы", callback_data=f"get_all_ticket_files_{ticket_id}")
+    finish_btn = InlineKeyboardButton("🏁 Завершить обработку", callback_data=pack("finish_ticket", ticket_id))
+    files_btn = InlineKeyboardButton("📎 Получить новые файлы", callback_data=pack("get_ticket_files", ticket_id))
+    files_all_btn = InlineKeyboardButton("📎 Получить все файлы", callback_data=pack("get_all_ticket_files", ticket_id))
     back_btn = InlineKeyboardButton("⬅️ Назад к обращениям", callback_data="admin_back_to_tickets")
     markup.add(finish_btn)
     markup.add(files_btn)
@@ -172,8 +174,8 @@ def get_admin_response_markup(ticket_id):
 def get_ticket_files_markup(ticket_id: int):
     """Кнопка под уведомлением: получить все файлы из обращения"""
     markup = InlineKeyboardMarkup()
-    btn_new = InlineKeyboardButton("📎 Получить новые файлы", callback_data=f"get_ticket_files_{ticket_id}")
-    btn_all = InlineKeyboardButton("📎 Получить все файлы", callback_data=f"get_all_ticket_files_{ticket_id}")
+    btn_new = InlineKeyboardButton("📎 Получить новые файлы", callback_data=pack("get_ticket_files", ticket_id))
+    btn_all = InlineKeyboardButton("📎 Получить все файлы", callback_data=pack("get_all_ticket_files", ticket_id))
     markup.add(btn_new)
     markup.add(btn_all)
     return markup
@@ -182,9 +184,9 @@ def get_ticket_files_markup(ticket_id: int):
 def get_admin_response_with_files_markup(ticket_id):
     """Создает клавиатуру для админа во время ответа на обращение с файлами"""
     markup = InlineKeyboardMarkup()
-    finish_btn = InlineKeyboardButton("🏁 Завершить обработку", callback_data=f"finish_ticket_{ticket_id}")
-    files_btn = InlineKeyboardButton("📎 Получить новые файлы", callback_data=f"get_ticket_files_{ticket_id}")
-    files_all_btn = InlineKeyboardButton("📎 Получить все файлы", callback_data=f"get_all_ticket_files_{ticket_id}")
+    finish_btn = InlineKeyboardButton("🏁 Завершить обработку", callback_data=pack("finish_ticket", ticket_id))
+    files_btn = InlineKeyboardButton("📎 Получить новые файлы", callback_data=pack("get_ticket_files", ticket_id))
+    files_all_btn = InlineKeyboardButton("📎 Получить все файлы", callback_data=pack("get_all_ticket_files", ticket_id))
     back_btn = InlineKeyboardButton("⬅️ Назад к обращениям", callback_data="admin_back_to_tickets")
     markup.add(finish_btn)
     markup.add(files_btn)
@@ -197,8 +199,8 @@ def get_admin_response_with_files_markup(ticket_id):
 def get_user_ticket_actions_markup(ticket_id: int):
     """Кнопки действий по выбранному обращению для пользователя"""
     markup = InlineKeyboardMarkup()
-    continue_btn = InlineKeyboardButton("✍️ Продолжить переписку", callback_data=f"support_open_{ticket_id}")
-    close_btn = InlineKeyboardButton("✅ Закрыть обращение", callback_data=f"support_close_{ticket_id}")
+    continue_btn = InlineKeyboardButton("✍️ Продолжить переписку", callback_data=pack("support_open", ticket_id))
+    close_btn = InlineKeyboardButton("✅ Закрыть обращение", callback_data=pack("support_close", ticket_id))
     back_btn = InlineKeyboardButton("⬅️ К списку обращений", callback_data="support_my_tickets")
     markup.add(continue_btn).add(close_btn).add(back_btn)
     return markup
@@ -208,7 +210,7 @@ def get_user_tickets_list_markup(tickets: list):
     markup = InlineKeyboardMarkup()
     for t in tickets:
         title = f"#{t.id} • {t.get_platform_display()} • {t.get_status_display()}"
-        markup.add(InlineKeyboardButton(title, callback_data=f"support_ticket_{t.id}"))
+        markup.add(InlineKeyboardButton(title, callback_data=pack("support_ticket", t.id)))
     markup.add(InlineKeyboardButton("⬅️ Назад", callback_data="help_main"))
     return markup
 
@@ -216,8 +218,8 @@ def get_user_tickets_list_markup(tickets: list):
 def get_admin_ticket_decision_markup(ticket_id: int):
     """Кнопки принятия или отказа от обращения после просмотра"""
     markup = InlineKeyboardMarkup()
-    accept_btn = InlineKeyboardButton("✅ Принять обращение", callback_data=f"accept_ticket_{ticket_id}")
-    decline_btn = InlineKeyboardButton("❌ Отказаться", callback_data=f"decline_ticket_{ticket_id}")
+    accept_btn = InlineKeyboardButton("✅ Принять обращение", callback_data=pack("accept_ticket", ticket_id))
+    decline_btn = InlineKeyboardButton("❌ Отказаться", callback_data=pack("decline_ticket", ticket_id))
     markup.add(accept_btn).add(decline_btn)
     return markup
 
@@ -227,7 +229,7 @@ def get_admin_open_tickets_markup(tickets: list):
     markup = InlineKeyboardMarkup()
     for t in tickets:
         title = f"#{t.id} • {t.user.user_name} • {t.get_platform_display()}"
-        markup.add(InlineKeyboardButton(title, callback_data=f"view_ticket_{t.id}"))
+        markup.add(InlineKeyboardButton(title, callback_data=pack("view_ticket", t.id)))
     markup.add(InlineKeyboardButton("⬅️ Админ-панель", callback_data="admin_panel"))
     return markup
 
@@ -238,7 +240,7 @@ def get_admin_in_progress_tickets_markup(tickets: list):
     for t in tickets:
         assigned = f" • {t.assigned_admin.user_name}" if t.assigned_admin else ""
         title = f"#{t.id} • {t.user.user_name} • {t.get_platform_display()}{assigned}"
-        markup.add(InlineKeyboardButton(title, callback_data=f"view_ticket_{t.id}"))
+        markup.add(InlineKeyboardButton(title, callback_data=pack("view_ticket", t.id)))
     markup.add(InlineKeyboardButton("⬅️ Админ-панель", callback_data="admin_panel"))
     return markup
 
@@ -261,7 +263,7 @@ def get_admin_my_tickets_markup(tickets: list):
         status = "🟢 В обработке" if t.status == 'in_progress' else "🟠 Открыто" if t.status == 'open' else "⚪️"
         unread = " • ✉️" if getattr(t, 'unread_by_admin', False) else ""
         title = f"#{t.id} • {t.user.user_name} • {t.get_platform_display()} • {status}{unread}"
-        markup.add(InlineKeyboardButton(title, callback_data=f"view_ticket_{t.id}"))
+        markup.add(InlineKeyboardButton(title, callback_data=pack("view_ticket", t.id)))
     markup.add(InlineKeyboardButton("⬅️ Админ-панель", callback_data="admin_panel"))
     return markup
 
@@ -292,7 +294,7 @@ def get_promocode_list_markup(promocodes):
     for promo in promocodes:
         status = "✅" if promo.is_active and not promo.is_used else "❌" if promo.is_used else "⏸️"
         btn_text = f"{promo.code} ({status})"
-        btn = InlineKeyboardButton(btn_text, callback_data=f"promocode_detail_{promo.id}")
+        btn = InlineKeyboardButton(btn_text, callback_data=pack("promocode_detail", promo.id))
         markup.add(btn)
     
     back_btn = InlineKeyboardButton("⬅️ Назад", callback_data="promocode_menu")
@@ -303,8 +305,8 @@ def get_promocode_list_markup(promocodes):
 def get_promocode_detail_markup(promo_id):
     """Клавиатура деталей промокода"""
     markup = InlineKeyboardMarkup()
-    toggle_btn = InlineKeyboardButton("🔄 Изменить статус", callback_data=f"promocode_toggle_{promo_id}")
-    delete_btn = InlineKeyboardButton("🗑️ Удалить", callback_data=f"promocode_delete_{promo_id}")
+    toggle_btn = InlineKeyboardButton("🔄 Изменить статус", callback_data=pack("promocode_toggle", promo_id))
+    delete_btn = InlineKeyboardButton("🗑️ Удалить", callback_data=pack("promocode_delete", promo_id))
     back_btn = InlineKeyboardButton("⬅️ Назад", callback_data="promocode_list")
     markup.add(toggle_btn).add(delete_btn).add(back_btn)
     return markup
@@ -317,7 +319,7 @@ def get_categories_markup(categories, prefix: str, back_callback: str):
     """
     markup = InlineKeyboardMarkup()
     for cat in categories:
-        btn = InlineKeyboardButton(cat.name, callback_data=f"{prefix}_{cat.id}")
+        btn = InlineKeyboardButton(cat.name, callback_data=pack(prefix, cat.id) if prefix in ACTIONS else f"{prefix}_{cat.id}")
         markup.add(btn)
     back_btn = InlineKeyboardButton("⬅️ Назад", callback_data=back_callback)
     markup.add(back_btn)
@@ -328,7 +330,7 @@ def get_promocode_categories_admin_markup(categories, back_callback: str):
     """Список категорий (только названия). Дальше пользователь выберет способ загрузки."""
     markup = InlineKeyboardMarkup()
     for cat in categories:
-        btn = InlineKeyboardButton(cat.name, callback_data=f"promocode_cat_select_{cat.id}")
+        btn = InlineKeyboardButton(cat.name, callback_data=pack("promocode_cat_select", cat.id))
         markup.add(btn)
     back_btn = InlineKeyboardButton("⬅️ Назад", callback_data=back_callback)
     markup.add(back_btn)
@@ -338,8 +340,8 @@ def get_promocode_categories_admin_markup(categories, back_callback: str):
 def get_promocode_category_actions_markup(category_id: int, back_callback: str):
     """Меню действий для выбранной категории: текстом или файлом + назад к списку категорий"""
     markup = InlineKeyboardMarkup()
-    text_btn = InlineKeyboardButton("➕ Загрузить списком (текст)", callback_data=f"promocode_cat_text_{category_id}")
-    file_btn = InlineKeyboardButton("📄 Загрузить файлом (.txt)", callback_data=f"promocode_cat_file_{category_id}")
+    text_btn = InlineKeyboardButton("➕ Загрузить списком (текст)", callback_data=pack("promocode_cat_text", category_id))
+    file_btn = InlineKeyboardButton("📄 Загрузить файлом (.txt)", callback_data=pack("promocode_cat_file", category_id))
     back_btn = InlineKeyboardButton("⬅️ К списку категорий", callback_data=back_callback)
     markup.add(text_btn)
     markup.add(file_btn)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from bot.cron import clean_expired_states
+
+
+class Command(BaseCommand):
+    help = 'Удаляет состояния диалогов с истекшим TTL'
+
+    def handle(self, *args, **options):
+        result = clean_expired_states()
+        self.stdout.write(self.style.SUCCESS(result))
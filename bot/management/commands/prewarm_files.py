@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from bot.file_cache import prewarm_files
+
+
+class Command(BaseCommand):
+    help = 'Загружает вложения каталога в служебный чат и запоминает их file_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products',
+                            help='Только файлы этого товара (можно указать несколько раз)')
+
+    def handle(self, *args, **options):
+        result = prewarm_files(options['products'])
+        self.stdout.write(self.style.SUCCESS(result))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from bot.cron import resume_interrupted_broadcasts
+
+
+class Command(BaseCommand):
+    help = 'Продолжает прерванные рассылки с контрольной точки'
+
+    def handle(self, *args, **options):
+        # Команда ждет окончания рассылок: фоновые потоки умерли бы вместе с процессом
+        result = resume_interrupted_broadcasts(wait=True)
+        self.stdout.write(self.style.SUCCESS(result))
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0017_fix_utf8mb4_encoding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=64, verbose_name='Пространство состояний')),
+                ('chat_id', models.BigIntegerField(verbose_name='ID чата')),
+                ('data', models.JSONField(default=dict, verbose_name='Данные состояния')),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Истекает')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Состояние диалога',
+                'verbose_name_plural': 'Состояния диалогов',
+                'unique_together': {('namespace', 'chat_id')},
+            },
+        ),
+    ]
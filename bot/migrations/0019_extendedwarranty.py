@@ -0,0 +1,158 @@
+import json
+from datetime import datetime, time
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_datetime(value):
+    try:
+        return timezone.make_aware(datetime.strptime(value, "%d.%m.%Y %H:%M:%S"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _legacy_entries(warranty_data):
+    """
+    Приводит старые форматы warranty_data к списку словарей. Старый код
+    сохранял данные и JSON-строкой - такие строки разбираются здесь же,
+    нечитаемые дают ValueError.
+    """
+    if isinstance(warranty_data, str):
+        warranty_data = json.loads(warranty_data)
+    if isinstance(warranty_data, list):
+        return [w for w in warranty_data if isinstance(w, dict)]
+    entries = []
+    if isinstance(warranty_data, dict):
+        # Самый старый формат: {product_id: {'info': {...}, 'screenshot': {...}}}
+        for pid, data in warranty_data.items():
+            if not isinstance(data, dict):
+                continue
+            info = data.get('info', {})
+            entries.append({
+                'product_id': pid,
+                'name': info.get('name', ''),
+                'warranty_period': info.get('warranty_period', ''),
+                'end_date': info.get('end_date', ''),
+                'purchase_date': info.get('review_date', ''),
+                'screenshot': data.get('screenshot'),
+                'status': info.get('status', 'Активна'),
+            })
+    return entries
+
+
+def _activated_at(screenshot_uploaded_at, purchase_date):
+    """Дата активации старой гарантии: загрузка скриншота, иначе дата покупки"""
+    if screenshot_uploaded_at is not None:
+        return screenshot_uploaded_at
+    if purchase_date is not None:
+        return timezone.make_aware(datetime.combine(purchase_date, time.min))
+    return None
+
+
+def _create_batch(ExtendedWarranty, batch):
+    """
+    bulk_create и затем перенос дат активации: created_at - auto_now_add, и
+    при вставке все старые гарантии получили бы время миграции.
+    """
+    created = ExtendedWarranty.objects.bulk_create([warranty for warranty, _ in batch])
+    dated = []
+    for warranty, activated_at in zip(created, (activated_at for _, activated_at in batch)):
+        if activated_at is not None and warranty.pk is not None:
+            warranty.created_at = activated_at
+            dated.append(warranty)
+    ExtendedWarranty.objects.bulk_update(dated, ['created_at'], batch_size=500)
+
+
+def migrate_warranty_data(apps, schema_editor):
+    User = apps.get_model('bot', 'User')
+    goods = apps.get_model('bot', 'goods')
+    ExtendedWarranty = apps.get_model('bot', 'ExtendedWarranty')
+
+    product_ids = set(goods.objects.values_list('id', flat=True))
+    today = timezone.now().date()
+    batch = []
+    skipped = unreadable = 0
+    for user in User.objects.only('warranty_data').iterator(chunk_size=500):
+        try:
+            entries = _legacy_entries(user.warranty_data)
+        except ValueError as e:
+            unreadable += 1
+            print(f"\n[ERROR] Не удалось разобрать warranty_data пользователя {user.pk}: {e}")
+            continue
+        for entry in entries:
+            end_date = _parse_date(entry.get('end_date'))
+            if end_date is None:
+                skipped += 1
+                continue
+            try:
+                product_id = int(entry.get('product_id'))
+            except (TypeError, ValueError):
+                product_id = None
+            screenshot = entry.get('screenshot') or {}
+            if not isinstance(screenshot, dict):
+                screenshot = {}
+            purchase_date = _parse_date(entry.get('purchase_date'))
+            screenshot_uploaded_at = _parse_datetime(screenshot.get('upload_date'))
+            batch.append((ExtendedWarranty(
+                user_id=user.pk,
+                product_id=product_id if product_id in product_ids else None,
+                name=(entry.get('name') or '')[:100],
+                warranty_period=(entry.get('warranty_period') or '')[:50],
+                purchase_date=purchase_date,
+                end_date=end_date,
+                screenshot_id=screenshot.get('photo_id'),
+                screenshot_uploaded_at=screenshot_uploaded_at,
+                status='active' if entry.get('status', 'Активна') == 'Активна' and end_date >= today else 'expired',
+            ), _activated_at(screenshot_uploaded_at, purchase_date)))
+        if len(batch) >= 500:
+            _create_batch(ExtendedWarranty, batch)
+            batch = []
+    if batch:
+        _create_batch(ExtendedWarranty, batch)
+    if skipped:
+        print(f"\n[LOG] Пропущено гарантий без корректной даты окончания: {skipped}")
+    if unreadable:
+        print(f"\n[LOG] Пользователей с нечитаемым warranty_data: {unreadable}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0018_conversationstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtendedWarranty',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название товара на момент активации')),
+                ('warranty_period', models.CharField(blank=True, max_length=50, verbose_name='Срок гарантии')),
+                ('purchase_date', models.DateField(blank=True, null=True, verbose_name='Дата покупки (отзыва)')),
+                ('end_date', models.DateField(db_index=True, verbose_name='Дата окончания')),
+                ('screenshot_id', models.CharField(blank=True, max_length=255, null=True, verbose_name='ID скриншота отзыва')),
+                ('screenshot_uploaded_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата загрузки скриншота')),
+                ('status', models.CharField(choices=[('active', 'Активна'), ('expired', 'Истекла')], default='active', max_length=20, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата активации')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='extended_warranties', to='bot.goods', verbose_name='Товар')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='extended_warranties', to='bot.user', verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Расширенная гарантия',
+                'verbose_name_plural': 'Расширенные гарантии',
+                'ordering': ['end_date'],
+                'indexes': [models.Index(fields=['status', 'end_date'], name='bot_extwarr_status_end_idx')],
+            },
+        ),
+        # warranty_data не очищаем: старые данные остаются для отката
+        migrations.RunPython(migrate_warranty_data, migrations.RunPython.noop),
+    ]
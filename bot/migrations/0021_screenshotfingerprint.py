@@ -0,0 +1,43 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0020_telegramfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScreenshotFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_hash', models.CharField(max_length=64, verbose_name='Перцептивный хэш')),
+                ('file_id', models.CharField(max_length=255, verbose_name='file_id скриншота')),
+                ('file_unique_id', models.CharField(db_index=True, max_length=64, verbose_name='file_unique_id скриншота')),
+                ('verdict', models.JSONField(blank=True, null=True, verbose_name='Результат проверки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата проверки')),
+                ('duplicate_of', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='bot.screenshotfingerprint', verbose_name='Повтор скриншота')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='screenshot_fingerprints', to='bot.goods', verbose_name='Товар')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='screenshot_fingerprints', to='bot.user', verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Отпечаток скриншота',
+                'verbose_name_plural': 'Отпечатки скриншотов',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ScreenshotHashBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=16, verbose_name='Номер и значение полосы')),
+                ('fingerprint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='bot.screenshotfingerprint', verbose_name='Отпечаток')),
+            ],
+            options={
+                'verbose_name': 'Полоса хэша скриншота',
+                'verbose_name_plural': 'Полосы хэшей скриншотов',
+            },
+        ),
+    ]
@@ -1,9 +1,82 @@
+import copy
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+logger = logging.getLogger(__name__)
+
+
+class DirtyFieldsMixin:
+    """
+    Отслеживает измененные поля модели.
+
+    save() без update_fields для уже существующей записи пишет только
+    изменившиеся поля (и ничего не пишет, если изменений нет). При
+    USER_SAVE_DEBUG=True каждый такой вызов логируется с местом вызова,
+    чтобы находить полные сохранения в горячих хендлерах.
+    """
+
+    def _reset_dirty_state(self, fields=None) -> None:
+        if fields is None or not hasattr(self, '_original_state'):
+            self._original_state = {}
+            fields = None
+        deferred = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname in deferred:
+                continue
+            if fields is None or field.name in fields or field.attname in fields:
+                # JSON-поля копируем: их часто меняют на месте
+                self._original_state[field.attname] = copy.deepcopy(getattr(self, field.attname))
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._reset_dirty_state()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._reset_dirty_state(fields)
+
+    def get_dirty_fields(self) -> list:
+        """Имена полей, изменившихся с момента загрузки или последнего сохранения"""
+        original = getattr(self, '_original_state', None)
+        if original is None:
+            return [f.attname for f in self._meta.concrete_fields if not f.primary_key]
+        return [name for name, value in original.items() if getattr(self, name) != value]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        tracked = hasattr(self, '_original_state') and not self._state.adding
+        if update_fields is None and tracked and not kwargs.get('force_insert') and not args:
+            dirty = self.get_dirty_fields()
+            if getattr(settings, 'USER_SAVE_DEBUG', False):
+                caller = traceback.extract_stack(limit=2)[0]
+                logger.warning(
+                    f"[DEBUG] {type(self).__name__}.save() без update_fields в "
+                    f"{caller.filename}:{caller.lineno} ({caller.name}), изменено: {dirty}"
+                )
+            if not dirty:
+                return
+            kwargs['update_fields'] = dirty
+        elif update_fields is None and getattr(settings, 'USER_SAVE_DEBUG', False) and not self._state.adding:
+            caller = traceback.extract_stack(limit=2)[0]
+            logger.warning(
+                f"[DEBUG] Полное сохранение {type(self).__name__} в "
+                f"{caller.filename}:{caller.lineno} ({caller.name})"
+            )
+        super().save(*args, **kwargs)
+        self._reset_dirty_state(kwargs.get('update_fields'))
+
 
-class User(models.Model):
+class User(DirtyFieldsMixin, models.Model):
     telegram_id = models.CharField(
         primary_key=True,
         max_length=50
@@ -95,6 +168,26 @@ class User(models.Model):
     def __str__(self):
         return str(self.user_name)
 
+    @property
+    def screenshots_today(self) -> int:
+        """Счетчик скриншотов за сегодня (устаревший счетчик считается нулевым)"""
+        if self.last_screenshot_date != timezone.now().date():
+            return 0
+        return self.screenshots_count
+
+    def reset_screenshots_if_stale(self) -> bool:
+        """
+        Ленивый сброс дневного счетчика при чтении: если последний скриншот
+        был не сегодня, счетчик обнуляется. Ежедневный cron только подчищает
+        счетчики одним UPDATE, лимит от него не зависит.
+        """
+        today = timezone.now().date()
+        if self.last_screenshot_date == today:
+            return False
+        self.screenshots_count = 0
+        self.last_screenshot_date = today
+        return True
+
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
@@ -233,6 +326,43 @@ class ProductImage(models.Model):
         verbose_name_plural = 'Изображения товаров'
         ordering = ['-created_at']
 
+
+# Эталон товара для проверки скриншотов (bot/apis/reference_images.py) сбрасывается
+# сигналами, а не в save()/delete(): так его сбрасывают и удаления через QuerySet, и
+# каскадное удаление товара. QuerySet.update() сигналов не шлет - после него эталон
+# обновится по истечении REFERENCE_IMAGE_CACHE_TTL.
+@receiver(pre_save, sender=ProductImage)
+def _remember_previous_product_image(sender, instance, raw=False, **kwargs):
+    # Товар и файл до сохранения: изображение могли перенести к другому товару
+    instance._previous_image = None
+    if not raw and instance.pk is not None:
+        instance._previous_image = (
+            ProductImage.objects.filter(pk=instance.pk).values_list('product_id', 'image').first()
+        )
+
+
+@receiver(post_save, sender=ProductImage)
+def _invalidate_saved_product_image(sender, instance, raw=False, **kwargs):
+    from bot.apis.reference_images import invalidate_reference_image
+    invalidate_reference_image(instance.product_id)
+    previous = getattr(instance, '_previous_image', None)
+    if previous is None:
+        return
+    product_id, image_name = previous
+    # Замененный файл: готовый эталон рядом со старым изображением больше не нужен
+    image_path = None
+    if image_name and image_name != instance.image.name:
+        image_path = instance.image.storage.path(image_name)
+    if product_id != instance.product_id or image_path:
+        invalidate_reference_image(product_id, image_path)
+
+
+@receiver(post_delete, sender=ProductImage)
+def _invalidate_deleted_product_image(sender, instance, **kwargs):
+    from bot.apis.reference_images import invalidate_reference_image
+    invalidate_reference_image(instance.product_id, instance.image.path if instance.image else None)
+
+
 class goods(models.Model):
     parent_category = models.ForeignKey(
         goods_category,
@@ -391,6 +521,12 @@ class SupportTicket(models.Model):
         blank=True,
         verbose_name='Время отправки уведомления владельцу'
     )
+    next_escalation_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Время следующего напоминания',
+        help_text='Когда cron отправит следующее уведомление по открытому обращению (пусто - уведомлений больше нет)'
+    )
     unread_by_admin = models.BooleanField(
         default=False,
         verbose_name='Есть непрочитанные сообщения для админа'
@@ -424,13 +560,51 @@ class SupportTicket(models.Model):
         help_text='Словарь {admin_telegram_id: [message_id, ...]}'
     )
 
+    # Задержки от создания обращения: первое и второе напоминание админам, уведомление владельцу
+    ESCALATION_DELAYS = (
+        timedelta(minutes=5),
+        timedelta(minutes=10),
+        timedelta(minutes=15),
+    )
+    ESCALATION_FIELDS = (
+        'first_admin_notification_sent',
+        'second_admin_notification_sent',
+        'owner_notification_sent',
+    )
+
     def __str__(self):
         return f"Обращение #{self.id} от {self.user.user_name} ({self.get_platform_display()})"
 
+    @property
+    def escalation_level(self) -> int:
+        """Сколько ступеней эскалации уже пройдено (0-3)"""
+        level = 0
+        for field in self.ESCALATION_FIELDS:
+            if not getattr(self, field):
+                break
+            level += 1
+        return level
+
+    def compute_next_escalation_at(self):
+        """Срок следующей ступени эскалации или None, если все уведомления отправлены"""
+        level = self.escalation_level
+        if level >= len(self.ESCALATION_DELAYS):
+            return None
+        return (self.created_at or timezone.now()) + self.ESCALATION_DELAYS[level]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.next_escalation_at is None:
+            self.next_escalation_at = timezone.now() + self.ESCALATION_DELAYS[0]
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Обращение в поддержку'
         verbose_name_plural = 'Обращения в поддержку'
         ordering = ['-created_at']
+        indexes = [
+            # Выборка обращений, по которым пора слать напоминание (cron раз в минуту)
+            models.Index(fields=['status', 'next_escalation_at'], name='bot_ticket_status_escal_idx'),
+        ]
 
 
 class SupportMessage(models.Model):
@@ -526,6 +700,14 @@ class OwnerSettings(models.Model):
 
 class BroadcastMessage(models.Model):
     """Модель для хранения и отправки рассылок пользователям"""
+    STATUS_CHOICES = [
+        ('draft', 'Черновик'),
+        ('queued', 'В очереди'),
+        ('running', 'Отправляется'),
+        ('done', 'Завершена'),
+        ('cancelled', 'Отменена'),
+    ]
+
     title = models.CharField(
         max_length=255,
         verbose_name='Заголовок'
@@ -546,15 +728,110 @@ class BroadcastMessage(models.Model):
         blank=True,
         verbose_name='Время отправки'
     )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='draft',
+        verbose_name='Статус'
+    )
+    total_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Получателей'
+    )
+    sent_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Доставлено'
+    )
+    failed_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Ошибок'
+    )
+    last_user_id = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+        verbose_name='Последний обработанный пользователь',
+        help_text='Контрольная точка: рассылка продолжается с пользователей с telegram_id больше этого'
+    )
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Время запуска'
+    )
+    heartbeat_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Последняя активность',
+        help_text='Обновляется после каждой страницы получателей; по нему находятся прерванные рассылки'
+    )
+    report_chat_id = models.CharField(
+        max_length=50,
+        null=True,
+        blank=True,
+        verbose_name='Чат для отчета о прогрессе'
+    )
+    report_message_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='Сообщение с прогрессом'
+    )
 
     def __str__(self):
         return f"{self.title} ({'отправлено' if self.is_sent else 'не отправлено'})"
 
+    @property
+    def processed_count(self) -> int:
+        return self.sent_count + self.failed_count
+
     class Meta:
         verbose_name = 'Рассылка'
         verbose_name_plural = 'Рассылки'
 
 
+class BroadcastDelivery(models.Model):
+    """Результат доставки рассылки одному пользователю"""
+    STATUS_CHOICES = [
+        ('sent', 'Доставлено'),
+        ('failed', 'Ошибка'),
+    ]
+
+    broadcast = models.ForeignKey(
+        BroadcastMessage,
+        on_delete=models.CASCADE,
+        related_name='deliveries',
+        verbose_name='Рассылка'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='broadcast_deliveries',
+        verbose_name='Пользователь'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        verbose_name='Статус'
+    )
+    error = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        verbose_name='Ошибка'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Время отправки'
+    )
+
+    def __str__(self):
+        return f"{self.broadcast_id} -> {self.user_id}: {self.status}"
+
+    class Meta:
+        verbose_name = 'Доставка рассылки'
+        verbose_name_plural = 'Доставки рассылок'
+        unique_together = ('broadcast', 'user')
+
+
 class PromoCodeCategory(models.Model):
     name = models.CharField(
         max_length=100,
@@ -588,14 +865,46 @@ class PromoCodeCategory(models.Model):
         auto_now_add=True,
         verbose_name='Дата создания'
     )
+    available_count = models.IntegerField(
+        null=True,
+        blank=True,
+        verbose_name='Осталось промокодов',
+        help_text='Кэш количества активных неиспользованных промокодов; пусто - пересчитать при следующем чтении'
+    )
+    low_stock_threshold = models.PositiveIntegerField(
+        default=10,
+        verbose_name='Порог малого остатка',
+        help_text='Когда промокодов остается столько или меньше, главный админ получает одно уведомление'
+    )
+    shortage_notified_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Уведомление о малом остатке',
+        help_text='Время последнего уведомления; сбрасывается, когда остаток снова выше порога'
+    )
     
     def __str__(self):
         return self.name
     
+    def refresh_available_count(self) -> int:
+        """Пересчитывает кэшированный остаток промокодов одним COUNT"""
+        self.available_count = self.promocodes.filter(is_active=True, is_used=False).count()
+        PromoCodeCategory.objects.filter(id=self.id).update(available_count=self.available_count)
+        if self.available_count > self.low_stock_threshold:
+            PromoCodeCategory.objects.filter(id=self.id).update(shortage_notified_at=None)
+        return self.available_count
+    
     def promocodes_count(self):
-        """Количество активных неиспользованных промокодов в категории"""
-        return self.promocodes.filter(is_active=True, is_used=False).count()
+        """Количество активных неиспользованных промокодов в категории (из кэша)"""
+        if self.available_count is None:
+            return self.refresh_available_count()
+        return self.available_count
     promocodes_count.short_description = 'Кол-во промокодов'
+    promocodes_count.admin_order_field = 'available_count'
+    
+    @property
+    def is_low_stock(self) -> bool:
+        return self.promocodes_count() <= self.low_stock_threshold
     
     def save(self, *args, **kwargs):
         """Переопределяем save для правильного сохранения многострочного текста с эмодзи"""
@@ -671,6 +980,48 @@ class PromoCode(models.Model):
         verbose_name = 'Промокод'
         verbose_name_plural = 'Промокоды'
         ordering = ['-created_at']
+        indexes = [
+            # Выдача: первый свободный промокод категории
+            models.Index(fields=['category', 'is_used', 'is_active', 'id'], name='bot_promo_alloc_idx'),
+        ]
+
+
+class PromoCodeClaim(models.Model):
+    """Выдача промокода пользователю (вместо удаления выданного промокода)"""
+    promocode = models.OneToOneField(
+        PromoCode,
+        on_delete=models.CASCADE,
+        related_name='claim',
+        verbose_name='Промокод'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='promocode_claims',
+        verbose_name='Пользователь'
+    )
+    category = models.ForeignKey(
+        PromoCodeCategory,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='claims',
+        verbose_name='Категория'
+    )
+    claimed_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата выдачи'
+    )
+
+    def __str__(self):
+        return f"{self.promocode.code} -> {self.user_id}"
+
+    class Meta:
+        verbose_name = 'Выданный промокод'
+        verbose_name_plural = 'Выданные промокоды'
+        # Один промокод категории на пользователя: повторное нажатие не выдаст второй
+        unique_together = ('user', 'category')
+        ordering = ['-claimed_at']
 
 
 class TypicalIssue(models.Model):
@@ -920,3 +1271,228 @@ class ProductWarrantyQuestion(models.Model):
         verbose_name = 'Вопрос гарантии товара'
         verbose_name_plural = 'Вопросы гарантии товаров'
         ordering = ['product', 'order', 'id']
+
+
+class ConversationState(models.Model):
+    """Состояние диалога (FSM) для бэкенда хранилища состояний 'db'"""
+    namespace = models.CharField(
+        max_length=64,
+        verbose_name='Пространство состояний'
+    )
+    chat_id = models.BigIntegerField(
+        verbose_name='ID чата'
+    )
+    data = models.JSONField(
+        default=dict,
+        verbose_name='Данные состояния'
+    )
+    expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        verbose_name='Истекает'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата обновления'
+    )
+
+    def __str__(self):
+        return f"{self.namespace}:{self.chat_id}"
+
+    class Meta:
+        verbose_name = 'Состояние диалога'
+        verbose_name_plural = 'Состояния диалогов'
+        unique_together = ('namespace', 'chat_id')
+
+
+class ExtendedWarranty(models.Model):
+    """Активированная расширенная гарантия (ранее хранилась в User.warranty_data)"""
+    STATUS_CHOICES = [
+        ('active', 'Активна'),
+        ('expired', 'Истекла'),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='extended_warranties',
+        verbose_name='Пользователь'
+    )
+    product = models.ForeignKey(
+        goods,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='extended_warranties',
+        verbose_name='Товар'
+    )
+    name = models.CharField(
+        max_length=100,
+        verbose_name='Название товара на момент активации'
+    )
+    warranty_period = models.CharField(
+        max_length=50,
+        blank=True,
+        verbose_name='Срок гарантии'
+    )
+    purchase_date = models.DateField(
+        null=True,
+        blank=True,
+        verbose_name='Дата покупки (отзыва)'
+    )
+    end_date = models.DateField(
+        db_index=True,
+        verbose_name='Дата окончания'
+    )
+    screenshot_id = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        verbose_name='ID скриншота отзыва'
+    )
+    screenshot_uploaded_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Дата загрузки скриншота'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='active',
+        verbose_name='Статус'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата активации'
+    )
+
+    def __str__(self):
+        return f"{self.name} до {self.end_date:%d.%m.%Y}"
+
+    @property
+    def is_expired(self):
+        return self.end_date < timezone.now().date()
+
+    class Meta:
+        verbose_name = 'Расширенная гарантия'
+        verbose_name_plural = 'Расширенные гарантии'
+        ordering = ['end_date']
+        indexes = [
+            # Выборка истекших активных гарантий в cron
+            models.Index(fields=['status', 'end_date'], name='bot_extwarr_status_end_idx'),
+        ]
+
+
+class TelegramFile(models.Model):
+    """
+    Кэш file_id файлов, уже загруженных в Telegram. Повторная отправка того же
+    содержимого идет по file_id, без загрузки файла.
+    """
+    key = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Ключ содержимого'
+    )
+    file_id = models.CharField(
+        max_length=255,
+        verbose_name='file_id в Telegram'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата загрузки'
+    )
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        verbose_name = 'Файл в Telegram'
+        verbose_name_plural = 'Файлы в Telegram'
+
+
+class ScreenshotFingerprint(models.Model):
+    """
+    Перцептивный хэш (dHash) проверенного скриншота отзыва и вердикт проверки.
+    Повторная отправка того же скриншота (в том числе пересжатого или
+    уменьшенного) берет вердикт отсюда без запроса к модели компьютерного
+    зрения, а скриншот другого пользователя помечается как повторный.
+    """
+    image_hash = models.CharField(
+        max_length=64,
+        verbose_name='Перцептивный хэш'
+    )
+    file_id = models.CharField(
+        max_length=255,
+        verbose_name='file_id скриншота'
+    )
+    file_unique_id = models.CharField(
+        max_length=64,
+        db_index=True,
+        verbose_name='file_unique_id скриншота'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='screenshot_fingerprints',
+        verbose_name='Пользователь'
+    )
+    product = models.ForeignKey(
+        goods,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='screenshot_fingerprints',
+        verbose_name='Товар'
+    )
+    verdict = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name='Результат проверки'
+    )
+    duplicate_of = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='duplicates',
+        verbose_name='Повтор скриншота'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата проверки'
+    )
+
+    def __str__(self):
+        return f"{self.image_hash[:16]}… ({self.user_id})"
+
+    class Meta:
+        verbose_name = 'Отпечаток скриншота'
+        verbose_name_plural = 'Отпечатки скриншотов'
+        ordering = ['-created_at']
+
+
+class ScreenshotHashBand(models.Model):
+    """
+    Часть хэша скриншота для поиска похожих: хэш делится на полосы, и у
+    хэшей с малым расстоянием Хэмминга хотя бы одна полоса совпадает
+    (поиск по индексу вместо перебора всех отпечатков).
+    """
+    fingerprint = models.ForeignKey(
+        ScreenshotFingerprint,
+        on_delete=models.CASCADE,
+        related_name='bands',
+        verbose_name='Отпечаток'
+    )
+    key = models.CharField(
+        max_length=16,
+        db_index=True,
+        verbose_name='Номер и значение полосы'
+    )
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        verbose_name = 'Полоса хэша скриншота'
+        verbose_name_plural = 'Полосы хэшей скриншотов'
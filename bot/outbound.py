@@ -0,0 +1,380 @@
+import heapq
+import inspect
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+import requests
+import telebot
+from django.conf import settings
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих запросов: меньше - раньше
+PRIORITY_INTERACTIVE = 0   # ответы пользователю в хендлерах
+PRIORITY_NOTIFICATION = 1  # напоминания админам, уведомления из cron
+PRIORITY_BULK = 2          # рассылки
+
+_local = threading.local()
+
+
+def current_priority() -> int:
+    return getattr(_local, 'priority', PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def outbound_priority(priority: int):
+    """Все отправки внутри блока в текущем потоке идут с указанным приоритетом"""
+    previous = current_priority()
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class TokenBucket:
+    """Ведро токенов: rate запросов в секунду, всплеск до capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до свободного токена (0 - можно отправлять)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        """Блокирует ведро до момента until (ответ 429 с retry_after)"""
+        self.blocked_until = max(self.blocked_until, until)
+
+    def is_idle(self, now: float) -> bool:
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+# Методы, создающие новое сообщение: после таймаута ответа запрос мог уже дойти,
+# и повтор отправил бы дубль
+NON_IDEMPOTENT_PREFIXES = ('send_', 'copy_message', 'forward_message')
+
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'chat_id', 'func', 'args', 'kwargs', 'future', 'attempts', 'files')
+
+    def __init__(self, priority, seq, chat_id, func, args, kwargs):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempts = 0
+        # Открытые файлы (document, photo...) и их позиции до первой попытки
+        self.files = []
+        for value in itertools.chain(args, kwargs.values()):
+            if hasattr(value, 'read'):
+                try:
+                    position = value.tell() if value.seekable() else None
+                except (AttributeError, OSError, ValueError):
+                    position = None
+                self.files.append((value, position))
+
+    def rewind(self) -> bool:
+        """
+        Возвращает файлы к исходной позиции перед повтором: первая попытка уже
+        дочитала их до конца. False - файл не перематывается, повторять нельзя.
+        """
+        for file, position in self.files:
+            if position is None:
+                return False
+            try:
+                file.seek(position)
+            except (OSError, ValueError):
+                return False
+        return True
+
+    @property
+    def creates_message(self) -> bool:
+        return getattr(self.func, '__name__', '').startswith(NON_IDEMPOTENT_PREFIXES)
+
+
+class OutboundDispatcher:
+    """
+    Очередь исходящих запросов к Telegram.
+
+    Один поток-диспетчер выбирает запросы по приоритету и пропускает их через
+    глобальное ведро токенов и ведро чата, отправкой занимаются потоки пула.
+    На 429 запрос откладывается на retry_after (чат при этом блокируется),
+    на сетевые ошибки - повторяется с экспоненциальной задержкой. Файлы в
+    аргументах перед повтором перематываются; send_* после таймаута ответа
+    не повторяются, чтобы не отправить сообщение дважды.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int,
+                 workers: int, max_retries: int, timeout: float):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = max(1, chat_burst)
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[Any, TokenBucket] = {}
+        # Чаты со своим лимитом (группы и каналы: около 20 сообщений в минуту)
+        self._chat_limits: Dict[str, tuple] = {}
+        self._ready = []    # (priority, seq, job)
+        self._delayed = []  # (not_before, seq, job)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stopping = False
+        self._last_prune = time.monotonic()
+
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="outbound")
+            self._thread = threading.Thread(target=self._run, name="outbound-dispatcher", daemon=True)
+            self._thread.start()
+        logger.info(
+            f"[LOG] Очередь исходящих запущена: {self.global_rate}/с глобально, "
+            f"{self.chat_rate}/с на чат, потоков {self.workers}"
+        )
+
+    def submit(self, func: Callable, args: tuple = (), kwargs: Optional[dict] = None,
+               chat_id: Any = None, priority: Optional[int] = None) -> Future:
+        """Ставит запрос в очередь и возвращает Future с результатом"""
+        if self._thread is None:
+            self.start()
+        priority = current_priority() if priority is None else priority
+        # '123' и 123 - один и тот же чат
+        chat_id = str(chat_id) if chat_id is not None else None
+        with self._cond:
+            job = _Job(priority, next(self._seq), chat_id, func, args, kwargs or {})
+            heapq.heappush(self._ready, (job.priority, job.seq, job))
+            self._cond.notify()
+        return job.future
+
+    def call(self, func: Callable, args: tuple = (), kwargs: Optional[dict] = None,
+             chat_id: Any = None, priority: Optional[int] = None) -> Any:
+        """Синхронная отправка через очередь: ждет результат и пробрасывает исключение"""
+        if getattr(_local, 'in_sender', False):
+            # Вызов из потока отправки (например, из самого запроса) - без очереди
+            return func(*args, **(kwargs or {}))
+        return self.submit(func, args, kwargs, chat_id, priority).result(timeout=self.timeout)
+
+    def pending(self) -> Dict[str, int]:
+        with self._cond:
+            return {'ready': len(self._ready), 'delayed': len(self._delayed), 'chats': len(self._chats)}
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Останавливает диспетчер после отправки всего, что уже в очереди"""
+        with self._cond:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+            thread, executor = self._thread, self._executor
+        thread.join(timeout)
+        executor.shutdown(wait=True)
+        with self._cond:
+            self._thread = None
+            self._executor = None
+        logger.info(f"[LOG] Очередь исходящих остановлена, осталось: {self.pending()}")
+
+    def set_chat_limit(self, chat_id, rate: float, burst: int = 1) -> None:
+        """Отдельный лимит для чата (rate запросов в секунду, всплеск burst)"""
+        chat_id = str(chat_id)
+        with self._cond:
+            if self._chat_limits.get(chat_id) == (rate, burst):
+                return
+            self._chat_limits[chat_id] = (rate, burst)
+            self._chats.pop(chat_id, None)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            rate, burst = self._chat_limits.get(chat_id, (self.chat_rate, self.chat_burst))
+            bucket = self._chats[chat_id] = TokenBucket(rate, burst)
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        # Полные ведра ничем не отличаются от новых - не держим их в памяти
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for chat_id in [c for c, b in self._chats.items() if b.is_idle(now)]:
+            del self._chats[chat_id]
+
+    def _next_job(self) -> Optional[_Job]:
+        """Ждет и возвращает запрос, который можно отправить (None - остановка)"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, job = heapq.heappop(self._delayed)
+                    heapq.heappush(self._ready, (job.priority, job.seq, job))
+                if self._stopping and not self._ready and not self._delayed:
+                    return None
+                self._prune(now)
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                if self._ready:
+                    global_wait = self._global.wait_time(now)
+                    if global_wait <= 0:
+                        _, _, job = heapq.heappop(self._ready)
+                        if job.future.cancelled():
+                            # Отмененный запрос (например, по таймауту рассылки) не отправляем
+                            continue
+                        if job.chat_id is not None:
+                            chat_wait = self._chat_bucket(job.chat_id).wait_time(now)
+                            if chat_wait > 0:
+                                # Чат упирается в свой лимит - пропускаем вперед другие чаты
+                                heapq.heappush(self._delayed, (now + chat_wait, job.seq, job))
+                                continue
+                            self._chat_bucket(job.chat_id).consume(now)
+                        self._global.consume(now)
+                        return job
+                    timeout = global_wait if timeout is None else min(timeout, global_wait)
+                self._cond.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            self._executor.submit(self._execute, job)
+
+    def _retry(self, job: _Job, delay: float, block_chat: bool = False) -> bool:
+        """Откладывает повтор; False - повтор невозможен (файл не перематывается)"""
+        if not job.rewind():
+            logger.warning(f"[WARNING] Запрос в чат {job.chat_id} с неперематываемым файлом не повторяется")
+            return False
+        job.attempts += 1
+        with self._cond:
+            not_before = time.monotonic() + delay
+            if block_chat:
+                if job.chat_id is not None:
+                    self._chat_bucket(job.chat_id).block(not_before)
+                else:
+                    self._global.block(not_before)
+            heapq.heappush(self._delayed, (not_before, job.seq, job))
+            self._cond.notify()
+        return True
+
+    def _execute(self, job: _Job) -> None:
+        _local.in_sender = True
+        # После начала отправки запрос уже не отменить
+        if job.attempts == 0 and not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = job.func(*job.args, **job.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and job.attempts < self.max_retries:
+                retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                logger.warning(f"[WARNING] 429 для чата {job.chat_id}, повтор через {retry_after} с")
+                if self._retry(job, retry_after, block_chat=True):
+                    return
+            job.future.set_exception(e)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # Таймаут ответа (не соединения): сообщение могло уже уйти
+            delivered_maybe = isinstance(e, requests.Timeout) and not isinstance(e, requests.ConnectTimeout)
+            if job.attempts < self.max_retries and not (delivered_maybe and job.creates_message):
+                delay = 2 ** job.attempts
+                logger.warning(f"[WARNING] Сетевая ошибка при отправке в чат {job.chat_id}, повтор через {delay} с: {e}")
+                if self._retry(job, delay):
+                    return
+            job.future.set_exception(e)
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+
+
+outbound = OutboundDispatcher(
+    global_rate=settings.OUTBOUND_GLOBAL_RATE,
+    chat_rate=settings.OUTBOUND_CHAT_RATE,
+    chat_burst=settings.OUTBOUND_CHAT_BURST,
+    workers=settings.OUTBOUND_WORKERS,
+    max_retries=settings.OUTBOUND_MAX_RETRIES,
+    timeout=settings.OUTBOUND_TIMEOUT,
+)
+
+
+# Методы TeleBot, которые отправляют сообщения в чаты и подпадают под лимиты Telegram
+QUEUED_METHODS = (
+    'send_message', 'edit_message_text', 'edit_message_reply_markup', 'edit_message_caption',
+    'send_photo', 'send_document', 'send_video', 'send_media_group',
+    'copy_message', 'forward_message',
+)
+
+
+def _chat_id_of(method: Callable, args: tuple, kwargs: dict):
+    try:
+        return inspect.signature(method).bind_partial(*args, **kwargs).arguments.get('chat_id')
+    except TypeError:
+        return None
+
+
+def _queued(name: str):
+    method = getattr(telebot.TeleBot, name)
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        args = (self,) + args
+        return outbound.call(method, args, kwargs, chat_id=_chat_id_of(method, args, kwargs))
+    return wrapper
+
+
+class RateLimitedTeleBot(telebot.TeleBot):
+    """
+    TeleBot, отправляющий сообщения через очередь outbound.
+    Для хендлеров вызовы остаются синхронными: метод возвращает результат
+    (или бросает исключение) как обычный TeleBot.
+    """
+
+    def submit_request(self, name: str, *args, **kwargs) -> Future:
+        """
+        Неблокирующий вызов метода TeleBot через очередь, например
+        bot.submit_request('send_message', chat_id, text). Для рассылок
+        админам: все сообщения ставятся в очередь сразу, результат - в Future.
+        """
+        method = getattr(telebot.TeleBot, name)
+        args = (self,) + args
+        if not settings.OUTBOUND_QUEUE:
+            future = Future()
+            try:
+                future.set_result(method(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return outbound.submit(method, args, kwargs, chat_id=_chat_id_of(method, args, kwargs))
+
+
+if settings.OUTBOUND_QUEUE:
+    for _name in QUEUED_METHODS:
+        setattr(RateLimitedTeleBot, _name, _queued(_name))
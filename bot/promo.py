@@ -0,0 +1,335 @@
+import codecs
+import csv
+import io
+import logging
+import time
+import zipfile
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from bot.models import PromoCode, PromoCodeCategory, PromoCodeClaim, User
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз пробовать забрать промокод без блокировок строк (SQLite)
+OPTIMISTIC_ATTEMPTS = 5
+
+# Максимальная длина промокода (PromoCode.code)
+CODE_MAX_LENGTH = PromoCode._meta.get_field('code').max_length
+# Заголовки столбца с промокодами в CSV/XLSX (без учета регистра)
+CODE_COLUMN_NAMES = ('code', 'promocode', 'promo', 'промокод', 'код')
+# Кодировки текстовых файлов в порядке проверки
+TEXT_ENCODINGS = ('utf-8', 'cp1251')
+# Размер блока при потоковом декодировании
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def get_available_count(category: PromoCodeCategory) -> int:
+    """Остаток промокодов категории из кэша (пересчитывается, если кэш пуст)"""
+    if category.available_count is not None and category.available_count < 0:
+        return category.refresh_available_count()
+    return category.promocodes_count()
+
+
+def adjust_available_count(category_id, delta: int) -> None:
+    """
+    Сдвигает кэшированный остаток категории на delta одним UPDATE.
+    Пустой кэш не трогаем: он пересчитается при следующем чтении.
+    """
+    if not category_id or not delta:
+        return
+    categories = PromoCodeCategory.objects.filter(id=category_id, available_count__isnull=False)
+    categories.update(available_count=F('available_count') + delta)
+    if delta > 0:
+        # Склад пополнен выше порога - следующее снижение снова вызовет уведомление
+        categories.filter(
+            available_count__gt=F('low_stock_threshold'), shortage_notified_at__isnull=False
+        ).update(shortage_notified_at=None)
+
+
+def invalidate_available_counts(category_ids) -> None:
+    """Сбрасывает кэш остатка (после правок, которые дешевле пересчитать)"""
+    category_ids = [c for c in category_ids if c]
+    if category_ids:
+        PromoCodeCategory.objects.filter(id__in=category_ids).update(available_count=None)
+
+
+def refresh_available_counts(category_ids=None) -> int:
+    """Пересчитывает остаток сразу для многих категорий одним GROUP BY"""
+    categories = PromoCodeCategory.objects.all()
+    if category_ids is not None:
+        categories = categories.filter(id__in=category_ids)
+    categories = list(categories.only('id', 'low_stock_threshold', 'shortage_notified_at'))
+    counts = dict(
+        PromoCode.objects.filter(category__in=categories, is_active=True, is_used=False)
+        .values('category_id').annotate(n=Count('id')).values_list('category_id', 'n')
+    )
+    for category in categories:
+        category.available_count = counts.get(category.id, 0)
+        if category.available_count > category.low_stock_threshold:
+            category.shortage_notified_at = None
+    PromoCodeCategory.objects.bulk_update(categories, ['available_count', 'shortage_notified_at'])
+    return len(categories)
+
+
+def mark_shortage_alert(category: PromoCodeCategory, remaining: int) -> bool:
+    """
+    True, если по остатку remaining нужно уведомить админа. Уведомление одно
+    на каждое снижение ниже порога: отметку ставит условный UPDATE, поэтому
+    параллельные выдачи не отправят его повторно.
+    """
+    if remaining is None or remaining > category.low_stock_threshold:
+        return False
+    return bool(PromoCodeCategory.objects.filter(
+        id=category.id, shortage_notified_at__isnull=True
+    ).update(shortage_notified_at=timezone.now()))
+
+
+def _take_locked(queryset) -> Optional[PromoCode]:
+    """
+    MySQL 8 / PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED. Параллельные
+    выдачи не ждут друг друга, а берут следующие свободные строки.
+    """
+    promo = queryset.select_for_update(skip_locked=True).order_by('id').first()
+    if promo is not None:
+        PromoCode.objects.filter(id=promo.id).update(is_used=True)
+    return promo
+
+
+def _take_optimistic(queryset) -> Optional[PromoCode]:
+    """
+    Без SKIP LOCKED (SQLite): условный UPDATE ... WHERE is_used = False.
+    Если строку успел забрать другой запрос, пробуем следующую.
+    """
+    for _ in range(OPTIMISTIC_ATTEMPTS):
+        promo = queryset.order_by('id').first()
+        if promo is None:
+            return None
+        if PromoCode.objects.filter(id=promo.id, is_used=False).update(is_used=True):
+            return promo
+    return None
+
+
+def claim_promocode_for(user: User, category: PromoCodeCategory) -> Tuple[Optional[str], bool, Optional[int]]:
+    """
+    Атомарно выдает пользователю один промокод категории.
+
+    Возвращает (код, выдан_сейчас, остаток). Если пользователь уже получал
+    промокод этой категории - (его код, False, None). Если промокоды
+    закончились - (None, False, 0).
+    """
+    existing = PromoCodeClaim.objects.filter(user=user, category=category).select_related('promocode').first()
+    if existing is not None:
+        return existing.promocode.code, False, None
+
+    queryset = PromoCode.objects.filter(category=category, is_active=True, is_used=False)
+    try:
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                promo = _take_locked(queryset)
+            else:
+                promo = _take_optimistic(queryset)
+            if promo is None:
+                PromoCodeCategory.objects.filter(id=category.id).update(available_count=0)
+                return None, False, 0
+            PromoCodeClaim.objects.create(promocode=promo, user=user, category=category)
+            PromoCodeCategory.objects.filter(id=category.id, available_count__gt=0).update(
+                available_count=F('available_count') - 1
+            )
+    except IntegrityError:
+        # Двойное нажатие: тот же пользователь параллельно уже получил промокод этой категории
+        existing = PromoCodeClaim.objects.filter(user=user, category=category).select_related('promocode').first()
+        if existing is None:
+            raise
+        return existing.promocode.code, False, None
+
+    category.refresh_from_db(fields=['available_count'])
+    remaining = get_available_count(category)
+    logger.info(f"[LOG] Промокод {promo.code} выдан пользователю {user.telegram_id}, осталось в '{category.name}': {remaining}")
+    return promo.code, True, remaining
+
+
+class ImportResult(NamedTuple):
+    created: int
+    skipped: int
+    seconds: float
+
+    @property
+    def rate(self) -> float:
+        """Обработано строк в секунду"""
+        return (self.created + self.skipped) / self.seconds if self.seconds else 0.0
+
+
+def _detect_encoding(data: bytes) -> str:
+    if data.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    for encoding in TEXT_ENCODINGS:
+        # Проверяем весь файл блоками: в начале может быть только латиница
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            for start in range(0, len(data), READ_CHUNK_SIZE):
+                decoder.decode(data[start:start + READ_CHUNK_SIZE])
+            decoder.decode(b'', final=True)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'iso-8859-1'
+
+
+def _text_stream(data: bytes) -> io.TextIOWrapper:
+    """
+    Поток строк из байтов файла: декодирование идет блоками по мере чтения,
+    а не копией всего файла в str. Битые байты заменяются на U+FFFD, такие
+    строки отбрасываются как некорректные промокоды.
+    """
+    return io.TextIOWrapper(
+        io.BufferedReader(io.BytesIO(data), buffer_size=READ_CHUNK_SIZE),
+        encoding=_detect_encoding(data), errors='replace', newline=''
+    )
+
+
+def _is_code_header(value) -> bool:
+    return str(value or '').strip().lower() in CODE_COLUMN_NAMES
+
+
+def iter_text_codes(data: bytes) -> Iterator[str]:
+    """Текстовый файл: один промокод в строке"""
+    for line in _text_stream(data):
+        yield line
+
+
+def iter_csv_codes(data: bytes) -> Iterator[str]:
+    """
+    CSV: промокоды из столбца code/promocode/промокод. Без такого заголовка
+    берется первый столбец, и первая строка считается данными.
+    """
+    stream = _text_stream(data)
+    sample = stream.read(READ_CHUNK_SIZE)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    stream.seek(0)
+    rows = csv.reader(stream, dialect)
+    header = next(rows, None)
+    if header is None:
+        return
+    column = next((i for i, value in enumerate(header) if _is_code_header(value)), None)
+    if column is None:
+        column = 0
+        if header:
+            yield header[0]
+    for row in rows:
+        if len(row) > column:
+            yield row[column]
+
+
+def iter_xlsx_codes(data: bytes) -> Iterator[str]:
+    """XLSX: первый лист, столбец с промокодами определяется так же, как в CSV"""
+    # read_only: строки читаются из архива по одной, без загрузки листа целиком
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        column = next((i for i, value in enumerate(header) if _is_code_header(value)), None)
+        if column is None:
+            column = 0
+            if header and header[0] is not None:
+                yield str(header[0])
+        for row in rows:
+            if len(row) > column and row[column] is not None:
+                value = row[column]
+                # Числовые промокоды Excel отдает как float: 12345.0
+                if isinstance(value, float) and value.is_integer():
+                    value = int(value)
+                yield str(value)
+    finally:
+        workbook.close()
+
+
+def iter_file_codes(file_name: str, data: bytes) -> Iterator[str]:
+    """Выбирает разборщик по расширению файла (.xlsx, .csv, иначе - текст)"""
+    name = (file_name or '').lower()
+    if name.endswith(('.xlsx', '.xlsm')) or (not name.endswith(('.csv', '.txt')) and zipfile.is_zipfile(io.BytesIO(data))):
+        return iter_xlsx_codes(data)
+    if name.endswith('.csv'):
+        return iter_csv_codes(data)
+    return iter_text_codes(data)
+
+
+def _insert_batch(batch: list, category_id, created_by) -> int:
+    """
+    Отсеивает уже существующие промокоды одним запросом, вставляет остальные
+    и возвращает число действительно вставленных строк.
+    """
+    existing = set(PromoCode.objects.filter(code__in=batch).values_list('code', flat=True))
+    new_codes = [code for code in batch if code not in existing]
+    if not new_codes:
+        return 0
+    # ignore_conflicts: промокод, добавленный параллельно другим импортом, не роняет пакет,
+    # но и не сообщает, какие строки пропущены - пересчитываем вставленные
+    PromoCode.objects.bulk_create(
+        [PromoCode(code=code, category_id=category_id, created_by=created_by) for code in new_codes],
+        ignore_conflicts=True,
+    )
+    return PromoCode.objects.filter(code__in=new_codes, category_id=category_id, created_by=created_by).count()
+
+
+def import_promocodes(codes: Iterable[str], category_id=None, created_by=None,
+                      batch_size: Optional[int] = None) -> ImportResult:
+    """
+    Массовый импорт промокодов. Дубликаты внутри файла отсеиваются в памяти,
+    уже существующие в базе - одним SELECT на пакет из batch_size кодов,
+    новые вставляются через bulk_create. Пустые строки не учитываются,
+    слишком длинные и битые строки попадают в пропущенные.
+    """
+    batch_size = batch_size or settings.PROMO_IMPORT_BATCH_SIZE
+    started = time.monotonic()
+    seen = set()
+    batch = []
+    created = skipped = 0
+    for raw in codes:
+        code = str(raw).strip().upper()
+        if not code:
+            continue
+        if len(code) > CODE_MAX_LENGTH or '\ufffd' in code or code in seen:
+            skipped += 1
+            continue
+        seen.add(code)
+        batch.append(code)
+        if len(batch) >= batch_size:
+            inserted = _insert_batch(batch, category_id, created_by)
+            created += inserted
+            skipped += len(batch) - inserted
+            batch = []
+    if batch:
+        inserted = _insert_batch(batch, category_id, created_by)
+        created += inserted
+        skipped += len(batch) - inserted
+    if category_id and created:
+        # Пересчет, а не сдвиг: параллельные импорты и выдача не сбивают остаток
+        refresh_available_counts([category_id])
+    result = ImportResult(created, skipped, time.monotonic() - started)
+    print(f"[LOG] Импорт промокодов: создано {created}, пропущено {skipped}, {result.rate:.0f} строк/с")
+    logger.info(f"[LOG] Импорт промокодов: создано {created}, пропущено {skipped}, {result.rate:.0f} строк/с")
+    return result
+
+
+def import_result_text(result: ImportResult, title: str = "✅ Промокоды обработаны:") -> str:
+    """Текст отчета об импорте для админа"""
+    text = f"{title}\n"
+    text += f"• Создано: {result.created}\n"
+    if result.skipped:
+        text += f"• Пропущено (уже существуют, дубликаты или ошибка): {result.skipped}\n"
+    text += f"• Время: {result.seconds:.1f} с ({result.rate:.0f} строк/с)\n"
+    text += "\n💡 Инструкции можно добавить в админ-панели Django."
+    return text
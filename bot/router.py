@@ -0,0 +1,132 @@
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telebot.types import CallbackQuery
+
+from bot.callback_data import ACTIONS, CALLBACK_DATA_PREFIX, unpack
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackRouteError(Exception):
+    """Неоднозначная или некорректная регистрация маршрута callback_data"""
+
+
+class _TrieNode:
+    __slots__ = ("children", "routes")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        # Список (predicate, handler) в порядке регистрации
+        self.routes: List[Tuple[Optional[Callable[[str], bool]], Callable]] = []
+
+
+class CallbackRouter:
+    """
+    Таблица маршрутизации callback_data -> обработчик.
+
+    callback_data в формате кодека (bot/callback_data.py) разбирается один раз
+    и маршрутизируется по имени действия за O(1). Старые строки: точные
+    совпадения ищутся в словаре, префиксы - в префиксном дереве за
+    O(len(data)). Приоритет: точное совпадение, затем самый длинный подходящий
+    префикс; среди маршрутов с одинаковым префиксом - первый, чей предикат
+    вернул True. Неоднозначные регистрации отклоняются сразу при старте.
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Callable] = {}
+        self._actions: Dict[str, Callable] = {}
+        self._root = _TrieNode()
+        self._prefix_count = 0
+
+    def exact(self, data: str, handler: Callable) -> Callable:
+        """Регистрирует обработчик для точного значения callback_data"""
+        if not data:
+            raise CallbackRouteError("Пустое значение callback_data")
+        if data in self._exact:
+            raise CallbackRouteError(
+                f"callback_data '{data}' уже зарегистрирован для {self._exact[data].__name__}"
+            )
+        self._exact[data] = handler
+        return handler
+
+    def action(self, action: str, handler: Callable) -> Callable:
+        """Регистрирует обработчик для действия кодека callback_data"""
+        if action not in ACTIONS:
+            raise CallbackRouteError(f"Действие '{action}' не описано в bot.callback_data.ACTIONS")
+        if action in self._actions:
+            raise CallbackRouteError(
+                f"Действие '{action}' уже зарегистрировано для {self._actions[action].__name__}"
+            )
+        self._actions[action] = handler
+        return handler
+
+    def route(self, action: str, handler: Callable) -> Callable:
+        """Действие кодека + старый префикс '<action>_' для ранее отправленных кнопок"""
+        self.action(action, handler)
+        return self.prefix(f"{action}_", handler)
+
+    def prefix(self, prefix: str, handler: Callable,
+               predicate: Optional[Callable[[str], bool]] = None) -> Callable:
+        """
+        Регистрирует обработчик для всех callback_data, начинающихся с prefix.
+        predicate(data) позволяет уточнить маршрут; маршрут без предиката на
+        этом префиксе может быть только один и должен регистрироваться последним.
+        """
+        if not prefix:
+            raise CallbackRouteError("Пустой префикс callback_data")
+        node = self._root
+        for ch in prefix:
+            node = node.children.setdefault(ch, _TrieNode())
+        for existing_predicate, existing_handler in node.routes:
+            if existing_predicate is None:
+                raise CallbackRouteError(
+                    f"Префикс '{prefix}' уже полностью занят {existing_handler.__name__}, "
+                    f"маршрут {handler.__name__} недостижим"
+                )
+        node.routes.append((predicate, handler))
+        self._prefix_count += 1
+        return handler
+
+    def resolve(self, data: str) -> Optional[Callable]:
+        """Возвращает обработчик для callback_data или None"""
+        if not data:
+            return None
+        if data.startswith(CALLBACK_DATA_PREFIX):
+            parsed = unpack(data)
+            return self._actions.get(parsed.action) if parsed is not None else None
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler
+
+        matched = []
+        node = self._root
+        for ch in data:
+            node = node.children.get(ch)
+            if node is None:
+                break
+            if node.routes:
+                matched.append(node.routes)
+
+        for routes in reversed(matched):
+            for predicate, handler in routes:
+                if predicate is None or predicate(data):
+                    return handler
+        return None
+
+    def dispatch(self, call: CallbackQuery) -> None:
+        """Единая точка входа для всех callback-запросов"""
+        handler = self.resolve(call.data)
+        if handler is None:
+            logger.warning(f"[WARNING] Нет обработчика для callback_data: {call.data}")
+            return
+        handler(call)
+
+    def summary(self) -> str:
+        return (
+            f"действий кодека: {len(self._actions)}, точных маршрутов: {len(self._exact)}, "
+            f"префиксных: {self._prefix_count}"
+        )
+
+
+callback_router = CallbackRouter()
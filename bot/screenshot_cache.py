@@ -0,0 +1,186 @@
+import io
+import logging
+import random
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from PIL import Image
+
+from bot.models import ScreenshotFingerprint, ScreenshotHashBand
+
+logger = logging.getLogger(__name__)
+
+# dHash 16x16 = 256 бит, 16 полос по 16 бит. Если расстояние Хэмминга не больше
+# 15, хотя бы одна полоса у двух хэшей совпадает целиком (если она не вырожденная)
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+BANDS = 16
+BAND_BITS = HASH_BITS // BANDS
+MAX_DISTANCE_LIMIT = BANDS - 1
+# Биты полосы разбросаны по всему хэшу (фиксированная перестановка): полоса из
+# одной строки хэша у скриншотов с однотонным фоном почти всегда нулевая
+_BAND_POSITIONS = list(range(HASH_BITS))
+random.Random(HASH_BITS).shuffle(_BAND_POSITIONS)
+BAND_POSITIONS = [sorted(_BAND_POSITIONS[i * BAND_BITS:(i + 1) * BAND_BITS]) for i in range(BANDS)]
+# Полосы из одних нулей или единиц есть почти у всех скриншотов - по ним не ищем
+DEGENERATE_BANDS = (0, (1 << BAND_BITS) - 1)
+# Сколько отпечатков с наибольшим числом совпавших полос сравнивать
+MAX_CANDIDATES = 200
+
+
+class ScreenshotLookup(NamedTuple):
+    user_id: str
+    image_hash: Optional[str]
+    # Ранее проверенный такой же скриншот
+    match: Optional[ScreenshotFingerprint]
+    # Расстояние Хэмминга до match (0 - тот же файл)
+    distance: Optional[int]
+    # Вердикт, который можно взять без запроса к модели
+    verdict: Optional[dict]
+
+    @property
+    def foreign(self) -> bool:
+        """Похожий скриншот уже присылал другой пользователь"""
+        return self.match is not None and self.match.user_id != self.user_id
+
+    @property
+    def reused(self) -> bool:
+        """
+        Чужой скриншот почти без изменений (не дальше SCREENSHOT_REUSE_MAX_DISTANCE) -
+        отказ. Просто похожий чужой скриншот (одинаковая верстка отзывов)
+        проверяется как обычно и только отмечается для админа.
+        """
+        return self.foreign and self.distance <= settings.SCREENSHOT_REUSE_MAX_DISTANCE
+
+
+def image_dhash(data: bytes) -> str:
+    """
+    Разностный хэш: изображение в оттенках серого уменьшается до 17x16, и
+    каждый бит - ярче ли пиксель соседа справа. Пересжатие и изменение
+    размера почти не меняют хэш. Возвращает 64 hex-символа.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))  # JPEG декодируется сразу уменьшенным
+        pixels = list(image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:0{HASH_BITS // 4}x}"
+
+
+def hamming_distance(first: str, second: str) -> int:
+    return (int(first, 16) ^ int(second, 16)).bit_count()
+
+
+def band_keys(image_hash: str) -> list:
+    """Ключи полос хэша для индекса, без вырожденных полос"""
+    value = int(image_hash, 16)
+    keys = []
+    for index, positions in enumerate(BAND_POSITIONS):
+        band = 0
+        for position in positions:
+            band = (band << 1) | ((value >> position) & 1)
+        if band not in DEGENERATE_BANDS:
+            keys.append(f"s{index:x}:{band:04x}")
+    return keys
+
+
+def find_similar(image_hash: str, file_unique_id: str = None, user_id=None, product_id=None) -> tuple:
+    """
+    Самый близкий из ранее проверенных скриншотов и расстояние до него: тот
+    же файл в Telegram (file_unique_id) или похожий по хэшу. Сравниваются
+    только MAX_CANDIDATES отпечатков с наибольшим числом совпавших полос. При
+    равном расстоянии выигрывает проверка того же пользователя и товара,
+    затем более ранняя.
+    """
+    max_distance = min(settings.SCREENSHOT_HASH_MAX_DISTANCE, MAX_DISTANCE_LIMIT)
+    candidate_ids = []
+    keys = band_keys(image_hash)
+    if keys:
+        candidate_ids = list(
+            ScreenshotHashBand.objects.filter(key__in=keys)
+            .values('fingerprint_id').annotate(matched=Count('id'))
+            .order_by('-matched', '-fingerprint_id')
+            .values_list('fingerprint_id', flat=True)[:MAX_CANDIDATES]
+        )
+    candidates = list(
+        ScreenshotFingerprint.objects.filter(id__in=candidate_ids).defer('verdict')
+    ) if candidate_ids else []
+    if file_unique_id:
+        # Записи об отклоненных повторах не участвуют: сравниваем с исходной проверкой
+        candidates += list(ScreenshotFingerprint.objects.filter(
+            file_unique_id=file_unique_id, duplicate_of__isnull=True
+        ).exclude(id__in=candidate_ids).defer('verdict'))
+    best, best_key = None, None
+    for candidate in candidates:
+        distance = 0 if candidate.file_unique_id == file_unique_id else hamming_distance(image_hash, candidate.image_hash)
+        if distance > max_distance:
+            continue
+        own = candidate.user_id == user_id and candidate.product_id == product_id
+        key = (distance, not own, candidate.created_at, candidate.id)
+        if best_key is None or key < best_key:
+            best, best_key = candidate, key
+    return best, best_key[0] if best_key else None
+
+
+def lookup_screenshot(photo, data: bytes, user_id, product_id) -> ScreenshotLookup:
+    """
+    Ищет скриншот среди проверенных. Вердикт берется из кэша только для того
+    же пользователя и товара, и только если это тот же файл или проверка была
+    пройдена: dHash почти не замечает смену 4 звезд на 5, поэтому похожий
+    скриншот после отказа проверяется заново. Ошибка чтения изображения не
+    мешает проверке - кэш просто не используется.
+    """
+    user_id = str(user_id)
+    try:
+        image_hash = image_dhash(data)
+    except Exception as e:
+        logger.warning(f"[WARNING] Не удалось посчитать хэш скриншота {photo.file_id}: {e}")
+        return ScreenshotLookup(user_id, None, None, None, None)
+
+    match, distance = find_similar(image_hash, photo.file_unique_id, user_id, product_id)
+    verdict = None
+    if match is not None and match.user_id == user_id and match.product_id == product_id and match.verdict:
+        if match.file_unique_id == photo.file_unique_id or match.verdict.get('has_5_stars'):
+            verdict = match.verdict
+    return ScreenshotLookup(user_id, image_hash, match, distance, verdict)
+
+
+def remember_screenshot(lookup: ScreenshotLookup, photo, product_id,
+                        verdict: Optional[dict] = None) -> Optional[ScreenshotFingerprint]:
+    """
+    Сохраняет отпечаток скриншота. verdict - ответ модели (None, если модель
+    не ответила: тогда скриншот проверится заново, но чужой повтор все равно
+    будет замечен). Похожий чужой скриншот сохраняется со ссылкой на исходную
+    проверку (duplicate_of); отклоненный повтор - еще и без полос хэша, чтобы
+    дальше сравнивать с исходной проверкой.
+    """
+    if lookup.image_hash is None:
+        return None
+    match = lookup.match
+    if (match is not None and not lookup.foreign and match.product_id == product_id
+            and match.file_unique_id == photo.file_unique_id):
+        # Повторная проверка того же файла: обновляем вердикт исходной записи
+        if verdict is not None:
+            ScreenshotFingerprint.objects.filter(id=match.id).update(verdict=verdict)
+            match.verdict = verdict
+        return match
+    with transaction.atomic():
+        fingerprint = ScreenshotFingerprint.objects.create(
+            image_hash=lookup.image_hash,
+            file_id=photo.file_id,
+            file_unique_id=photo.file_unique_id,
+            user_id=lookup.user_id,
+            product_id=product_id,
+            verdict=verdict,
+            duplicate_of=match if lookup.foreign else None,
+        )
+        if not lookup.reused:
+            ScreenshotHashBand.objects.bulk_create([
+                ScreenshotHashBand(fingerprint=fingerprint, key=key) for key in band_keys(lookup.image_hash)
+            ])
+    return fingerprint
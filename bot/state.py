@@ -0,0 +1,343 @@
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессные блокировки файлов недоступны
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+Mutator = Callable[[Optional[dict]], Optional[dict]]
+
+
+class MemoryStateBackend:
+    """Состояния в памяти процесса (прежнее поведение, не переживает перезапуск)"""
+
+    def __init__(self):
+        self._data: Dict[Tuple[str, int], Tuple[dict, Optional[float]]] = {}
+        self._lock = threading.RLock()
+
+    def _get_locked(self, namespace: str, chat_id: int) -> Optional[dict]:
+        item = self._data.get((namespace, chat_id))
+        if item is None:
+            return None
+        data, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[(namespace, chat_id)]
+            return None
+        return data
+
+    def get(self, namespace: str, chat_id: int) -> Optional[dict]:
+        with self._lock:
+            data = self._get_locked(namespace, chat_id)
+            return copy.deepcopy(data) if data is not None else None
+
+    def set(self, namespace: str, chat_id: int, data: dict, ttl: Optional[int]) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[(namespace, chat_id)] = (copy.deepcopy(data), expires_at)
+
+    def delete(self, namespace: str, chat_id: int) -> Optional[dict]:
+        with self._lock:
+            data = self._get_locked(namespace, chat_id)
+            self._data.pop((namespace, chat_id), None)
+            return data
+
+    def mutate(self, namespace: str, chat_id: int, func: Mutator, ttl: Optional[int]) -> Optional[dict]:
+        with self._lock:
+            current = self._get_locked(namespace, chat_id)
+            new = func(copy.deepcopy(current) if current is not None else None)
+            if new is None:
+                self._data.pop((namespace, chat_id), None)
+            else:
+                self.set(namespace, chat_id, new, ttl)
+            return copy.deepcopy(new)
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._data.items()
+                       if expires_at is not None and expires_at <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+
+class DatabaseStateBackend:
+    """Состояния в таблице ConversationState (SQLite локально, MySQL на проде)"""
+
+    @staticmethod
+    def _expires_at(ttl: Optional[int]):
+        return timezone.now() + timedelta(seconds=ttl) if ttl else None
+
+    @staticmethod
+    def _is_expired(row) -> bool:
+        return row.expires_at is not None and row.expires_at <= timezone.now()
+
+    def get(self, namespace: str, chat_id: int) -> Optional[dict]:
+        from bot.models import ConversationState
+        row = ConversationState.objects.filter(
+            namespace=namespace, chat_id=chat_id
+        ).only('data', 'expires_at').first()
+        if row is None or self._is_expired(row):
+            return None
+        return row.data
+
+    def set(self, namespace: str, chat_id: int, data: dict, ttl: Optional[int]) -> None:
+        from bot.models import ConversationState
+        ConversationState.objects.update_or_create(
+            namespace=namespace,
+            chat_id=chat_id,
+            defaults={'data': data, 'expires_at': self._expires_at(ttl)},
+        )
+
+    def delete(self, namespace: str, chat_id: int) -> Optional[dict]:
+        from bot.models import ConversationState
+        with transaction.atomic():
+            row = ConversationState.objects.select_for_update().filter(
+                namespace=namespace, chat_id=chat_id
+            ).first()
+            if row is None:
+                return None
+            row.delete()
+            return None if self._is_expired(row) else row.data
+
+    def mutate(self, namespace: str, chat_id: int, func: Mutator, ttl: Optional[int]) -> Optional[dict]:
+        from bot.models import ConversationState
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    # Блокировка строки делает чтение-изменение-запись атомарным между процессами
+                    row = ConversationState.objects.select_for_update().filter(
+                        namespace=namespace, chat_id=chat_id
+                    ).first()
+                    current = None if row is None or self._is_expired(row) else row.data
+                    new = func(current)
+                    if new is None:
+                        if row is not None:
+                            row.delete()
+                    elif row is not None:
+                        row.data = new
+                        row.expires_at = self._expires_at(ttl)
+                        row.save(update_fields=['data', 'expires_at', 'updated_at'])
+                    else:
+                        ConversationState.objects.create(
+                            namespace=namespace,
+                            chat_id=chat_id,
+                            data=new,
+                            expires_at=self._expires_at(ttl),
+                        )
+                    return new
+            except IntegrityError:
+                # Строку одновременно создал другой процесс - повторяем уже с блокировкой
+                if attempt:
+                    raise
+        return None
+
+    def purge_expired(self) -> int:
+        from bot.models import ConversationState
+        deleted, _ = ConversationState.objects.filter(expires_at__lte=timezone.now()).delete()
+        return deleted
+
+
+class FileStateBackend:
+    """
+    Состояния в JSON-файлах: <STATE_FILE_DIR>/<namespace>/<chat_id>.json.
+    Запись атомарная (os.replace), межпроцессная блокировка - fcntl.flock.
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._lock = threading.RLock()
+
+    def _path(self, namespace: str, chat_id: int) -> str:
+        directory = os.path.join(self.base_dir, namespace)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{chat_id}.json")
+
+    class _FileLock:
+        def __init__(self, backend: "FileStateBackend", path: str):
+            self.backend = backend
+            self.lock_path = path + ".lock"
+            self.handle = None
+
+        def __enter__(self):
+            self.backend._lock.acquire()
+            if fcntl is not None:
+                self.handle = open(self.lock_path, 'a')
+                fcntl.flock(self.handle, fcntl.LOCK_EX)
+            return self
+
+        def __exit__(self, *exc):
+            if self.handle is not None:
+                fcntl.flock(self.handle, fcntl.LOCK_UN)
+                self.handle.close()
+            self.backend._lock.release()
+
+    @staticmethod
+    def _read(path: str) -> Optional[dict]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            logger.error(f"[ERROR] Повреждено состояние {path}: {e}")
+            return None
+        expires_at = payload.get('expires_at')
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return payload.get('data')
+
+    @staticmethod
+    def _write(path: str, data: Optional[dict], ttl: Optional[int]) -> None:
+        if data is None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return
+        payload = {'data': data, 'expires_at': time.time() + ttl if ttl else None}
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get(self, namespace: str, chat_id: int) -> Optional[dict]:
+        return self._read(self._path(namespace, chat_id))
+
+    def set(self, namespace: str, chat_id: int, data: dict, ttl: Optional[int]) -> None:
+        path = self._path(namespace, chat_id)
+        with self._FileLock(self, path):
+            self._write(path, data, ttl)
+
+    def delete(self, namespace: str, chat_id: int) -> Optional[dict]:
+        path = self._path(namespace, chat_id)
+        with self._FileLock(self, path):
+            data = self._read(path)
+            self._write(path, None, None)
+            return data
+
+    def mutate(self, namespace: str, chat_id: int, func: Mutator, ttl: Optional[int]) -> Optional[dict]:
+        path = self._path(namespace, chat_id)
+        with self._FileLock(self, path):
+            new = func(self._read(path))
+            self._write(path, new, ttl)
+            return new
+
+    def purge_expired(self) -> int:
+        removed = 0
+        if not os.path.isdir(self.base_dir):
+            return 0
+        now = time.time()
+        for namespace in os.listdir(self.base_dir):
+            directory = os.path.join(self.base_dir, namespace)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        expires_at = json.load(f).get('expires_at')
+                    if expires_at is not None and expires_at <= now:
+                        os.remove(path)
+                        removed += 1
+                except (ValueError, OSError):
+                    continue
+        return removed
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_state_backend():
+    """Бэкенд по настройке STATE_BACKEND: memory (по умолчанию), db или file"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(settings, 'STATE_BACKEND', 'memory')
+                if name == 'db':
+                    _backend = DatabaseStateBackend()
+                elif name == 'file':
+                    _backend = FileStateBackend(settings.STATE_FILE_DIR)
+                else:
+                    if name != 'memory':
+                        logger.warning(f"[WARNING] Неизвестный STATE_BACKEND '{name}', используется memory")
+                    _backend = MemoryStateBackend()
+    return _backend
+
+
+class StateStore:
+    """
+    Хранилище состояний диалога по chat_id с интерфейсом словаря.
+
+    Значения - JSON-совместимые dict. Возвращается копия: изменения
+    полученного словаря не сохраняются, для этого есть update()/mutate(),
+    которые атомарно читают и записывают состояние одного чата.
+    """
+
+    def __init__(self, namespace: str, ttl: Optional[int] = None):
+        self.namespace = namespace
+        self.ttl = settings.STATE_TTL if ttl is None else ttl
+
+    @property
+    def backend(self):
+        return get_state_backend()
+
+    def __contains__(self, chat_id) -> bool:
+        return self.backend.get(self.namespace, int(chat_id)) is not None
+
+    def __getitem__(self, chat_id) -> dict:
+        data = self.backend.get(self.namespace, int(chat_id))
+        if data is None:
+            raise KeyError(chat_id)
+        return data
+
+    def __setitem__(self, chat_id, data: dict) -> None:
+        self.backend.set(self.namespace, int(chat_id), data, self.ttl)
+
+    def __delitem__(self, chat_id) -> None:
+        # В отличие от dict, удаление отсутствующего состояния не ошибка:
+        # его мог уже удалить другой процесс или истечь TTL
+        self.backend.delete(self.namespace, int(chat_id))
+
+    def get(self, chat_id, default: Any = None) -> Any:
+        data = self.backend.get(self.namespace, int(chat_id))
+        return default if data is None else data
+
+    def pop(self, chat_id, default: Any = None) -> Any:
+        data = self.backend.delete(self.namespace, int(chat_id))
+        return default if data is None else data
+
+    def update(self, chat_id, **fields) -> dict:
+        """Атомарно дописывает поля в состояние чата (создает его при отсутствии)"""
+        def merge(current):
+            current = current or {}
+            current.update(fields)
+            return current
+        return self.backend.mutate(self.namespace, int(chat_id), merge, self.ttl)
+
+    def mutate(self, chat_id, func: Mutator) -> Optional[dict]:
+        """Атомарно заменяет состояние на func(текущее); None удаляет состояние"""
+        return self.backend.mutate(self.namespace, int(chat_id), func, self.ttl)
+
+
+def purge_expired_states() -> str:
+    """Удаляет состояния с истекшим TTL (для cron)"""
+    removed = get_state_backend().purge_expired()
+    return f"Удалено просроченных состояний: {removed}"
@@ -43,6 +43,12 @@ SCREENSHOT_INVALID = "❌ Скриншот не прошел проверку. 
 
 SCREENSHOT_LIMIT_REACHED = "⚠️ Вы достигли дневного лимита отправки скриншотов (3 скриншота в день). Пожалуйста, попробуйте снова завтра."
 
+SCREENSHOT_ALREADY_CHECKING = "⏳ Ваш предыдущий скриншот еще проверяется. Дождитесь результата, пожалуйста."
+
+SCREENSHOT_BUSY = "😔 Сейчас проверяется очень много скриншотов. Пожалуйста, отправьте скриншот еще раз через пару минут."
+
+SCREENSHOT_REUSED = "❌ Этот скриншот уже присылал другой пользователь. Пожалуйста, отправьте скриншот своего отзыва. Если это ваш отзыв, напишите в поддержку."
+
 # Условия гарантии
 WARRANTY_CONDITIONS_TEXT = """🛡️ Условия гарантии
 
@@ -12,4 +12,6 @@ urlpatterns = [
     path('', views.set_webhook, name="set_webhook"),
     path("status/", views.status, name="status"),
     path("cron/reset-screenshot-counters/", views.run_reset_screenshot_counters, name="reset_screenshot_counters"),
+    path("cron/resume-broadcasts/", views.run_resume_broadcasts, name="resume_broadcasts"),
+    path("cron/clean-expired-states/", views.run_clean_expired_states, name="clean_expired_states"),
 ]
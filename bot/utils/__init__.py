@@ -1,3 +1,4 @@
 from .excel_handler import WarrantyExcelHandler
+from .queryset import keyset_chunks, keyset_iterator
 
-__all__ = ['WarrantyExcelHandler'] 
\ No newline at end of file
+__all__ = ['WarrantyExcelHandler', 'keyset_chunks', 'keyset_iterator'] 
\ No newline at end of file
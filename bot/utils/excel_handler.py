@@ -1,70 +1,98 @@
 import os
-from datetime import datetime
-from django.utils import timezone
+import hashlib
+import tempfile
 import logging
-import pandas as pd  # Добавляем импорт pandas
+from django.utils import timezone
+from openpyxl import Workbook
+
+from bot.models import ExtendedWarranty
+from bot.utils.queryset import keyset_iterator
 
 logger = logging.getLogger(__name__)
 
+
 class WarrantyExcelHandler:
-    def __init__(self):
-        self.file_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'warranty_records.xlsx')
-        self._ensure_file_exists()
+    """
+    Выгрузка активированных гарантий в Excel.
 
-    def _ensure_file_exists(self):
-        """Создает файл Excel, если он не существует"""
-        try:
-            if not os.path.exists(self.file_path):
-                df = pd.DataFrame(columns=[
-                    'Дата активации',
-                    'ID пользователя',
-                    'Имя пользователя',
-                    'ID товара',
-                    'Название товара',
-                    'Срок гарантии',
-                    'Дата окончания',
-                    'Дата отзыва',
-                    'ID скриншота',
-                    'Дата добавления'
-                ])
-                df.to_excel(self.file_path, index=False)
-                logger.info(f"Создан новый файл Excel: {self.file_path}")
-        except Exception as e:
-            logger.error(f"Ошибка при создании файла Excel: {e}")
-            raise
+    Журнал активаций - таблица ExtendedWarranty: при активации пишется одна
+    строка (INSERT), а xlsx собирается только по запросу админа. Поэтому
+    активация не зависит от размера истории и от параллельных записей в файл.
 
-    def add_warranty_record(self, user_data, product_data, warranty_info):
-        """Добавляет запись о новой гарантии в Excel файл"""
-        try:
-            # Проверяем наличие pandas
-            if 'pd' not in globals():
-                logger.error("Модуль pandas не импортирован")
-                return False
+    Фильтры: date_from/date_to - дата активации (включительно), product_id,
+    category_id - категория товара.
+    """
 
-            # Читаем существующий файл
-            df = pd.read_excel(self.file_path)
+    COLUMNS = [
+        'Дата активации',
+        'ID пользователя',
+        'Имя пользователя',
+        'ID товара',
+        'Название товара',
+        'Срок гарантии',
+        'Дата окончания',
+        'Дата отзыва',
+        'ID скриншота',
+        'Дата добавления',
+    ]
 
-            # Создаем новую запись
-            new_record = {
-                'Дата активации': warranty_info.get('activation_date'),
-                'ID пользователя': user_data.get('telegram_id'),
-                'Имя пользователя': user_data.get('user_name'),
-                'ID товара': product_data.get('id'),
-                'Название товара': product_data.get('name'),
-                'Срок гарантии': warranty_info.get('warranty_period'),
-                'Дата окончания': warranty_info.get('end_date'),
-                'Дата отзыва': warranty_info.get('review_date'),
-                'ID скриншота': warranty_info.get('screenshot_id'),
-                'Дата добавления': timezone.now().strftime("%d.%m.%Y %H:%M:%S")
-            }
+    def __init__(self, queryset=None, date_from=None, date_to=None, product_id=None, category_id=None):
+        queryset = queryset if queryset is not None else ExtendedWarranty.objects.all()
+        if date_from:
+            queryset = queryset.filter(created_at__date__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(created_at__date__lte=date_to)
+        if product_id:
+            queryset = queryset.filter(product_id=product_id)
+        if category_id:
+            queryset = queryset.filter(product__parent_category_id=category_id)
+        self.queryset = queryset
+        # Заполняются в export(): хэш строк выгрузки и их количество
+        self.content_hash = None
+        self.row_count = 0
 
-            # Добавляем запись в DataFrame
-            df = pd.concat([df, pd.DataFrame([new_record])], ignore_index=True)
+    def rows(self):
+        """Строки выгрузки в порядке активации, страницами по первичному ключу"""
+        records = self.queryset.select_related('user').only(
+            'created_at', 'product_id', 'name', 'warranty_period', 'end_date', 'purchase_date',
+            'screenshot_id', 'user__telegram_id', 'user__user_name',
+        )
+        for record in keyset_iterator(records):
+            created_at = timezone.localtime(record.created_at)
+            yield [
+                created_at.strftime("%d.%m.%Y"),
+                record.user.telegram_id,
+                record.user.user_name,
+                record.product_id,
+                record.name,
+                record.warranty_period,
+                record.end_date.strftime("%d.%m.%Y"),
+                record.purchase_date.strftime("%d.%m.%Y") if record.purchase_date else None,
+                record.screenshot_id,
+                created_at.strftime("%d.%m.%Y %H:%M:%S"),
+            ]
 
-            # Сохраняем обновленный файл
-            df.to_excel(self.file_path, index=False)
-            logger.info(f"Добавлена новая запись о гарантии в Excel для пользователя {user_data.get('user_name')}")
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении записи в Excel: {e}")
-            return False
+    def export(self) -> str:
+        """
+        Собирает xlsx во временный файл и возвращает путь к нему.
+        Файл удаляет вызывающий код после отправки. Заодно считает
+        content_hash по строкам: сам xlsx каждый раз разный (время в архиве),
+        а одинаковые данные должны давать одинаковый ключ кэша file_id.
+        """
+        # write_only: строки сразу уходят в файл, память не растет с историей
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Гарантии')
+        sheet.append(self.COLUMNS)
+        digest = hashlib.sha256()
+        count = 0
+        for row in self.rows():
+            sheet.append(row)
+            digest.update(repr(row).encode('utf-8'))
+            count += 1
+        fd, file_path = tempfile.mkstemp(prefix='warranty_records_', suffix='.xlsx')
+        os.close(fd)
+        workbook.save(file_path)
+        self.content_hash = digest.hexdigest()
+        self.row_count = count
+        logger.info(f"Собрана выгрузка гарантий: {count} записей")
+        return file_path
@@ -0,0 +1,50 @@
+from typing import Any, Iterator, List, Optional
+
+from django.db.models import QuerySet
+
+# Размер страницы по умолчанию для массовых задач
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def _row_key(row: Any, field: str) -> Any:
+    if isinstance(row, dict):
+        return row[field]
+    if isinstance(row, tuple):
+        # values_list(...): ключ должен идти первым полем
+        return row[0]
+    if hasattr(row, '_meta'):
+        return getattr(row, field)
+    # values_list(<ключ>, flat=True)
+    return row
+
+
+def keyset_chunks(queryset: QuerySet, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  start_after: Optional[Any] = None, key: str = 'pk') -> Iterator[List[Any]]:
+    """
+    Отдает queryset страницами по chunk_size строк, упорядоченными по key
+    (по умолчанию первичный ключ). Каждая страница - отдельный запрос
+    WHERE key > <последний ключ> ORDER BY key LIMIT n, поэтому память не растет
+    с размером таблицы, а OFFSET не замедляет дальние страницы.
+
+    Подходят модели (в т.ч. с .only()), values() и values_list(), у которых
+    ключ - первое поле. start_after - контрольная точка для продолжения.
+    """
+    field = queryset.model._meta.pk.name if key == 'pk' else key
+    queryset = queryset.order_by(field)
+    last = start_after
+    while True:
+        page_qs = queryset if last is None else queryset.filter(**{f"{field}__gt": last})
+        page = list(page_qs[:chunk_size])
+        if not page:
+            return
+        yield page
+        if len(page) < chunk_size:
+            return
+        last = _row_key(page[-1], field)
+
+
+def keyset_iterator(queryset: QuerySet, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    start_after: Optional[Any] = None, key: str = 'pk') -> Iterator[Any]:
+    """То же, что keyset_chunks, но построчно"""
+    for page in keyset_chunks(queryset, chunk_size, start_after, key):
+        yield from page
@@ -1,5 +1,3 @@
-from traceback import format_exc
-
 from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.http import HttpRequest, JsonResponse
@@ -9,7 +7,12 @@ from telebot.apihelper import ApiTelegramException
 from telebot.types import Update, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
 from bot import bot, logger
-from bot.cron import reset_screenshot_counters
+from bot.cron import clean_expired_states, reset_screenshot_counters, resume_interrupted_broadcasts
+from bot.router import callback_router
+from bot.workers import process_update, webhook_pool
+from bot.outbound import outbound
+from bot.vision_queue import vision_queue
+from bot.apis.image_prep import prep_stats
 from bot.utils.excel_handler import WarrantyExcelHandler
 
 # Импортируем все обработчики из handlers/__init__.py
@@ -20,6 +23,7 @@ from bot.handlers import (
     handle_first_user_message,
     cancel_warranty_activation, show_my_warranties, check_screenshot,
     confirm_review, cancel_review, send_excel_to_admin, admin_command,
+    excel_export_choose_category, excel_export_choose_product, excel_export_run,
     show_warranty_cases, handle_warranty_case, send_instruction_pdf,
     send_product_instruction_pdf,
     request_contact_for_warranty, process_warranty_case_contact,
@@ -97,7 +101,13 @@ def set_webhook(request: HttpRequest) -> JsonResponse:
 
 @require_GET
 def status(request: HttpRequest) -> JsonResponse:
-    return JsonResponse({"message": "OK"}, status=200)
+    return JsonResponse({
+        "message": "OK",
+        "lanes": webhook_pool.queue_depths(),
+        "outbound": outbound.pending(),
+        "vision": vision_queue.pending(),
+        "vision_images": prep_stats.snapshot(),
+    }, status=200)
 
 
 @require_GET
@@ -119,6 +129,42 @@ def run_reset_screenshot_counters(request: HttpRequest) -> JsonResponse:
         return JsonResponse({"message": "Error", "error": str(e)}, status=500)
 
 
+@require_GET
+def run_resume_broadcasts(request: HttpRequest) -> JsonResponse:
+    """
+    Продолжает прерванные рассылки в этом процессе
+    Эндпоинт может вызываться внешним cron-сервисом (например, раз в 5 минут)
+    """
+    secret_key = request.GET.get('key', '')
+    if secret_key != settings.CRON_SECRET_KEY:
+        return JsonResponse({"message": "Unauthorized"}, status=403)
+
+    try:
+        result = resume_interrupted_broadcasts()
+        return JsonResponse({"message": "OK", "result": result}, status=200)
+    except Exception as e:
+        logger.error(f"Error running resume_interrupted_broadcasts: {e}")
+        return JsonResponse({"message": "Error", "error": str(e)}, status=500)
+
+
+@require_GET
+def run_clean_expired_states(request: HttpRequest) -> JsonResponse:
+    """
+    Удаляет просроченные состояния диалогов
+    Эндпоинт может вызываться внешним cron-сервисом (например, раз в час)
+    """
+    secret_key = request.GET.get('key', '')
+    if secret_key != settings.CRON_SECRET_KEY:
+        return JsonResponse({"message": "Unauthorized"}, status=403)
+
+    try:
+        result = clean_expired_states()
+        return JsonResponse({"message": "OK", "result": result}, status=200)
+    except Exception as e:
+        logger.error(f"Error running clean_expired_states: {e}")
+        return JsonResponse({"message": "Error", "error": str(e)}, status=500)
+
+
 @csrf_exempt
 @require_POST
 @sync_to_async
@@ -128,24 +174,23 @@ def index(request: HttpRequest) -> JsonResponse:
 
     json_string = request.body.decode("utf-8")
     update = Update.de_json(json_string)
-    try:
-        bot.process_new_updates([update])
-    except ApiTelegramException as e:
-        logger.error(f"Telegram exception. {e} {format_exc()}")
-    except ConnectionError as e:
-        logger.error(f"Connection error. {e} {format_exc()}")
-    except Exception as e:
-        bot.send_message(settings.OWNER_ID, f'Error from index: {e}')
-        logger.error(f"Unhandled exception. {e} {format_exc()}")
+    # В асинхронном режиме сразу подтверждаем апдейт, обработка идет в пуле воркеров
+    if settings.WEBHOOK_ASYNC:
+        if webhook_pool.submit(update):
+            return JsonResponse({"message": "OK"}, status=200)
+        # Дорожка чата переполнена: не обрабатываем здесь (сломается порядок апдейтов
+        # чата), а просим Telegram повторить доставку позже
+        return JsonResponse({"message": "Busy"}, status=503)
+    process_update(update)
     return JsonResponse({"message": "OK"}, status=200)
 
 
 """Common"""
 
 start = bot.message_handler(commands=["start"])(start)
-menu_call = bot.callback_query_handler(lambda c: c.data == "menu")(menu_call)
-back_to_main_handler = bot.callback_query_handler(lambda c: c.data == "back_to_main")(back_to_main)
-my_warranties_handler = bot.callback_query_handler(lambda c: c.data == "my_warranties")(show_my_warranties)
+callback_router.exact("menu", menu_call)
+callback_router.exact("back_to_main", back_to_main)
+callback_router.exact("my_warranties", show_my_warranties)
 admin_command_handler = bot.message_handler(commands=['admin'])(admin_command)
 
 # Обработчик для контактов и номеров телефона в гарантийных случаях
@@ -193,140 +238,166 @@ promocode_document_handler = bot.message_handler(func=lambda m: (m.chat.id in pr
 # Общий обработчик сообщений (должен идти после специализированных обработчиков)
 text_handler = bot.message_handler(func=lambda message: True)(chat_with_ai)
 
+
+"""Callback-запросы
+
+Все callback_data маршрутизируются через callback_router (bot/router.py).
+route() регистрирует действие кодека bot/callback_data.py и старый префикс
+для уже отправленных кнопок; прочие строки: точное совпадение -> самый
+длинный префикс -> предикат. Порядок регистрации
+ниже на приоритет не влияет, конфликтующие маршруты отклоняются при старте.
+"""
+
+
+def _second_part_is_digit(data: str) -> bool:
+    """Формат <тип>_<id товара>: warranty_12, support_12"""
+    parts = data.split('_')
+    return len(parts) > 1 and parts[1].isdigit()
+
+
+def show_catalog(call: CallbackQuery) -> None:
+    show_categories(call.message.chat.id, call.message.message_id)
+
+
 # Обработчики для категорий и товаров
-catalog_handler = bot.callback_query_handler(lambda c: c.data == "catalog")(lambda c: show_categories(c.message.chat.id, c.message.message_id))
-category_handler = bot.callback_query_handler(lambda c: c.data.startswith("category_"))(show_category_products)
-product_handler = bot.callback_query_handler(lambda c: c.data.startswith("product_"))(show_product_menu)
-back_to_categories_handler = bot.callback_query_handler(lambda c: c.data == "back_to_categories")(back_to_categories)
+callback_router.exact("catalog", show_catalog)
+callback_router.route("category", show_category_products)
+callback_router.route("product", show_product_menu)
+callback_router.exact("back_to_categories", back_to_categories)
 
-# Новые обработчики для системы гарантийных обращений (ДОЛЖНЫ БЫТЬ ПЕРЕД warranty_info_handler!)
+# Новые обработчики для системы гарантийных обращений
 from bot.handlers.warranty import (
     warranty_start, warranty_select_category, warranty_select_product,
     warranty_select_issue, warranty_helped, warranty_not_helped, warranty_other,
     process_warranty_questionnaire_answer
 )
 
-warranty_start_handler = bot.callback_query_handler(lambda c: c.data == "warranty_start")(warranty_start)
-warranty_category_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_category_"))(warranty_select_category)
-warranty_product_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_product_"))(warranty_select_product)
-warranty_issue_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_issue_"))(warranty_select_issue)
-warranty_helped_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_helped_"))(warranty_helped)
-warranty_not_helped_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_not_helped_"))(warranty_not_helped)
-warranty_other_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_other_"))(warranty_other)
-warranty_qna_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_qna_"))(process_warranty_questionnaire_answer)
+callback_router.exact("warranty_start", warranty_start)
+callback_router.route("warranty_category", warranty_select_category)
+callback_router.route("warranty_product", warranty_select_product)
+callback_router.route("warranty_issue", warranty_select_issue)
+callback_router.route("warranty_helped", warranty_helped)
+callback_router.route("warranty_not_helped", warranty_not_helped)
+callback_router.route("warranty_other", warranty_other)
+callback_router.prefix("warranty_qna_", process_warranty_questionnaire_answer)
 
 # Обработчики для информации о товаре
-instructions_handler = bot.callback_query_handler(lambda c: c.data.startswith("instructions_"))(show_product_info)
-faq_handler = bot.callback_query_handler(lambda c: c.data.startswith("faq_"))(show_product_info)
-issues_handler = bot.callback_query_handler(lambda c: c.data.startswith("issues_"))(show_product_info)
-warranty_info_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_") and not c.data.startswith("warranty_main") and not c.data.startswith("warranty_conditions") and not c.data.startswith("warranty_activation") and not c.data.startswith("warranty_case") and c.data != "warranty_cases" and c.data != "warranty_start" and not c.data.startswith("warranty_category_") and not c.data.startswith("warranty_product_") and not c.data.startswith("warranty_issue_") and not c.data.startswith("warranty_helped_") and not c.data.startswith("warranty_not_helped_") and not c.data.startswith("warranty_other_"))(show_product_info)
-support_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_") and c.data.split('_')[1].isdigit())(show_product_info)
+callback_router.route("instructions", show_product_info)
+callback_router.route("faq", show_product_info)
+callback_router.route("issues", show_product_info)
+callback_router.prefix("warranty_", show_product_info, predicate=_second_part_is_digit)
+callback_router.prefix("support_", show_product_info, predicate=_second_part_is_digit)
 
 # Обработчики для расширенной гарантии
-activate_warranty_handler = bot.callback_query_handler(lambda c: c.data.startswith("activate_warranty_"))(activate_warranty)
-cancel_warranty_handler = bot.callback_query_handler(lambda c: c.data.startswith("cancel_warranty_"))(cancel_warranty_activation)
+callback_router.route("activate_warranty", activate_warranty)
+callback_router.route("cancel_warranty", cancel_warranty_activation)
 
 # Обработчики для подтверждения скриншотов отзывов
-confirm_review_handler = bot.callback_query_handler(lambda c: c.data.startswith("confirm_review_"))(confirm_review)
-cancel_review_handler = bot.callback_query_handler(lambda c: c.data.startswith("cancel_review_"))(cancel_review)
+callback_router.route("confirm_review", confirm_review)
+callback_router.route("cancel_review", cancel_review)
 
 # Обработчики для админ-панели
-admin_excel_handler = bot.callback_query_handler(lambda c: c.data == "admin_excel")(send_excel_to_admin)
+callback_router.exact("admin_excel", send_excel_to_admin)
+callback_router.action("excel_export", send_excel_to_admin)
+callback_router.action("excel_export_category", excel_export_choose_category)
+callback_router.action("excel_export_product", excel_export_choose_product)
+callback_router.action("excel_export_run", excel_export_run)
 
 # Обработчики для гарантийных случаев
-warranty_cases_handler = bot.callback_query_handler(lambda c: c.data == "warranty_cases")(show_warranty_cases)
-warranty_case_handler = bot.callback_query_handler(lambda c: c.data.startswith("atwarranty_case_"))(handle_warranty_case)
+callback_router.exact("warranty_cases", show_warranty_cases)
+callback_router.prefix("atwarranty_case_", handle_warranty_case)
 
 # Обработчики для запроса контакта в гарантийном случае
-request_contact_handler = bot.callback_query_handler(lambda c: c.data.startswith("request_contact_"))(request_contact_for_warranty)
+callback_router.prefix("request_contact_", request_contact_for_warranty)
 
 # Обработчики для PDF инструкций
-instruction_pdf_handler = bot.callback_query_handler(lambda c: c.data.startswith("instruction_pdf_"))(send_instruction_pdf)
-product_instruction_pdf_handler = bot.callback_query_handler(lambda c: c.data.startswith("product_instruction_pdf_"))(send_product_instruction_pdf)
+callback_router.prefix("instruction_pdf_", send_instruction_pdf)
+callback_router.prefix("product_instruction_pdf_", send_product_instruction_pdf)
 
 # Новые обработчики для меню гарантии
-warranty_main_menu_handler = bot.callback_query_handler(lambda c: c.data == "warranty_main_menu")(show_warranty_main_menu)
-warranty_conditions_handler = bot.callback_query_handler(lambda c: c.data == "warranty_conditions")(show_warranty_conditions)
-warranty_activation_menu_handler = bot.callback_query_handler(lambda c: c.data == "warranty_activation_menu")(show_warranty_activation_menu)
+callback_router.exact("warranty_main_menu", show_warranty_main_menu)
+callback_router.exact("warranty_conditions", show_warranty_conditions)
+callback_router.exact("warranty_activation_menu", show_warranty_activation_menu)
 
 # Обработчик для быстрой активации гарантии
-warranty_goods_fast_handler = bot.callback_query_handler(lambda c: c.data == "waranty_goods_fast")(waranty_goods_fast)
-warranty_activation_category_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_activation_category_"))(warranty_show_category_products)
+callback_router.exact("waranty_goods_fast", waranty_goods_fast)
+callback_router.prefix("warranty_activation_category_", warranty_show_category_products)
 
 # Обработчики для новой системы поддержки
-# support_main_handler = bot.callback_query_handler(lambda c: c.data == "help_main")(show_support_menu)  # Устарел, заменен на support_start
-support_ozon_handler = bot.callback_query_handler(lambda c: c.data == "support_ozon")(start_support_ozon)
-support_wildberries_handler = bot.callback_query_handler(lambda c: c.data == "support_wildberries")(start_support_wildberries)
+callback_router.exact("support_ozon", start_support_ozon)
+callback_router.exact("support_wildberries", start_support_wildberries)
 
 # Новые обработчики для системы поддержки (аналог гарантийных)
-support_start_handler = bot.callback_query_handler(lambda c: c.data == "support_start")(support_start)
-support_category_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_category_"))(support_select_category)
-support_product_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_product_"))(support_select_product)
-support_issue_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_issue_"))(support_select_issue)
-support_helped_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_helped_"))(support_helped)
-support_not_helped_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_not_helped_"))(support_not_helped)
-support_other_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_other_"))(support_other)
-support_qna_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_qna_"))(process_support_questionnaire_answer)
-close_ticket_handler = bot.callback_query_handler(lambda c: c.data == "close_ticket")(close_support_ticket)
-accept_ticket_handler = bot.callback_query_handler(lambda c: c.data.startswith("accept_ticket_"))(accept_support_ticket)
-finish_ticket_handler = bot.callback_query_handler(lambda c: c.data.startswith("finish_ticket_"))(finish_ticket_processing)
-view_ticket_handler = bot.callback_query_handler(lambda c: c.data.startswith("view_ticket_"))(view_ticket_details)
-takeover_ticket_handler = bot.callback_query_handler(lambda c: c.data.startswith("takeover_ticket_"))(takeover_support_ticket)
-get_ticket_files_handler = bot.callback_query_handler(lambda c: c.data.startswith("get_ticket_files_"))(send_ticket_files_to_admin)
-get_all_ticket_files_handler = bot.callback_query_handler(lambda c: c.data.startswith("get_all_ticket_files_"))(send_all_ticket_files_to_admin)
-already_assigned_handler = bot.callback_query_handler(lambda c: c.data == "already_assigned")(already_assigned_callback)
+callback_router.exact("support_start", support_start)
+callback_router.route("support_category", support_select_category)
+callback_router.route("support_product", support_select_product)
+callback_router.route("support_issue", support_select_issue)
+callback_router.route("support_helped", support_helped)
+callback_router.route("support_not_helped", support_not_helped)
+callback_router.route("support_other", support_other)
+callback_router.prefix("support_qna_", process_support_questionnaire_answer)
+callback_router.exact("close_ticket", close_support_ticket)
+callback_router.route("accept_ticket", accept_support_ticket)
+callback_router.route("finish_ticket", finish_ticket_processing)
+callback_router.route("view_ticket", view_ticket_details)
+callback_router.route("takeover_ticket", takeover_support_ticket)
+callback_router.route("get_ticket_files", send_ticket_files_to_admin)
+callback_router.route("get_all_ticket_files", send_all_ticket_files_to_admin)
+callback_router.exact("already_assigned", already_assigned_callback)
 
 # Пользовательские обращения
-support_my_tickets_handler = bot.callback_query_handler(lambda c: c.data == "support_my_tickets")(show_user_tickets)
-support_ticket_actions_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_ticket_"))(show_user_ticket_actions)
-support_user_close_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_close_"))(user_close_ticket)
-support_user_open_handler = bot.callback_query_handler(lambda c: c.data.startswith("support_open_"))(user_open_ticket)
+callback_router.exact("support_my_tickets", show_user_tickets)
+callback_router.route("support_ticket", show_user_ticket_actions)
+callback_router.route("support_close", user_close_ticket)
+callback_router.route("support_open", user_open_ticket)
 
 # Отказ админа от обращения после просмотра
-support_admin_decline_handler = bot.callback_query_handler(lambda c: c.data.startswith("decline_ticket_"))(decline_support_ticket)
+callback_router.route("decline_ticket", decline_support_ticket)
 
 # Админ: список свободных активных обращений
-admin_open_tickets_handler = bot.callback_query_handler(lambda c: c.data == "admin_open_tickets")(admin_list_open_tickets)
-admin_in_progress_tickets_handler = bot.callback_query_handler(lambda c: c.data == "admin_in_progress_tickets")(admin_list_in_progress_tickets)
-from bot.handlers.common import admin_panel as admin_panel_cb, show_product_info
-admin_panel_back_handler = bot.callback_query_handler(lambda c: c.data == "admin_panel")(admin_panel_cb)
-admin_my_tickets_handler = bot.callback_query_handler(lambda c: c.data == "admin_my_tickets")(admin_list_my_tickets)
+callback_router.exact("admin_open_tickets", admin_list_open_tickets)
+callback_router.exact("admin_in_progress_tickets", admin_list_in_progress_tickets)
+from bot.handlers.common import admin_panel as admin_panel_cb
+callback_router.exact("admin_panel", admin_panel_cb)
+callback_router.exact("admin_my_tickets", admin_list_my_tickets)
 
 # Админ: назад к списку его обращений
-admin_back_to_tickets_handler = bot.callback_query_handler(lambda c: c.data == "admin_back_to_tickets")(admin_back_to_tickets)
+callback_router.exact("admin_back_to_tickets", admin_back_to_tickets)
 
 # Админ: рассылка
-admin_broadcast_start_handler = bot.callback_query_handler(lambda c: c.data == "admin_broadcast")(admin_start_broadcast)
-broadcast_confirm_handler = bot.callback_query_handler(lambda c: c.data in ("broadcast_confirm", "broadcast_cancel"))(admin_broadcast_confirm)
+callback_router.exact("admin_broadcast", admin_start_broadcast)
+callback_router.exact("broadcast_confirm", admin_broadcast_confirm)
+callback_router.exact("broadcast_cancel", admin_broadcast_confirm)
 
 # Админ: промокоды
-promocode_menu_handler = bot.callback_query_handler(lambda c: c.data == "promocode_menu")(promocode_menu)
-promocode_add_handler = bot.callback_query_handler(lambda c: c.data == "promocode_add")(promocode_add)
-promocode_list_handler = bot.callback_query_handler(lambda c: c.data == "promocode_list")(promocode_list)
-promocode_detail_handler = bot.callback_query_handler(lambda c: c.data.startswith("promocode_detail_"))(promocode_detail)
-promocode_toggle_handler = bot.callback_query_handler(lambda c: c.data.startswith("promocode_toggle_"))(promocode_toggle)
-promocode_delete_handler = bot.callback_query_handler(lambda c: c.data.startswith("promocode_delete_"))(promocode_delete)
+callback_router.exact("promocode_menu", promocode_menu)
+callback_router.exact("promocode_add", promocode_add)
+callback_router.exact("promocode_list", promocode_list)
+callback_router.route("promocode_detail", promocode_detail)
+callback_router.route("promocode_toggle", promocode_toggle)
+callback_router.route("promocode_delete", promocode_delete)
 
 # Пользователь: получение промокода
-get_promocode_handler = bot.callback_query_handler(lambda c: c.data == "get_promocode")(get_user_promocode)
-promocode_select_category_handler = bot.callback_query_handler(lambda c: c.data.startswith("promocode_cat_text_"))(promocode_select_category)
-promocode_choose_actions_handler = bot.callback_query_handler(lambda c: c.data.startswith("promocode_cat_select_"))(promocode_choose_actions)
-user_select_category_handler = bot.callback_query_handler(lambda c: c.data.startswith("get_promocode_cat_"))(user_select_category)
-promocode_select_category_file_handler = bot.callback_query_handler(lambda c: c.data.startswith("promocode_cat_file_"))(promocode_select_category_file)
-promocode_back_to_category_handler = bot.callback_query_handler(lambda c: c.data.startswith("promocode_back_to_category_"))(promocode_back_to_category)
+callback_router.exact("get_promocode", get_user_promocode)
+callback_router.route("promocode_cat_text", promocode_select_category)
+callback_router.route("promocode_cat_select", promocode_choose_actions)
+callback_router.route("get_promocode_cat", user_select_category)
+callback_router.route("promocode_cat_file", promocode_select_category_file)
+callback_router.route("promocode_back_to_category", promocode_back_to_category)
 
 # Новые обработчики для пользовательских промокодов
 from bot.handlers.promocodes import claim_promocode, get_category_instruction
-claim_promocode_handler = bot.callback_query_handler(lambda c: c.data.startswith("claim_promocode_"))(claim_promocode)
-get_instruction_handler = bot.callback_query_handler(lambda c: c.data.startswith("get_instruction_"))(get_category_instruction)
+callback_router.route("claim_promocode", claim_promocode)
+callback_router.route("get_instruction", get_category_instruction)
 
 # Старые обработчики поддержки (для обратной совместимости)
-support_ozon_old_handler = bot.callback_query_handler(lambda c: c.data == "help_ozon")(support_ozon)
-support_wildberries_old_handler = bot.callback_query_handler(lambda c: c.data == "help_wildberries")(support_wildberries)
-
-
+callback_router.exact("help_ozon", support_ozon)
+callback_router.exact("help_wildberries", support_wildberries)
 
 # Обработчики для гарантийных случаев с выбором платформы
-warranty_case_ozon_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_case_ozon"))(warranty_case_ozon)
-warranty_case_wb_handler = bot.callback_query_handler(lambda c: c.data.startswith("warranty_case_wb"))(warranty_case_wildberries)
+callback_router.prefix("warranty_case_ozon", warranty_case_ozon)
+callback_router.prefix("warranty_case_wb", warranty_case_wildberries)
 
+# Единственный callback-хендлер telebot: дальше всё решает таблица маршрутов
+callback_query_handler = bot.callback_query_handler(func=lambda c: True)(callback_router.dispatch)
+logger.info(f"Маршрутизатор callback_data готов: {callback_router.summary()}")
@@ -0,0 +1,94 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from bot.context import update_context
+
+logger = logging.getLogger(__name__)
+
+# Результат reserve()
+RESERVED = 'reserved'
+DUPLICATE = 'duplicate'  # у пользователя уже проверяется скриншот
+BUSY = 'busy'            # очередь заполнена
+
+
+class VisionJobQueue:
+    """
+    Очередь проверок скриншотов (запросы к модели компьютерного зрения).
+
+    Хендлер сначала резервирует место для пользователя (reserve), отвечает
+    "проверяю..." и отдает работу пулу (start). Одновременно у пользователя
+    может быть только одна проверка, а всего в пуле - не больше max_pending
+    (выполняются + ждут), иначе пользователь получает вежливый отказ.
+    """
+
+    def __init__(self, workers: int, max_pending: int, name: str = "vision"):
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, bool] = {}  # chat_id -> запущена ли работа
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _ensure_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            logger.info(f"[LOG] Пул '{self.name}' запущен: потоков {self.workers}, очередь {self.max_pending}")
+        return self._executor
+
+    def reserve(self, chat_id) -> str:
+        chat_id = str(chat_id)
+        with self._lock:
+            if chat_id in self._in_flight:
+                return DUPLICATE
+            if len(self._in_flight) >= self.max_pending:
+                logger.warning(f"[WARNING] Очередь '{self.name}' заполнена ({len(self._in_flight)}), отказ {chat_id}")
+                return BUSY
+            self._in_flight[chat_id] = False
+            return RESERVED
+
+    def release(self, chat_id) -> None:
+        with self._lock:
+            self._in_flight.pop(str(chat_id), None)
+
+    def start(self, chat_id, func: Callable, *args) -> None:
+        """Запускает работу для зарезервированного пользователя"""
+        chat_id = str(chat_id)
+        with self._lock:
+            executor = self._ensure_executor()
+            self._in_flight[chat_id] = True
+        executor.submit(self._run, chat_id, func, args)
+
+    def pending(self) -> Dict[str, int]:
+        with self._lock:
+            running = sum(1 for started in self._in_flight.values() if started)
+            return {'in_flight': len(self._in_flight), 'started': running, 'limit': self.max_pending}
+
+    def stop(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _run(self, chat_id: str, func: Callable, args: tuple) -> None:
+        close_old_connections()
+        try:
+            # Тот же контекст, что у апдейта: get_user() и сохранение пользователя в конце
+            with update_context(chat_id):
+                func(*args)
+        except Exception as e:
+            print(f"[ERROR] Ошибка в задаче '{self.name}' для {chat_id}: {e}")
+            logger.error(f"[ERROR] Ошибка в задаче '{self.name}' для {chat_id}: {e}")
+        finally:
+            self.release(chat_id)
+            close_old_connections()
+
+
+vision_queue = VisionJobQueue(
+    workers=settings.VISION_WORKERS,
+    max_pending=settings.VISION_QUEUE_SIZE,
+)
@@ -0,0 +1,173 @@
+import logging
+import queue
+import threading
+from traceback import format_exc
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from telebot.apihelper import ApiTelegramException
+from telebot.types import Update
+
+from bot import bot
+from bot.context import update_context
+
+logger = logging.getLogger(__name__)
+
+
+def get_update_chat_id(update: Update) -> Optional[int]:
+    """Возвращает chat.id (или id пользователя), к которому относится апдейт"""
+    for attr in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = getattr(update, attr, None)
+        if message is not None:
+            return message.chat.id
+    callback_query = getattr(update, 'callback_query', None)
+    if callback_query is not None:
+        if callback_query.message is not None:
+            return callback_query.message.chat.id
+        return callback_query.from_user.id
+    for attr in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query'):
+        obj = getattr(update, attr, None)
+        if obj is not None:
+            return obj.from_user.id
+    return None
+
+
+def process_update(update: Update) -> None:
+    """Обрабатывает один апдейт с тем же логированием ошибок, что и вебхук"""
+    try:
+        # Пользователь чата загружается один раз и сохраняется в конце апдейта
+        with update_context(get_update_chat_id(update)):
+            bot.process_new_updates([update])
+    except ApiTelegramException as e:
+        logger.error(f"Telegram exception. {e} {format_exc()}")
+    except ConnectionError as e:
+        logger.error(f"Connection error. {e} {format_exc()}")
+    except Exception as e:
+        try:
+            bot.send_message(settings.OWNER_ID, f'Error from index: {e}')
+        except Exception:
+            pass
+        logger.error(f"Unhandled exception. {e} {format_exc()}")
+
+
+class UpdateWorkerPool:
+    """
+    Пул воркеров для апдейтов Telegram.
+
+    Апдейты раскладываются по "дорожкам" по chat.id: у каждой дорожки своя
+    очередь и свой поток, поэтому сообщения одного чата обрабатываются строго
+    по порядку, а разные чаты - параллельно.
+    """
+
+    def __init__(self, workers: int, queue_size: int, name: str = "updates"):
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.name = name
+        self._lanes: List[queue.Queue] = []
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                lane = queue.Queue(maxsize=self.queue_size)
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(lane,),
+                    name=f"{self.name}-lane-{index}",
+                    daemon=True,
+                )
+                self._lanes.append(lane)
+                self._threads.append(thread)
+                thread.start()
+        logger.info(f"[LOG] Пул '{self.name}' запущен: дорожек {self.workers}, очередь {self.queue_size}")
+
+    def _lane_for(self, update: Update) -> queue.Queue:
+        chat_id = get_update_chat_id(update)
+        if chat_id is None:
+            chat_id = update.update_id
+        return self._lanes[hash(chat_id) % self.workers]
+
+    def submit(self, update: Update, block: bool = False) -> bool:
+        """
+        Ставит апдейт в очередь его дорожки. Если очередь переполнена и
+        block=False, возвращает False. Обрабатывать такой апдейт в своем потоке
+        нельзя - ранние апдейты того же чата еще в дорожке, порядок нарушится;
+        вебхук отвечает ошибкой, и Telegram пришлет апдейт повторно.
+        block=True ждет свободного места (обратное давление для поллинга).
+        """
+        if self._stopping:
+            return False
+        if not self._threads:
+            self.start()
+        try:
+            self._lane_for(update).put(update, block=block)
+            return True
+        except queue.Full:
+            logger.warning(f"[WARNING] Очередь пула '{self.name}' переполнена, апдейт {update.update_id}")
+            return False
+
+    def queue_depths(self) -> List[int]:
+        """Текущее количество апдейтов в очереди каждой дорожки"""
+        return [lane.qsize() for lane in self._lanes]
+
+    def stop(self, drain: bool = True, timeout: Optional[float] = None) -> None:
+        """
+        Останавливает пул. drain=True - дорабатывает уже принятые апдейты,
+        drain=False - отбрасывает то, что еще не начали обрабатывать.
+        """
+        with self._lock:
+            if self._stopping or not self._threads:
+                return
+            self._stopping = True
+        dropped = 0
+        for lane in self._lanes:
+            if not drain:
+                while True:
+                    try:
+                        lane.get_nowait()
+                    except queue.Empty:
+                        break
+                    lane.task_done()
+                    dropped += 1
+            # Маркер остановки встает в конец очереди, после всех принятых апдейтов
+            lane.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        alive = sum(1 for thread in self._threads if thread.is_alive())
+        logger.info(
+            f"[LOG] Пул '{self.name}' остановлен: отброшено {dropped}, "
+            f"не завершились дорожек {alive}, остаток очередей {self.queue_depths()}"
+        )
+
+    def _worker(self, lane: queue.Queue) -> None:
+        while True:
+            update = lane.get()
+            if update is None:
+                lane.task_done()
+                break
+            # Потоки живут долго: не держим протухшие соединения с БД между апдейтами
+            close_old_connections()
+            try:
+                process_update(update)
+            finally:
+                close_old_connections()
+                lane.task_done()
+
+
+webhook_pool = UpdateWorkerPool(
+    workers=settings.WEBHOOK_WORKERS,
+    queue_size=settings.WEBHOOK_QUEUE_SIZE,
+    name="webhook",
+)
+
+
+polling_pool = UpdateWorkerPool(
+    workers=settings.POLLING_WORKERS,
+    queue_size=settings.POLLING_QUEUE_SIZE,
+    name="polling",
+)
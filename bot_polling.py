@@ -1,4 +1,6 @@
 import os
+import signal
+import time
 import django
 import dotenv
 
@@ -10,10 +12,75 @@ django.setup()
 dotenv.load_dotenv()
 
 # Импорт бота после настройки Django
-from bot import bot
+from bot import bot, logger
 from bot.handlers import *  # Импортируем обработчики
+from bot import views  # noqa: F401 - регистрирует хендлеры и маршруты callback_data
+from bot.workers import polling_pool
+from bot.outbound import outbound
+from bot.vision_queue import vision_queue
+from bot.broadcast import resume_broadcasts
+
+# Таймаут long polling у Telegram (секунды)
+POLLING_TIMEOUT = 25
+# Как часто писать в лог глубину очередей дорожек (секунды)
+LANES_LOG_INTERVAL = 60
+# Сколько ждать дорожки при остановке (секунды)
+DRAIN_TIMEOUT = 30
+
+stop_requested = False
+
+
+def request_stop(signum, frame):
+    global stop_requested
+    print(f"[LOG] Получен сигнал {signum}, останавливаем поллинг...")
+    stop_requested = True
+
+
+def run_polling():
+    """Long polling: апдейты раскладываются по дорожкам polling_pool по chat.id"""
+    offset = None
+    last_lanes_log = time.monotonic()
+    polling_pool.start()
+    while not stop_requested:
+        try:
+            updates = bot.get_updates(
+                offset=offset,
+                timeout=POLLING_TIMEOUT,
+                long_polling_timeout=POLLING_TIMEOUT,
+            )
+        except Exception as e:
+            logger.error(f"[ERROR] Ошибка получения апдейтов: {e}")
+            time.sleep(3)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            # Блокирующая постановка: при переполненной дорожке не читаем новые апдейты
+            polling_pool.submit(update, block=True)
+        if time.monotonic() - last_lanes_log >= LANES_LOG_INTERVAL:
+            logger.info(f"[LOG] Очереди дорожек поллинга: {polling_pool.queue_depths()}")
+            last_lanes_log = time.monotonic()
+
+    print(f"[LOG] Дорабатываем очереди: {polling_pool.queue_depths()}")
+    polling_pool.stop(drain=True, timeout=DRAIN_TIMEOUT)
+    # Дожидаемся начатых проверок скриншотов: их результат пользователь уже ждет
+    vision_queue.stop(wait=True)
+    # Досылаем то, что хендлеры успели поставить в очередь исходящих
+    outbound.stop(timeout=DRAIN_TIMEOUT)
+    # Подтверждаем Telegram последний принятый апдейт, чтобы он не пришел повторно
+    if offset is not None:
+        try:
+            bot.get_updates(offset=offset, timeout=0, long_polling_timeout=0)
+        except Exception as e:
+            logger.error(f"[ERROR] Не удалось подтвердить offset {offset}: {e}")
+
 
 if __name__ == '__main__':
     print("Удаление webhook для использования поллинга...")
     bot.remove_webhook()
-    print("Webhook удален. Бот готов к работе с webhook.") 
\ No newline at end of file
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    print(f"Webhook удален. Запуск поллинга, дорожек: {polling_pool.workers}")
+    # Рассылки, прерванные прошлым запуском, продолжаются с контрольной точки
+    print(f"[LOG] {resume_broadcasts()}")
+    run_polling()
+    print("Поллинг остановлен.")
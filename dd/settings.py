@@ -32,6 +32,79 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 OWNER_ID = os.getenv('OWNER_ID')
 HOOK = os.getenv('HOOK')
 
+# Асинхронный прием вебхуков: ответ Telegram сразу, обработка в пуле воркеров
+WEBHOOK_ASYNC = os.getenv('WEBHOOK_ASYNC', 'False') == 'True'
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 100))
+# Количество дорожек (потоков) при работе через поллинг (bot_polling.py)
+POLLING_WORKERS = int(os.getenv('POLLING_WORKERS', 4))
+# Сколько обновлений поллинга может ждать в очереди воркеров
+POLLING_QUEUE_SIZE = int(os.getenv('POLLING_QUEUE_SIZE', 100))
+
+# Очередь исходящих запросов к Telegram (bot/outbound.py): лимиты и повторы на 429
+OUTBOUND_QUEUE = os.getenv('OUTBOUND_QUEUE', 'True') == 'True'
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', 3))
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', 8))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 5))
+# Сколько хендлер ждет отправки своего сообщения (секунды)
+OUTBOUND_TIMEOUT = float(os.getenv('OUTBOUND_TIMEOUT', 120))
+
+# Рассылки (bot/broadcast.py): размер страницы получателей и когда считать рассылку прерванной
+BROADCAST_PAGE_SIZE = int(os.getenv('BROADCAST_PAGE_SIZE', 500))
+# Сколько ждать очередной доставки рассылки (секунды): дольше - очередь исходящих зависла
+BROADCAST_SEND_TIMEOUT = float(os.getenv('BROADCAST_SEND_TIMEOUT', 300))
+# Должно быть больше BROADCAST_SEND_TIMEOUT: иначе resume_broadcasts заберет рассылку,
+# пока исходный поток еще ждет отправок, и те же сообщения уйдут дважды
+BROADCAST_STALE_MINUTES = int(os.getenv('BROADCAST_STALE_MINUTES', int(BROADCAST_SEND_TIMEOUT // 60) + 2))
+
+# Импорт промокодов (bot/promo.py): сколько кодов проверять и вставлять за один запрос
+PROMO_IMPORT_BATCH_SIZE = int(os.getenv('PROMO_IMPORT_BATCH_SIZE', 1000))
+
+# Служебный чат (канал), куда загружаются вложения каталога для получения file_id (bot/file_cache.py)
+FILE_STORAGE_CHAT_ID = os.getenv('FILE_STORAGE_CHAT_ID')
+# Загрузок в служебный чат в минуту: Telegram пропускает в группу или канал около 20 сообщений в минуту
+FILE_STORAGE_UPLOADS_PER_MINUTE = int(os.getenv('FILE_STORAGE_UPLOADS_PER_MINUTE', 18))
+
+# Проверка скриншотов отзывов (bot/vision_queue.py): потоки и сколько проверок держать одновременно
+VISION_WORKERS = int(os.getenv('VISION_WORKERS', 4))
+VISION_QUEUE_SIZE = int(os.getenv('VISION_QUEUE_SIZE', 20))
+
+# Кэш проверенных скриншотов (bot/screenshot_cache.py): скриншоты с расстоянием
+# Хэмминга между dHash (256 бит) не больше этого считаются одним и тем же (максимум 15)
+SCREENSHOT_HASH_MAX_DISTANCE = int(os.getenv('SCREENSHOT_HASH_MAX_DISTANCE', 10))
+# Чужой скриншот отклоняется без проверки, только если отличается не больше чем на столько
+# бит. По умолчанию 0 - тот же файл или совпадающий хэш: разные отзывы с одинаковой версткой
+# бывают ближе, чем пересжатая копия одного скриншота. Остальные совпадения уходят админу
+SCREENSHOT_REUSE_MAX_DISTANCE = int(os.getenv('SCREENSHOT_REUSE_MAX_DISTANCE', 0))
+
+# Подготовка изображений перед отправкой в модель (bot/apis/image_prep.py):
+# максимальная сторона в пикселях, формат (jpeg или webp) и качество сжатия
+VISION_IMAGE_MAX_SIDE = int(os.getenv('VISION_IMAGE_MAX_SIDE', 1280))
+VISION_IMAGE_FORMAT = os.getenv('VISION_IMAGE_FORMAT', 'jpeg')
+VISION_IMAGE_QUALITY = int(os.getenv('VISION_IMAGE_QUALITY', 80))
+
+# Эталонные изображения товаров для сравнения (bot/apis/reference_images.py):
+# сторона миниатюры, сколько товаров держать в памяти и сколько секунд
+REFERENCE_IMAGE_MAX_SIDE = int(os.getenv('REFERENCE_IMAGE_MAX_SIDE', 512))
+REFERENCE_IMAGE_CACHE_SIZE = int(os.getenv('REFERENCE_IMAGE_CACHE_SIZE', 256))
+REFERENCE_IMAGE_CACHE_TTL = int(os.getenv('REFERENCE_IMAGE_CACHE_TTL', 600))
+
+# Локальный анализ скриншотов на OpenCV (bot/apis/local_vision.py): очевидные отказы
+# без запроса к модели. Когда модель недоступна, он работает в любом случае
+LOCAL_VISION_PREFILTER = os.getenv('LOCAL_VISION_PREFILTER', 'True') == 'True'
+
+# Хранилище состояний диалогов (bot/state.py): memory, db или file.
+# Для нескольких процессов за вебхуком нужен db или file.
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+# Время жизни состояния в секундах (0 - без ограничения)
+STATE_TTL = int(os.getenv('STATE_TTL', 86400))
+STATE_FILE_DIR = os.getenv('STATE_FILE_DIR', os.path.join(BASE_DIR, 'state'))
+
+# Логировать места вызова User.save() без update_fields (поиск полных сохранений)
+USER_SAVE_DEBUG = os.getenv('USER_SAVE_DEBUG', 'False') == 'True'
+
 # Application definition
 BOT_COMMANDS = [
     BotCommand("start", "Меню"),